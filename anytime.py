@@ -0,0 +1,80 @@
+import time
+import numpy as np
+from collections import namedtuple, Counter
+
+from searching import create_lexicon, check_impacts, DEFAULT_TOP_K
+from kernels import select_top_k_array
+
+# document_scores like searching.search, terminated_early tells whether the
+# postings budget or the deadline stopped the search before all postings of
+# the query terms were processed
+AnytimeResult = namedtuple('AnytimeResult', ['document_scores', 'terminated_early',
+                                             'processed_postings'])
+
+
+def anytime_search(number_of_documents, index, impacts, impact_order, search_terms,
+                   ranking_method, params={}, top_k=DEFAULT_TOP_K,
+                   max_postings=None, deadline_ms=None):
+    """Score-at-a-time search through the impact ordered postings of an index
+    (see indexing.create_impact_order) which returns the best ranking found
+    when it runs out of time
+
+    The segments of all query terms are processed in order of their score
+    contribution (impact times query term weight), highest first, so the
+    documents with the highest scores are found early. The search stops
+    before the segment which would exceed max_postings processed postings or
+    once deadline_ms milliseconds have passed since it started, whatever
+    happens first, and ranks the documents by their partial scores. Without
+    a budget, scores are the ones of searching.impact_search
+
+    Raises a ValueError if the impacts were not built for the given ranking
+    method and parameters. Returns an AnytimeResult
+    """
+    start = time.perf_counter()
+    deadline = start + deadline_ms / 1000 if deadline_ms is not None else None
+
+    check_impacts(impacts, ranking_method, params)
+
+    lexicon = create_lexicon(index)
+    segments = []
+
+    for term, tfq in Counter(search_terms).items():
+        token = lexicon.get(term)
+
+        if token is None:
+            continue
+
+        if ranking_method == 'bm25':
+            # query term weight, 1 for terms which occur once in the query
+            k3 = params.get('k3', 100)
+            query_weight = ((k3+1)*tfq)/(k3+tfq)
+        else:
+            query_weight = 1
+
+        for segment in impact_order.segments(token.position):
+            segments.append((segment.impact * query_weight, segment))
+
+    segments.sort(key=lambda entry: -entry[0])
+
+    scores = np.zeros(number_of_documents)
+    matched = np.zeros(number_of_documents, dtype=bool)
+    processed_postings = 0
+    terminated_early = False
+
+    for contribution, segment in segments:
+        if (max_postings is not None and
+                processed_postings + segment.number_of_postings > max_postings) or \
+                (deadline is not None and time.perf_counter() >= deadline):
+            terminated_early = True
+            break
+
+        # document ids are unique within a segment
+        document_ids = impact_order.document_ids(segment)
+        scores[document_ids] += contribution
+        matched[document_ids] = True
+
+        processed_postings += segment.number_of_postings
+
+    document_scores = select_top_k_array(scores / impacts.scale, matched, top_k)
+
+    return AnytimeResult(document_scores, terminated_early, processed_postings)
@@ -0,0 +1,242 @@
+import numpy as np
+
+# document ids are split into their high bits, which select a container,
+# and their low CONTAINER_BITS bits, which are stored in the container
+CONTAINER_BITS = 16
+CONTAINER_SIZE = 1 << CONTAINER_BITS
+
+# containers with more ids are stored as bitmaps, a bitmap container takes
+# 8 KiB, as much as an array container with 4096 uint16 ids
+ARRAY_CONTAINER_LIMIT = 4096
+
+ARRAY_DTYPE = np.dtype('<u2')
+BITMAP_DTYPE = np.dtype('<u8')
+BITMAP_WORDS = CONTAINER_SIZE // 64
+
+# bitmaps are packed with np.packbits, which stores the first bit of each
+# byte in its most significant bit, so low bit i of a container is bit
+# (i & 63) ^ 7 of its little endian word i >> 6
+BIT_ORDER_MASK = 7
+
+# intersect two sorted arrays by searching the elements of the shorter one
+# in the longer one if it is at least this many times longer
+SEARCH_RATIO = 32
+
+
+class RoaringBitmap:
+    """Compressed set of document ids, following Roaring bitmaps
+
+    See https://arxiv.org/abs/1402.6407
+
+    Ids are grouped by their high bits into containers of CONTAINER_SIZE
+    ids. Sparse containers are sorted uint16 arrays of the low bits, dense
+    containers (more than ARRAY_CONTAINER_LIMIT ids) are bitmaps of
+    BITMAP_WORDS uint64 words. Set operations work container by container
+    and pick the algorithm by container type: bitwise operations for two
+    bitmaps, bit tests for an array and a bitmap and merging (or binary
+    search, if one array is much shorter) for two arrays. Results are
+    converted to the smaller container type
+
+    Bitmaps are immutable, the operators &, | and - return new bitmaps
+    """
+
+    def __init__(self, containers=None):
+        # high bits -> container
+        self.containers = containers or {}
+
+    @staticmethod
+    def from_sorted(document_ids):
+        """Creates a bitmap from a sorted array of unique document ids
+        """
+        document_ids = np.asarray(document_ids, dtype=np.int64)
+        containers = {}
+
+        keys = document_ids >> CONTAINER_BITS
+        (unique_keys, starts) = np.unique(keys, return_index=True)
+        ends = np.append(starts[1:], len(document_ids))
+
+        for key, start, end in zip(unique_keys.tolist(), starts.tolist(), ends.tolist()):
+            lows = (document_ids[start:end] & (CONTAINER_SIZE - 1)).astype(ARRAY_DTYPE)
+            containers[key] = RoaringBitmap.__optimize(lows)
+
+        return RoaringBitmap(containers)
+
+    @staticmethod
+    def full(number_of_documents):
+        """Creates a bitmap which contains the ids 0 to number_of_documents - 1
+        """
+        return RoaringBitmap.from_sorted(np.arange(number_of_documents))
+
+    def to_array(self):
+        """Returns the document ids as a sorted numpy array
+        """
+        parts = [(key << CONTAINER_BITS) + self.__to_lows(container).astype(np.int64)
+                 for key, container in sorted(self.containers.items())]
+
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def contains(self, document_ids):
+        """Returns a boolean array which tells for each of the given document
+        ids whether it is part of the bitmap
+        """
+        document_ids = np.asarray(document_ids, dtype=np.int64)
+        result = np.zeros(len(document_ids), dtype=bool)
+        keys = document_ids >> CONTAINER_BITS
+
+        for key, container in self.containers.items():
+            selected = np.flatnonzero(keys == key)
+            lows = (document_ids[selected] & (CONTAINER_SIZE - 1)).astype(ARRAY_DTYPE)
+            result[selected] = RoaringBitmap.__contains(container, lows)
+
+        return result
+
+    def __and__(self, other):
+        containers = {}
+
+        for key in self.containers.keys() & other.containers.keys():
+            container = RoaringBitmap.__intersect(self.containers[key], other.containers[key])
+
+            if len(container):
+                containers[key] = container
+
+        return RoaringBitmap(containers)
+
+    def __or__(self, other):
+        containers = dict(self.containers)
+
+        for key, container in other.containers.items():
+            containers[key] = RoaringBitmap.__union(containers[key], container) \
+                if key in containers else container
+
+        return RoaringBitmap(containers)
+
+    def __sub__(self, other):
+        containers = {}
+
+        for key, container in self.containers.items():
+            if key in other.containers:
+                container = RoaringBitmap.__difference(container, other.containers[key])
+
+            if len(container):
+                containers[key] = container
+
+        return RoaringBitmap(containers)
+
+    def __len__(self):
+        return sum(RoaringBitmap.__cardinality(container)
+                   for container in self.containers.values())
+
+    def __eq__(self, other):
+        return np.array_equal(self.to_array(), other.to_array())
+
+    def __repr__(self):
+        bitmaps = sum(1 for container in self.containers.values()
+                      if container.dtype == BITMAP_DTYPE)
+
+        return '<RoaringBitmap {} ids, {} array and {} bitmap containers>'.format(
+            len(self), len(self.containers) - bitmaps, bitmaps)
+
+    @staticmethod
+    def __is_bitmap(container):
+        return container.dtype == BITMAP_DTYPE
+
+    @staticmethod
+    def __to_bits(container):
+        """Returns the container as a boolean array of CONTAINER_SIZE entries
+        """
+        if RoaringBitmap.__is_bitmap(container):
+            return np.unpackbits(container.view(np.uint8)).astype(bool)
+
+        bits = np.zeros(CONTAINER_SIZE, dtype=bool)
+        bits[container] = True
+        return bits
+
+    @staticmethod
+    def __from_bits(bits):
+        bitmap = np.packbits(bits).view(BITMAP_DTYPE)
+        return RoaringBitmap.__optimize_bitmap(bitmap)
+
+    @staticmethod
+    def __to_lows(container):
+        if RoaringBitmap.__is_bitmap(container):
+            return np.flatnonzero(RoaringBitmap.__to_bits(container)).astype(ARRAY_DTYPE)
+
+        return container
+
+    @staticmethod
+    def __cardinality(container):
+        if RoaringBitmap.__is_bitmap(container):
+            return int(np.unpackbits(container.view(np.uint8)).sum())
+
+        return len(container)
+
+    @staticmethod
+    def __optimize(lows):
+        """Returns the smaller container for the given sorted low bits
+        """
+        if len(lows) <= ARRAY_CONTAINER_LIMIT:
+            return lows
+
+        return np.packbits(RoaringBitmap.__to_bits(lows)).view(BITMAP_DTYPE)
+
+    @staticmethod
+    def __optimize_bitmap(bitmap):
+        if RoaringBitmap.__cardinality(bitmap) <= ARRAY_CONTAINER_LIMIT:
+            return RoaringBitmap.__to_lows(bitmap)
+
+        return bitmap
+
+    @staticmethod
+    def __contains(container, lows):
+        if RoaringBitmap.__is_bitmap(container):
+            words = container[lows >> 6]
+            shifts = ((lows & 63) ^ BIT_ORDER_MASK).astype(BITMAP_DTYPE)
+            return ((words >> shifts) & 1).astype(bool)
+
+        indices = np.searchsorted(container, lows)
+        found = indices < len(container)
+        found[found] = container[indices[found]] == lows[found]
+        return found
+
+    @staticmethod
+    def __intersect(a, b):
+        if RoaringBitmap.__is_bitmap(a) and RoaringBitmap.__is_bitmap(b):
+            return RoaringBitmap.__optimize_bitmap(a & b)
+
+        if RoaringBitmap.__is_bitmap(a):
+            return b[RoaringBitmap.__contains(a, b)]
+
+        if RoaringBitmap.__is_bitmap(b):
+            return a[RoaringBitmap.__contains(b, a)]
+
+        (shorter, longer) = (a, b) if len(a) <= len(b) else (b, a)
+
+        if len(shorter) * SEARCH_RATIO <= len(longer):
+            return shorter[RoaringBitmap.__contains(longer, shorter)]
+
+        return np.intersect1d(a, b, assume_unique=True)
+
+    @staticmethod
+    def __union(a, b):
+        if RoaringBitmap.__is_bitmap(a) and RoaringBitmap.__is_bitmap(b):
+            return a | b
+
+        if RoaringBitmap.__is_bitmap(a) or RoaringBitmap.__is_bitmap(b):
+            bits = RoaringBitmap.__to_bits(a) | RoaringBitmap.__to_bits(b)
+            return RoaringBitmap.__from_bits(bits)
+
+        return RoaringBitmap.__optimize(np.union1d(a, b).astype(ARRAY_DTYPE))
+
+    @staticmethod
+    def __difference(a, b):
+        if RoaringBitmap.__is_bitmap(a) and RoaringBitmap.__is_bitmap(b):
+            return RoaringBitmap.__optimize_bitmap(a & ~b)
+
+        if RoaringBitmap.__is_bitmap(a):
+            bits = RoaringBitmap.__to_bits(a) & ~RoaringBitmap.__to_bits(b)
+            return RoaringBitmap.__from_bits(bits)
+
+        if RoaringBitmap.__is_bitmap(b):
+            return a[~RoaringBitmap.__contains(b, a)]
+
+        return np.setdiff1d(a, b, assume_unique=True)
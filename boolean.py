@@ -0,0 +1,248 @@
+import re
+import numpy as np
+from collections import namedtuple
+from functools import reduce
+
+from bitmaps import RoaringBitmap
+from phrases import PHRASE_PATTERN, Phrase, match_phrase
+from postings import open_cursor, postings_arrays
+from preprocessing import split_words
+from searching import search, create_lexicon, create_filtered_lexicon, DEFAULT_TOP_K
+
+# parentheses, quoted phrases (optionally with a proximity window) and words
+QUERY_TOKEN_PATTERN = re.compile(r'\(|\)|"[^"]*"(?:~\d+)?|[^\s()"]+')
+
+OPERATORS = ['AND', 'OR', 'NOT']
+
+# a term which is intersected with candidates is looked up candidate by
+# candidate with a galloping posting cursor instead of decoding its whole
+# posting list if it has this many times more postings than candidates
+# (measured, both take about as long at a ratio of 200-250)
+GALLOP_RATIO = 256
+
+# operator is AND, OR or NOT, operands are queries, terms or phrases
+BooleanQuery = namedtuple('BooleanQuery', ['operator', 'operands'])
+
+
+def parse_boolean_query(query, preprocess,
+                        strip_html_tags=True,
+                        strip_html_entities=True,
+                        strip_square_bracket_tags=True):
+    """Parses a boolean query like 'drug AND NOT (cartel OR "money laundering")'
+
+    Operators are AND, OR and NOT (upper case), AND binds stronger than OR,
+    words without an operator in between are combined with AND. Words are
+    preprocessed, a word which is removed by preprocessing (a stop word) is
+    dropped from the query. Quoted phrases match like in phrases.py.
+    Returns a BooleanQuery, a term or a Phrase
+    """
+    def terms(text):
+        return preprocess(split_words(text,
+                                      strip_html_tags=strip_html_tags,
+                                      strip_html_entities=strip_html_entities,
+                                      strip_square_bracket_tags=strip_square_bracket_tags))
+
+    tokens = QUERY_TOKEN_PATTERN.findall(query)
+    (result, i) = __parse_or(tokens, 0, terms)
+
+    if i < len(tokens):
+        raise ValueError('Unexpected "{}" in boolean query'.format(tokens[i]))
+
+    if result is None:
+        raise ValueError('Boolean query "{}" contains no terms'.format(query))
+
+    return result
+
+
+def evaluate_boolean_query(number_of_documents, index, query, positions_table=None):
+    """Returns the ids of the documents matching the given boolean query (see
+    parse_boolean_query) as a bitmaps.RoaringBitmap. Phrases require the
+    positions of the index (see indexing.open_positions)
+
+    The operands of AND are intersected in order of their document
+    frequencies. Terms with many more postings than the remaining
+    candidates are not decoded, the candidates are looked up with a
+    galloping posting cursor instead, which skips over the blocks in between
+    """
+    return __evaluate(number_of_documents, create_lexicon(index), query, positions_table)
+
+
+def boolean_search(number_of_documents, index, document_stats, search_terms, query,
+                   ranking_method, params={}, top_k=DEFAULT_TOP_K,
+                   scoring_context=None, positions_table=None):
+    """Ranks the documents matching the given boolean query by the search
+    terms, see searching.search. Only the matching documents are scored,
+    their scores are the ones of the unfiltered search
+    """
+    lexicon = create_lexicon(index)
+    matches = __evaluate(number_of_documents, lexicon, query, positions_table)
+
+    return search(number_of_documents,
+                  create_filtered_lexicon(lexicon, search_terms, matches.contains),
+                  document_stats, search_terms, ranking_method, params,
+                  top_k=top_k, scoring_context=scoring_context)
+
+
+def __parse_or(tokens, i, terms):
+    (operand, i) = __parse_and(tokens, i, terms)
+    operands = [operand]
+
+    while i < len(tokens) and tokens[i] == 'OR':
+        (operand, i) = __parse_and(tokens, i + 1, terms)
+        operands.append(operand)
+
+    return (__combine('OR', operands), i)
+
+
+def __parse_and(tokens, i, terms):
+    (operand, i) = __parse_not(tokens, i, terms)
+    operands = [operand]
+
+    while i < len(tokens) and tokens[i] not in ['OR', ')']:
+        if tokens[i] == 'AND':
+            i += 1
+
+        (operand, i) = __parse_not(tokens, i, terms)
+        operands.append(operand)
+
+    return (__combine('AND', operands), i)
+
+
+def __parse_not(tokens, i, terms):
+    if i < len(tokens) and tokens[i] == 'NOT':
+        (operand, i) = __parse_not(tokens, i + 1, terms)
+        return (BooleanQuery('NOT', [operand]) if operand is not None else None, i)
+
+    if i >= len(tokens):
+        raise ValueError('Unexpected end of boolean query')
+
+    token = tokens[i]
+
+    if token == '(':
+        (operand, i) = __parse_or(tokens, i + 1, terms)
+
+        if i >= len(tokens) or tokens[i] != ')':
+            raise ValueError('Missing ")" in boolean query')
+
+        return (operand, i + 1)
+
+    if token == ')' or token in OPERATORS:
+        raise ValueError('Unexpected "{}" in boolean query'.format(token))
+
+    match = PHRASE_PATTERN.fullmatch(token)
+
+    if match:
+        phrase_terms = terms(match.group(1))
+        window = int(match.group(2)) if match.group(2) else None
+        return (Phrase(phrase_terms, window) if phrase_terms else None, i + 1)
+
+    return (__combine('AND', terms(token)), i + 1)
+
+
+def __combine(operator, operands):
+    """Drops empty operands, operators with a single operand are replaced by
+    the operand
+    """
+    operands = [operand for operand in operands if operand is not None]
+
+    if len(operands) <= 1:
+        return operands[0] if operands else None
+
+    return BooleanQuery(operator, operands)
+
+
+def __evaluate(number_of_documents, lexicon, query, positions_table):
+    if isinstance(query, str):
+        return __term_bitmap(lexicon, query)
+
+    if isinstance(query, Phrase):
+        if positions_table is None:
+            raise ValueError('Phrases require a positional index')
+
+        return RoaringBitmap.from_sorted(sorted(match_phrase(lexicon, positions_table, query)))
+
+    if query.operator == 'NOT':
+        return RoaringBitmap.full(number_of_documents) - \
+            __evaluate(number_of_documents, lexicon, query.operands[0], positions_table)
+
+    if query.operator == 'OR':
+        return reduce(lambda a, b: a | b,
+                      [__evaluate(number_of_documents, lexicon, operand, positions_table)
+                       for operand in query.operands])
+
+    return __evaluate_and(number_of_documents, lexicon, query.operands, positions_table)
+
+
+def __evaluate_and(number_of_documents, lexicon, operands, positions_table):
+    excluded = [operand.operands[0] for operand in operands
+                if isinstance(operand, BooleanQuery) and operand.operator == 'NOT']
+    included = [operand for operand in operands
+                if not (isinstance(operand, BooleanQuery) and operand.operator == 'NOT')]
+
+    tokens = []
+
+    for term in [operand for operand in included if isinstance(operand, str)]:
+        token = lexicon.get(term)
+
+        if token is None:
+            return RoaringBitmap()
+
+        tokens.append(token)
+
+    # operators and phrases first, then terms from the shortest posting list on
+    candidates = None
+
+    for operand in included:
+        if not isinstance(operand, str):
+            matches = __evaluate(number_of_documents, lexicon, operand, positions_table)
+            candidates = matches if candidates is None else candidates & matches
+
+    for token in sorted(tokens, key=lambda token: token.document_frequency):
+        if candidates is None:
+            candidates = RoaringBitmap.from_sorted(postings_arrays(token.postings)[0])
+        elif len(candidates) * GALLOP_RATIO < token.document_frequency:
+            candidates = __gallop_filter(candidates, lexicon, token.term, keep=True)
+        else:
+            candidates = candidates & RoaringBitmap.from_sorted(postings_arrays(token.postings)[0])
+
+    if candidates is None:
+        candidates = RoaringBitmap.full(number_of_documents)
+
+    for operand in excluded:
+        if isinstance(operand, str):
+            token = lexicon.get(operand)
+
+            if token is None:
+                continue
+
+            if len(candidates) * GALLOP_RATIO < token.document_frequency:
+                candidates = __gallop_filter(candidates, lexicon, operand, keep=False)
+                continue
+
+        candidates = candidates - __evaluate(number_of_documents, lexicon, operand,
+                                             positions_table)
+
+    return candidates
+
+
+def __gallop_filter(candidates, lexicon, term, keep):
+    """Keeps (or removes) the candidates which occur in the posting list of
+    the given term, looking them up in ascending order with a posting cursor
+    """
+    cursor = open_cursor(lexicon, term)
+    document_ids = candidates.to_array()
+
+    found = np.fromiter((cursor.advance(document_id) == document_id
+                         for document_id in document_ids.tolist()),
+                        dtype=bool, count=len(document_ids))
+
+    return RoaringBitmap.from_sorted(document_ids[found if keep else ~found])
+
+
+def __term_bitmap(lexicon, term):
+    token = lexicon.get(term)
+
+    if token is None:
+        return RoaringBitmap()
+
+    return RoaringBitmap.from_sorted(postings_arrays(token.postings)[0])
@@ -0,0 +1,326 @@
+import sys
+import heapq
+import threading
+from collections import OrderedDict, Counter
+
+from indexing import file_version
+from searching import search, DEFAULT_TOP_K
+
+# approximate size of a single (document_id, score) result tuple
+RESULT_BYTES = sys.getsizeof((0, 0.0)) + sys.getsizeof(2**40) + sys.getsizeof(0.0)
+
+# approximate size of a single decoded (document_id, term_frequency) posting
+# including its list slot, small term frequencies are shared int objects
+POSTING_BYTES = 8 + sys.getsizeof((0, 0)) + sys.getsizeof(2**20)
+
+# time of a lexicon lookup, measured in decoded postings
+LOOKUP_COST = 64
+
+
+class ResultCache:
+    """LRU cache for search results, bounded by the number of entries and
+    optionally by the (approximate) number of bytes of the cached results
+
+    Entries are keyed by the version of the index (see
+    indexing.file_version), the preprocessed search terms, the ranking
+    method, its parameters and top_k. All entries are dropped as soon as
+    the cache is used with a different index version. Safe to use from
+    multiple threads
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.counters = Counter()
+
+        self.__entries = OrderedDict()
+        self.__bytes = 0
+        self.__version = None
+        self.__lock = threading.Lock()
+
+    def get(self, version, search_terms, ranking_method, params={},
+            top_k=DEFAULT_TOP_K):
+        """Returns the cached results, None if they are not cached
+        """
+        key = cache_key(search_terms, ranking_method, params, top_k)
+
+        with self.__lock:
+            self.__check_version(version)
+
+            entry = self.__entries.get(key)
+
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+
+            self.__entries.move_to_end(key)
+            self.counters['hits'] += 1
+
+            return list(entry[0])
+
+    def put(self, version, search_terms, ranking_method, params, top_k,
+            document_scores):
+        """Caches the results, evicts the least recently used entries if the
+        cache is full
+        """
+        key = cache_key(search_terms, ranking_method, params, top_k)
+        size = sys.getsizeof(key) + sys.getsizeof(document_scores) + \
+            len(document_scores) * RESULT_BYTES
+
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        with self.__lock:
+            self.__check_version(version)
+
+            if key in self.__entries:
+                self.__bytes -= self.__entries.pop(key)[1]
+
+            self.__entries[key] = (tuple(document_scores), size)
+            self.__bytes += size
+
+            while len(self.__entries) > self.max_entries or \
+                    (self.max_bytes is not None and self.__bytes > self.max_bytes):
+                (_, (_, evicted_size)) = self.__entries.popitem(last=False)
+                self.__bytes -= evicted_size
+                self.counters['evictions'] += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def stats(self):
+        """Returns the hit/miss/eviction/invalidation counters along with the
+        current size of the cache
+        """
+        with self.__lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+
+            return {'hits': self.counters['hits'],
+                    'misses': self.counters['misses'],
+                    'hit_ratio': self.counters['hits'] / lookups if lookups else 0,
+                    'evictions': self.counters['evictions'],
+                    'invalidations': self.counters['invalidations'],
+                    'entries': len(self.__entries),
+                    'bytes': self.__bytes}
+
+    def __check_version(self, version):
+        if version != self.__version:
+            if self.__entries:
+                self.counters['invalidations'] += 1
+
+            self.__entries.clear()
+            self.__bytes = 0
+            self.__version = version
+
+
+def cache_key(search_terms, ranking_method, params, top_k):
+    """Key of a query, the order of the search terms does not matter but
+    their frequencies do (query term frequency of bm25)
+    """
+    return (tuple(sorted(Counter(search_terms).items())), ranking_method,
+            tuple(sorted(params.items())), top_k)
+
+
+def search_version(index, document_stats):
+    """Version of an index and its document stats opened from files
+    """
+    return (file_version(index.filepath),
+            file_version(document_stats.filepath) if document_stats is not None else None)
+
+
+def cached_search(cache, number_of_documents, index, document_stats, search_terms,
+                  ranking_method, params={}, top_k=DEFAULT_TOP_K, version=None,
+                  scoring_context=None):
+    """Like searching.search, but returns the results from the given
+    ResultCache if the query has been searched before on the same version of
+    the index. The version is determined from the index and stats files if
+    it is not given
+    """
+    if version is None:
+        version = search_version(index, document_stats)
+
+    document_scores = cache.get(version, search_terms, ranking_method, params, top_k)
+
+    if document_scores is None:
+        document_scores = search(number_of_documents, index, document_stats,
+                                 search_terms, ranking_method, params, top_k=top_k,
+                                 scoring_context=scoring_context)
+        cache.put(version, search_terms, ranking_method, params, top_k,
+                  document_scores)
+
+    return document_scores
+
+
+class PostingCache:
+    """Lexicon (see searching.create_lexicon) which keeps the decoded posting
+    lists of frequently used terms of the given index in memory, up to
+    max_bytes (approximately)
+
+    Eviction uses Greedy-Dual-Size-Frequency: each cached term has the
+    priority L + frequency * cost / size, where frequency is the number of
+    lookups since the term was cached, cost the work of looking the term up
+    and decoding its postings again and size the bytes held by the decoded
+    postings. The term with the lowest priority is evicted and its priority
+    becomes the new L, so terms which are no longer used age out. As both
+    cost and size grow with the number of postings, short posting lists are
+    only preferred because of their lookup costs
+
+    Other attributes (filepath, cursor, ...) are the ones of the index
+    """
+
+    def __init__(self, index, max_bytes=256 * 1024 * 1024):
+        self.index = index
+        self.max_bytes = max_bytes
+
+        self.counters = Counter()
+
+        self.__entries = {}
+        self.__heap = []
+        self.__inflation = 0
+        self.__bytes = 0
+        self.__lock = threading.Lock()
+
+    def get(self, term, default=None):
+        with self.__lock:
+            entry = self.__entries.get(term)
+
+            if entry is not None:
+                self.counters['hits'] += 1
+
+                entry[2] += 1
+                self.__update_priority(term, entry)
+
+                return entry[0]
+
+            self.counters['misses'] += 1
+
+        token = self.index.get(term)
+
+        if token is None:
+            return default
+
+        return self.__insert(token)
+
+    def prewarm(self, terms):
+        """Loads the posting lists of the given terms (most important first)
+        until the cache is full. Returns the number of cached terms
+        """
+        number_of_terms = 0
+
+        for term in terms:
+            token = self.index.get(term)
+
+            if token is None:
+                continue
+
+            if self.__bytes + len(token.postings) * POSTING_BYTES > self.max_bytes:
+                break
+
+            self.__insert(token)
+            number_of_terms += 1
+
+        return number_of_terms
+
+    def stats(self):
+        """Returns the hit/miss/eviction counters along with the number of
+        cached terms and the bytes held
+        """
+        with self.__lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+
+            return {'hits': self.counters['hits'],
+                    'misses': self.counters['misses'],
+                    'hit_ratio': self.counters['hits'] / lookups if lookups else 0,
+                    'evictions': self.counters['evictions'],
+                    'terms': len(self.__entries),
+                    'bytes': self.__bytes}
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    def __contains__(self, term):
+        return term in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __insert(self, token):
+        # decode outside of the lock, the token is shared by all lookups
+        size = len(token.postings) * POSTING_BYTES
+
+        if size > self.max_bytes:
+            return token
+
+        list(token.postings)
+
+        with self.__lock:
+            if token.term in self.__entries:
+                return self.__entries[token.term][0]
+
+            while self.__bytes + size > self.max_bytes:
+                self.__evict()
+
+            # token, size, frequency, priority
+            entry = [token, size, 1, 0]
+            self.__entries[token.term] = entry
+            self.__bytes += size
+            self.__update_priority(token.term, entry)
+
+            return token
+
+    def __update_priority(self, term, entry):
+        (token, size, frequency, _) = entry
+
+        cost = LOOKUP_COST + len(token.postings)
+
+        entry[3] = self.__inflation + frequency * cost / max(1, size)
+        heapq.heappush(self.__heap, (entry[3], term))
+
+        # drop outdated heap entries once they make up most of the heap
+        if len(self.__heap) > 2 * len(self.__entries) + 64:
+            self.__heap = [(cached[3], cached_term)
+                           for cached_term, cached in self.__entries.items()]
+            heapq.heapify(self.__heap)
+
+    def __evict(self):
+        while True:
+            (priority, term) = heapq.heappop(self.__heap)
+            entry = self.__entries.get(term)
+
+            # skip heap entries of evicted terms and outdated priorities
+            if entry is not None and entry[3] == priority:
+                break
+
+        del self.__entries[term]
+        self.__bytes -= entry[1]
+        self.__inflation = priority
+        self.counters['evictions'] += 1
+
+
+def frequent_query_terms(queries):
+    """Returns the terms of the given (preprocessed) queries ordered by the
+    number of queries they occur in, to prewarm a PostingCache from a query
+    log
+    """
+    counter = Counter()
+
+    for search_terms in queries:
+        counter.update(set(search_terms))
+
+    return [term for term, _ in counter.most_common()]
+
+
+def highest_document_frequency_terms(index, number_of_terms):
+    """Returns the number_of_terms terms of the index with the longest
+    posting lists, to prewarm a PostingCache
+    """
+    entries = heapq.nlargest(number_of_terms, index.entries(),
+                             key=lambda entry: entry[1])
+
+    return [term for term, _, _ in entries]
@@ -0,0 +1,870 @@
+from preprocessing import create_preprocessor
+from indexing import create_index_spimi, create_champions, open_champions, open_impact_order, \
+    load_impacts, \
+    open_index, open_docnos, open_positions, create_index_reader, \
+    load_document_stats, load_bounds, IndexWriter, MappedIndex, Token, LEXICON_SUFFIX, \
+    POSITIONS_SUFFIX
+from compression import encode_postings, decode_postings
+from searching import create_lexicon, search, batch_search, create_scoring_context, \
+    impact_search
+from sharding import ShardedIndex
+from pruning import top_k_search, PRUNING_ALGORITHMS
+from kernels import numpy_search
+from caching import PostingCache
+from phrases import match_phrase, Phrase
+from boolean import evaluate_boolean_query, boolean_search, BooleanQuery
+from tiers import tiered_search
+from anytime import anytime_search
+import numpy as np
+from collections import Counter, defaultdict
+from evaluation import load_topic_tokens, load_qrels, mean_average_precision
+import os
+import glob
+import nltk
+import random
+import tempfile
+import time
+import tracemalloc
+import click
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--index_file', required=True, type=click.Path(exists=True),
+              help='Path to index file')
+def compression(index_file):
+    """Compares size and decoding speed of the compressed posting lists
+    against the former text-based index format
+    """
+    number_of_documents, index = open_index(index_file)
+    docnos = open_docnos(index_file)
+
+    text_size = 0
+    text_decode_time = 0
+    compressed_size = os.path.getsize(index_file + LEXICON_SUFFIX)
+    compressed_decode_time = 0
+
+    click.echo(f'Comparing posting list encodings of {len(index)} terms')
+
+    for term, document_frequency, data in index.entries():
+        postings = decode_postings(data, document_frequency)
+
+        # '<TERM>\t<DOCUMENT_FREQUENCY>\t<DOCUMENT_ID>|<TERM_FREQUENCY>,...'
+        text_postings = ','.join(['{}|{}'.format(docnos[document_id], term_frequency)
+                                  for document_id, term_frequency in postings])
+        line = '{}\t{}\t{}\n'.format(term, document_frequency, text_postings)
+        text_size += len(line.encode('utf-8'))
+
+        start = time.perf_counter()
+        parts = line.split('\t')
+        text_decoded = [(p[0], int(p[1])) for p in
+                        (e.split('|') for e in parts[2].split(','))]
+        text_decode_time += time.perf_counter() - start
+
+        encoded = encode_postings(postings)
+        compressed_size += len(encoded)
+
+        start = time.perf_counter()
+        decoded = decode_postings(encoded, document_frequency)
+        compressed_decode_time += time.perf_counter() - start
+
+        if decoded != postings or len(text_decoded) != len(postings):
+            raise click.ClickException(f'Round trip failed for term "{term}"')
+
+    click.echo('Round trip ok')
+    click.echo(f'Text:       {text_size} bytes, decoded in {text_decode_time:.3f} seconds')
+    click.echo(f'Compressed: {compressed_size} bytes, decoded in {compressed_decode_time:.3f} seconds')
+    click.echo(f'Ratio:      {text_size / compressed_size:.2f}x smaller, '
+               f'{text_decode_time / compressed_decode_time:.2f}x decoding speed')
+
+
+@cli.command()
+@click.option('--index_file', required=True, type=click.Path(exists=True),
+              help='Path to index file')
+@click.option('--num_queries', default=100, show_default=True,
+              help='Number of random queries to look up')
+@click.option('--terms_per_query', default=5, show_default=True,
+              help='Number of terms per query')
+def lexicon(index_file, num_queries, terms_per_query):
+    """Compares the per-query term lookup cost of a linear scan over the
+    token list, the in-memory hash lexicon and the front-coded on-disk
+    lexicon for growing vocabulary sizes
+    """
+    number_of_documents, index = open_index(index_file)
+    entries = list(index.entries())
+
+    click.echo('Vocabulary\tLinear (us)\tHash (us)\tOn-disk (us)')
+
+    for fraction in [0.125, 0.25, 0.5, 1.0]:
+        subset = entries[:max(terms_per_query, int(len(entries) * fraction))]
+
+        random.seed(42)
+        queries = [[term for term, _, _ in random.sample(subset, terms_per_query)]
+                   for _ in range(num_queries)]
+
+        tokens = [Token(i, term, document_frequency, [])
+                  for i, (term, document_frequency, _) in enumerate(subset)]
+
+        start = time.perf_counter()
+        for query in queries:
+            __linear_scan(tokens, query)
+        linear_time = time.perf_counter() - start
+
+        hash_lexicon = create_lexicon(tokens)
+
+        start = time.perf_counter()
+        for query in queries:
+            [term in hash_lexicon for term in query]
+        hash_time = time.perf_counter() - start
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = os.path.join(tmp_dir, 'subset.index')
+
+            with IndexWriter(filepath, number_of_documents) as index_writer:
+                for term, document_frequency, data in subset:
+                    index_writer.write_encoded(term, document_frequency, data)
+
+            subset_index = MappedIndex(filepath)
+
+            start = time.perf_counter()
+            for query in queries:
+                [term in subset_index for term in query]
+            disk_time = time.perf_counter() - start
+
+            subset_index.close()
+
+        click.echo('{}\t\t{:.1f}\t\t{:.1f}\t\t{:.1f}'.format(
+            len(subset), linear_time / num_queries * 1e6,
+            hash_time / num_queries * 1e6, disk_time / num_queries * 1e6))
+
+
+@cli.command()
+@click.option('--index_file', required=True, type=click.Path(exists=True),
+              help='Path to index file')
+def reader(index_file):
+    """Compares time and peak memory of loading all tokens of the index via
+    create_index_reader with lazy and with eager posting decoding
+    """
+    click.echo('Mode\tSeconds\tPeak memory (MB)')
+
+    for mode in ['lazy', 'eager']:
+        tracemalloc.start()
+        start = time.perf_counter()
+
+        number_of_documents, index_reader = create_index_reader(index_file)
+        tokens = list(index_reader())
+
+        if mode == 'eager':
+            for token in tokens:
+                token.postings[0]
+
+        duration = time.perf_counter() - start
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        click.echo(f'{mode}\t{duration:.3f}\t{peak / 1024 / 1024:.1f}')
+
+        del tokens
+
+
+@cli.command()
+@click.option('--index_file', required=True, type=click.Path(exists=True),
+              help='Path to index file, created with cmd_index.py --num_shards')
+@click.option('--stats_file', required=True, type=click.Path(exists=True),
+              help='Path to document stats file')
+@click.option('--topics_file', required=True, type=click.Path(exists=True),
+              help='Path to a file containing search topics')
+def shards(index_file, stats_file, topics_file):
+    """Checks that searching the shards of an index yields exactly the same
+    rankings as searching the whole index and compares the search times
+    """
+    topics = load_topic_tokens(topics_file)
+    document_stats = load_document_stats(stats_file)
+    number_of_documents, index = open_index(index_file)
+    sharded_index = ShardedIndex(index_file)
+
+    methods = [('tfidf', {}), ('cosine_tfidf', {}),
+               ('bm25', {'k1': 1.2, 'b': 0.75, 'k3': 8.0}),
+               ('bm25va', {'k1': 1.2, 'k3': 8.0})]
+
+    click.echo('Method\t\tSingle (s)\tSharded (s)')
+
+    for ranking_method, params in methods:
+        single_time = 0
+        sharded_time = 0
+
+        for topic in topics:
+            search_terms = topic.title | topic.desc
+
+            start = time.perf_counter()
+            expected = search(number_of_documents, index, document_stats,
+                              search_terms, ranking_method, params)
+            single_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            actual = sharded_index.search(search_terms, ranking_method, params)
+            sharded_time += time.perf_counter() - start
+
+            if actual != expected:
+                raise click.ClickException(
+                    f'Sharded ranking of topic {topic.id} differs for {ranking_method}')
+
+        click.echo(f'{ranking_method:<12}\t{single_time:.3f}\t\t{sharded_time:.3f}')
+
+    click.echo('Rankings identical')
+    sharded_index.close()
+
+
+@cli.command()
+@click.option('--index_file', required=True, type=click.Path(exists=True),
+              help='Path to index file')
+@click.option('--stats_file', required=True, type=click.Path(exists=True),
+              help='Path to document stats file')
+@click.option('--topics_file', required=True, type=click.Path(exists=True),
+              help='Path to a file containing search topics')
+@click.option('--top_k', default=1000, show_default=True,
+              help='Number of documents retrieved per topic')
+def pruning(index_file, stats_file, topics_file, top_k):
+    """Compares the number of scored postings and the search time of WAND and
+    MaxScore against the exhaustive search and checks that the top k
+    documents are identical
+    """
+    topics = load_topic_tokens(topics_file)
+    document_stats = load_document_stats(stats_file)
+    number_of_documents, index = open_index(index_file)
+    bounds = load_bounds(index_file)
+
+    methods = [('tfidf', {}), ('bm25', {'k1': 1.2, 'b': 0.75, 'k3': 8.0})]
+
+    click.echo('Method\tAlgorithm\tScored postings\tSeconds')
+
+    for ranking_method, params in methods:
+        expected = {}
+        postings = 0
+
+        start = time.perf_counter()
+        for topic in topics:
+            search_terms = topic.title | topic.desc
+            expected[topic.id] = search(number_of_documents, index, document_stats,
+                                        search_terms, ranking_method, params)[:top_k]
+            postings += sum([token.document_frequency for token
+                             in [index.get(term) for term in search_terms] if token])
+        exhaustive_time = time.perf_counter() - start
+
+        click.echo(f'{ranking_method}\t{"exhaustive":<10}\t{postings} (100.0%)\t{exhaustive_time:.3f}')
+
+        for algorithm in PRUNING_ALGORITHMS:
+            counters = Counter()
+
+            start = time.perf_counter()
+            for topic in topics:
+                document_scores = top_k_search(number_of_documents, index, bounds,
+                                               topic.title | topic.desc, ranking_method,
+                                               document_stats, params, top_k,
+                                               algorithm, counters)
+
+                if document_scores != expected[topic.id]:
+                    raise click.ClickException(
+                        f'{algorithm} top {top_k} of topic {topic.id} differs for {ranking_method}')
+            duration = time.perf_counter() - start
+
+            scored_postings = counters['scored_postings']
+            click.echo(f'{ranking_method}\t{algorithm:<10}\t{scored_postings} '
+                       f'({scored_postings / postings * 100:.1f}%)\t{duration:.3f}')
+
+    click.echo('Top k identical')
+
+
+@cli.command()
+@click.option('--index_file', required=True, type=click.Path(exists=True),
+              help='Path to index file')
+@click.option('--stats_file', required=True, type=click.Path(exists=True),
+              help='Path to document stats file')
+@click.option('--topics_file', required=True, type=click.Path(exists=True),
+              help='Path to a file containing search topics')
+@click.option('--top_k', default=1000, show_default=True,
+              help='Number of documents retrieved per topic')
+def kernels(index_file, stats_file, topics_file, top_k):
+    """Compares the search time of the numpy scoring kernels against the
+    pure python scorers and checks that the scores match
+    """
+    topics = load_topic_tokens(topics_file)
+    document_stats = load_document_stats(stats_file)
+    number_of_documents, index = open_index(index_file)
+
+    methods = [('tfidf', {}), ('cosine_tfidf', {}),
+               ('bm25', {'k1': 1.2, 'b': 0.75, 'k3': 8.0}),
+               ('bm25va', {'k1': 1.2, 'k3': 8.0})]
+
+    click.echo('Method\t\tPython (s)\tNumpy (s)\tSpeedup\tReordered ties')
+
+    for ranking_method, params in methods:
+        python_time = 0
+        numpy_time = 0
+        reordered = 0
+
+        for topic in topics:
+            search_terms = topic.title | topic.desc
+
+            start = time.perf_counter()
+            expected = search(number_of_documents, index, document_stats,
+                              search_terms, ranking_method, params, top_k=top_k)
+            python_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            actual = numpy_search(number_of_documents, index, document_stats,
+                                  search_terms, ranking_method, params, top_k=top_k)
+            numpy_time += time.perf_counter() - start
+
+            if len(actual) != len(expected) or \
+                    not np.allclose([s for _, s in actual], [s for _, s in expected],
+                                    rtol=1e-9, atol=1e-12):
+                raise click.ClickException(
+                    f'Numpy scores of topic {topic.id} differ for {ranking_method}')
+
+            # documents with (almost) equal scores may swap places
+            reordered += len([1 for a, e in zip(actual, expected) if a[0] != e[0]])
+
+        click.echo(f'{ranking_method:<12}\t{python_time:.3f}\t\t{numpy_time:.3f}\t\t'
+                   f'{python_time / numpy_time:.1f}x\t{reordered}')
+
+    click.echo('Scores match')
+
+
+@cli.command()
+@click.option('--index_file', required=True, type=click.Path(exists=True),
+              help='Path to index file')
+@click.option('--stats_file', required=True, type=click.Path(exists=True),
+              help='Path to document stats file')
+@click.option('--topics_file', required=True, type=click.Path(exists=True),
+              help='Path to a file containing search topics')
+@click.option('--top_k', default=1000, show_default=True,
+              help='Number of documents retrieved per topic')
+def batch(index_file, stats_file, topics_file, top_k):
+    """Compares searching the topics one by one against searching them as a
+    batch and checks that the rankings are identical
+    """
+    topics = load_topic_tokens(topics_file)
+    document_stats = load_document_stats(stats_file)
+    number_of_documents, index = open_index(index_file)
+
+    queries = [topic.title | topic.desc for topic in topics]
+
+    query_terms = sum([len([term for term in query if index.get(term) is not None])
+                       for query in queries])
+    unique_terms = len([term for term in set().union(*queries) if index.get(term) is not None])
+
+    click.echo(f'{len(queries)} topics, {query_terms} posting lists decoded one by one, '
+               f'{unique_terms} decoded as a batch')
+
+    methods = [('tfidf', {}), ('cosine_tfidf', {}),
+               ('bm25', {'k1': 1.2, 'b': 0.75, 'k3': 8.0}),
+               ('bm25va', {'k1': 1.2, 'k3': 8.0})]
+
+    click.echo('Method\t\tOne by one (s)\tBatch (s)\tSpeedup')
+
+    for ranking_method, params in methods:
+        start = time.perf_counter()
+        expected = [search(number_of_documents, index, document_stats, query,
+                           ranking_method, params, top_k=top_k)
+                    for query in queries]
+        single_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = batch_search(number_of_documents, index, document_stats, queries,
+                              ranking_method, params, top_k=top_k)
+        batch_time = time.perf_counter() - start
+
+        if actual != expected:
+            raise click.ClickException(f'Batch rankings differ for {ranking_method}')
+
+        click.echo(f'{ranking_method:<12}\t{single_time:.3f}\t\t{batch_time:.3f}\t\t'
+                   f'{single_time / batch_time:.1f}x')
+
+    click.echo('Rankings are identical')
+
+
+@cli.command()
+@click.option('--index_file', required=True, type=click.Path(exists=True),
+              help='Path to index file')
+@click.option('--stats_file', required=True, type=click.Path(exists=True),
+              help='Path to document stats file')
+@click.option('--topics_file', required=True, type=click.Path(exists=True),
+              help='Path to a file containing search topics')
+@click.option('--megabytes', default=[1.0, 8.0, 64.0], type=float, multiple=True,
+              show_default=True,
+              help='Memory budgets of the posting cache (can be repeated)')
+@click.option('--top_k', default=1000, show_default=True,
+              help='Number of documents retrieved per topic')
+def posting_cache(index_file, stats_file, topics_file, megabytes, top_k):
+    """Searches all topics with bm25 with and without the posting cache and
+    reports search times and cache stats
+    """
+    topics = load_topic_tokens(topics_file)
+    document_stats = load_document_stats(stats_file)
+    number_of_documents, index = open_index(index_file)
+
+    params = {'k1': 1.2, 'b': 0.75, 'k3': 8.0}
+    queries = [topic.title | topic.desc for topic in topics]
+
+    start = time.perf_counter()
+    expected = [search(number_of_documents, index, document_stats, query,
+                       'bm25', params, top_k=top_k) for query in queries]
+    click.echo(f'No cache: {time.perf_counter() - start:.3f}s')
+
+    click.echo('Budget (MB)\tTime (s)\tHit ratio\tEvictions\tTerms\tBytes')
+
+    for budget in megabytes:
+        cached_index = PostingCache(index, int(budget * 1024 * 1024))
+
+        start = time.perf_counter()
+        actual = [search(number_of_documents, cached_index, document_stats, query,
+                         'bm25', params, top_k=top_k) for query in queries]
+        elapsed = time.perf_counter() - start
+
+        if actual != expected:
+            raise click.ClickException(f'Rankings differ with a {budget} MB posting cache')
+
+        stats = cached_index.stats()
+        click.echo(f'{budget:<8}\t{elapsed:.3f}\t\t{stats["hit_ratio"]:.3f}\t\t'
+                   f'{stats["evictions"]}\t\t{stats["terms"]}\t{stats["bytes"]}')
+
+
+@cli.command()
+@click.option('--index_file', required=True, type=click.Path(exists=True),
+              help='Path to index file')
+@click.option('--stats_file', required=True, type=click.Path(exists=True),
+              help='Path to document stats file')
+@click.option('--topics_file', required=True, type=click.Path(exists=True),
+              help='Path to a file containing search topics')
+@click.option('--top_k', default=1000, show_default=True,
+              help='Number of documents retrieved per topic')
+def scoring_context(index_file, stats_file, topics_file, top_k):
+    """Compares the bm25 and bm25va search times with and without a
+    precomputed scoring context and checks that the rankings are identical
+    """
+    topics = load_topic_tokens(topics_file)
+    document_stats = load_document_stats(stats_file)
+    number_of_documents, index = open_index(index_file)
+
+    queries = [topic.title | topic.desc for topic in topics]
+    methods = [('bm25', {'k1': 1.2, 'b': 0.75, 'k3': 8.0}),
+               ('bm25va', {'k1': 1.2, 'k3': 8.0})]
+
+    click.echo('Method\tContext (s)\tWithout (ms/query)\tWith (ms/query)\tSpeedup')
+
+    for ranking_method, params in methods:
+        start = time.perf_counter()
+        context = create_scoring_context(document_stats, ranking_method, params)
+        context_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        expected = [search(number_of_documents, index, document_stats, query,
+                           ranking_method, params, top_k=top_k) for query in queries]
+        without_time = (time.perf_counter() - start) * 1000 / len(queries)
+
+        start = time.perf_counter()
+        actual = [search(number_of_documents, index, document_stats, query,
+                         ranking_method, params, top_k=top_k, scoring_context=context)
+                  for query in queries]
+        with_time = (time.perf_counter() - start) * 1000 / len(queries)
+
+        if actual != expected:
+            raise click.ClickException(f'Rankings differ for {ranking_method}')
+
+        click.echo(f'{ranking_method}\t{context_time:.3f}\t\t{without_time:.2f}\t\t\t'
+                   f'{with_time:.2f}\t\t{without_time / with_time:.1f}x')
+
+    click.echo('Rankings are identical')
+
+
+@cli.command()
+@click.option('--index_file', required=True, type=click.Path(exists=True),
+              help='Path to a positional index file')
+@click.option('--num_queries', default=100, show_default=True,
+              help='Number of phrases, taken from random documents')
+@click.option('--phrase_length', default=2, show_default=True,
+              help='Number of terms per phrase')
+def phrases(index_file, num_queries, phrase_length):
+    """Compares phrase and proximity matching, which only decodes the
+    positions of candidate documents, against decoding the complete position
+    lists of the phrase terms and checks that the matches are identical
+    """
+    number_of_documents, index = open_index(index_file)
+    positions_table = open_positions(index_file)
+
+    postings_size = os.path.getsize(index_file)
+    positions_size = os.path.getsize(index_file + POSITIONS_SUFFIX)
+    click.echo(f'Positions: {positions_size} bytes ({positions_size / postings_size:.2f}x the postings)')
+
+    random.seed(0)
+    sample = np.array(sorted(random.sample(range(number_of_documents),
+                                           min(num_queries, number_of_documents))))
+
+    # reconstruct the term sequences of the sampled documents
+    sequences = defaultdict(dict)
+
+    for token in index:
+        (document_ids, term_frequencies) = token.postings.arrays()
+        posting_indices = np.flatnonzero(np.isin(document_ids, sample))
+
+        for i, positions in zip(posting_indices,
+                                positions_table.positions(token, posting_indices, term_frequencies)):
+            for position in positions.tolist():
+                sequences[int(document_ids[i])][position] = token.term
+
+    queries = []
+
+    for document_id in sample.tolist():
+        terms = [term for _, term in sorted(sequences[document_id].items())]
+
+        if len(terms) >= phrase_length:
+            start = random.randrange(len(terms) - phrase_length + 1)
+            queries.append(terms[start:start + phrase_length])
+
+    click.echo(f'{len(queries)} phrases of {phrase_length} terms')
+    click.echo('Query\t\tCandidates (ms/query)\tFull lists (ms/query)\tSpeedup')
+
+    for name, window in [('phrase', None), ('proximity', phrase_length + 3)]:
+        phrase_queries = [Phrase(terms, window) for terms in queries]
+
+        start = time.perf_counter()
+        expected = [match_phrase(index, __FullPositionsTable(positions_table), phrase)
+                    for phrase in phrase_queries]
+        full_time = (time.perf_counter() - start) * 1000 / len(queries)
+
+        start = time.perf_counter()
+        actual = [match_phrase(index, positions_table, phrase) for phrase in phrase_queries]
+        candidates_time = (time.perf_counter() - start) * 1000 / len(queries)
+
+        if actual != expected:
+            raise click.ClickException(f'Matches differ for {name} queries')
+
+        click.echo(f'{name:<10}\t{candidates_time:.3f}\t\t\t{full_time:.3f}\t\t\t'
+                   f'{full_time / candidates_time:.1f}x')
+
+    click.echo('Matches are identical')
+
+
+@cli.command()
+@click.option('--index_file', required=True, type=click.Path(exists=True),
+              help='Path to index file')
+@click.option('--stats_file', required=True, type=click.Path(exists=True),
+              help='Path to document stats file')
+@click.option('--topics_file', required=True, type=click.Path(exists=True),
+              help='Path to a file containing search topics')
+@click.option('--top_k', default=1000, show_default=True,
+              help='Number of documents retrieved per topic')
+def boolean(index_file, stats_file, topics_file, top_k):
+    """Compares boolean filters evaluated with bitmap containers and
+    galloping cursors against python sets of the decoded posting lists, and
+    filtered bm25 searches against filtering the full rankings. Filters
+    combine the rarest and the most frequent term of each topic with a
+    third one, the results have to be identical
+    """
+    topics = load_topic_tokens(topics_file)
+    document_stats = load_document_stats(stats_file)
+    number_of_documents, index = open_index(index_file)
+    params = {'k1': 1.2, 'b': 0.75, 'k3': 8.0}
+
+    queries = []
+
+    for topic in topics:
+        terms = sorted((term for term in topic.title | topic.desc if term in index),
+                       key=lambda term: index.get(term).document_frequency)
+
+        if len(terms) >= 3:
+            queries.append((sorted(topic.title | topic.desc), terms))
+
+    filters = [('a AND z', lambda t: BooleanQuery('AND', [t[0], t[-1]])),
+               ('z AND NOT b', lambda t: BooleanQuery('AND', [t[-1], BooleanQuery('NOT', [t[1]])])),
+               ('(a OR b) AND z', lambda t: BooleanQuery('AND', [BooleanQuery('OR', t[:2]), t[-1]]))]
+
+    click.echo(f'{len(queries)} topics, terms a, b, ... ordered by document frequency, z is the most frequent one')
+    click.echo('Filter\t\tBitmaps (ms)\tSets (ms)\tFiltered search (ms)\tFull search (ms)')
+
+    for name, create_filter in filters:
+        boolean_queries = [create_filter(terms) for _, terms in queries]
+
+        start = time.perf_counter()
+        expected = [__set_evaluate(number_of_documents, index, query) for query in boolean_queries]
+        sets_time = (time.perf_counter() - start) * 1000 / len(queries)
+
+        start = time.perf_counter()
+        actual = [evaluate_boolean_query(number_of_documents, index, query)
+                  for query in boolean_queries]
+        bitmaps_time = (time.perf_counter() - start) * 1000 / len(queries)
+
+        if [set(matches.to_array().tolist()) for matches in actual] != expected:
+            raise click.ClickException(f'Matches differ for {name}')
+
+        start = time.perf_counter()
+        expected = []
+
+        for (search_terms, _), matches in zip(queries, actual):
+            accepted = set(matches.to_array().tolist())
+            document_scores = search(number_of_documents, index, document_stats, search_terms,
+                                     'bm25', params, top_k=None)
+            expected.append([document_score for document_score in document_scores
+                             if document_score[0] in accepted][:top_k])
+
+        full_time = (time.perf_counter() - start) * 1000 / len(queries)
+
+        start = time.perf_counter()
+        filtered = [boolean_search(number_of_documents, index, document_stats, search_terms,
+                                   query, 'bm25', params, top_k=top_k)
+                    for (search_terms, _), query in zip(queries, boolean_queries)]
+        filtered_time = (time.perf_counter() - start) * 1000 / len(queries)
+
+        if filtered != expected:
+            raise click.ClickException(f'Rankings differ for {name}')
+
+        click.echo(f'{name:<16}{bitmaps_time:.2f}\t\t{sets_time:.2f}\t\t'
+                   f'{filtered_time:.2f}\t\t\t{full_time:.2f}')
+
+    click.echo('Matches and rankings are identical')
+
+
+def __set_evaluate(number_of_documents, index, query):
+    """Evaluates a boolean query with python sets of document ids
+    """
+    if isinstance(query, str):
+        token = index.get(query)
+        return {document_id for document_id, _ in token.postings} if token else set()
+
+    operands = [__set_evaluate(number_of_documents, index, operand) for operand in query.operands]
+
+    if query.operator == 'NOT':
+        return set(range(number_of_documents)) - operands[0]
+
+    if query.operator == 'OR':
+        return set.union(*operands)
+
+    return set.intersection(*operands)
+
+
+@cli.command()
+@click.option('--document_folder', required=True, type=click.Path(exists=True),
+              help='Path to the documents which are indexed')
+@click.option('--enable_lemmatizer/--disable_lemmatizer', default=False, show_default=True,
+              help='Enable/Disable lemmatizer')
+@click.option('--cache_entries', default=100000, show_default=True,
+              help='Maximum number of words remembered by the cached preprocessor')
+def preprocessing(document_folder, enable_lemmatizer, cache_entries):
+    """Compares the indexing throughput (spimi) of a preprocessor which
+    remembers the terms of the words against one which preprocesses every
+    word occurrence. Both indexes have to be identical
+    """
+    if enable_lemmatizer:
+        nltk.download('wordnet')
+
+    document_files = [fname for fname in glob.glob(document_folder + '/**', recursive=True)
+                      if os.path.isfile(fname)]
+
+    click.echo('Preprocessor\tIndexing (s)\tHit ratio\tCached words')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index_files = []
+
+        for name, entries in [('uncached', 0), ('cached', cache_entries)]:
+            preprocess = create_preprocessor(enable_lemmatizer=enable_lemmatizer,
+                                             cache_entries=entries)
+            index_file = os.path.join(tmp_dir, name + '.index')
+
+            start = time.perf_counter()
+            create_index_spimi(document_files, preprocess, index_file,
+                               os.path.join(tmp_dir, name + '.stats'), verbose=False)
+            elapsed = time.perf_counter() - start
+
+            stats = preprocess.stats()
+            click.echo(f'{name:<16}{elapsed:.2f}\t\t{stats["hit_ratio"]:.3f}\t\t{stats["words"]}')
+
+            index_files.append(index_file)
+
+        for suffix in ['', LEXICON_SUFFIX]:
+            with open(index_files[0] + suffix, 'rb') as a, open(index_files[1] + suffix, 'rb') as b:
+                if a.read() != b.read():
+                    raise click.ClickException('Indexes differ')
+
+    click.echo('Indexes are identical')
+
+
+@cli.command()
+@click.option('--index_file', required=True, type=click.Path(exists=True),
+              help='Path to index file')
+@click.option('--stats_file', required=True, type=click.Path(exists=True),
+              help='Path to document stats file')
+@click.option('--topics_file', required=True, type=click.Path(exists=True),
+              help='Path to a file containing search topics')
+@click.option('--qrels_file', type=click.Path(exists=True),
+              help='Path to the relevance judgements of the topics, to compare MAP')
+@click.option('--sizes', default='100,500,2000', show_default=True,
+              help='Comma separated champion list sizes')
+@click.option('--top_k', default=1000, show_default=True,
+              help='Number of documents retrieved per topic')
+def tiers(index_file, stats_file, topics_file, qrels_file, sizes, top_k):
+    """Compares bm25 searches of the champion lists (falling back to the
+    whole index if they hold less than top_k documents) of different sizes
+    against the exhaustive search: time per topic, scored candidates,
+    fallbacks, the share of the exhaustive top k which is found and MAP
+    """
+    topics = load_topic_tokens(topics_file)
+    document_stats = load_document_stats(stats_file)
+    number_of_documents, index = open_index(index_file)
+    docnos = open_docnos(index_file)
+    params = {'k1': 1.2, 'b': 0.75, 'k3': 8.0}
+    qrels = load_qrels(qrels_file) if qrels_file else None
+
+    queries = [topic.title | topic.desc for topic in topics]
+
+    def report(name, results, elapsed, candidates, fallbacks):
+        overlap = sum(len({d for d, _ in a} & {d for d, _ in b})
+                      for a, b in zip(results, expected)) / \
+            max(sum(len(b) for b in expected), 1)
+        line = f'{name:<12}{elapsed * 1000 / len(queries):.2f}\t\t{candidates:.0f}\t\t' \
+               f'{fallbacks}\t\t{overlap:.3f}'
+
+        if qrels is not None:
+            rankings = {topic.id: [docnos[document_id] for document_id, _ in document_scores]
+                        for topic, document_scores in zip(topics, results)}
+            line += f'\t\t{mean_average_precision(rankings, qrels):.4f}'
+
+        click.echo(line)
+
+    click.echo(f'{len(queries)} topics, top {top_k}')
+    click.echo('Champions\tTime (ms)\tCandidates\tFallbacks\tOverlap' +
+               ('\t\tMAP' if qrels is not None else ''))
+
+    start = time.perf_counter()
+    expected = [search(number_of_documents, index, document_stats, search_terms,
+                       'bm25', params, top_k=top_k)
+                for search_terms in queries]
+    report('all', expected, time.perf_counter() - start, number_of_documents, 0)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in [int(size) for size in sizes.split(',')]:
+            champions_file = os.path.join(tmp_dir, f'{size}.champions')
+            create_champions(index_file, stats_file, size, 'bm25', params,
+                             output_filepath=champions_file)
+            champions = open_champions(index_file, champions_file)
+
+            counters = Counter()
+            start = time.perf_counter()
+            results = [tiered_search(number_of_documents, index, champions, document_stats,
+                                     search_terms, 'bm25', params, top_k=top_k,
+                                     counters=counters)
+                       for search_terms in queries]
+            elapsed = time.perf_counter() - start
+
+            report(str(size), results, elapsed, counters['candidates'] / len(queries),
+                   counters['fallbacks'])
+            champions.index.close()
+
+
+@cli.command()
+@click.option('--index_file', required=True, type=click.Path(exists=True),
+              help='Path to index file, built with --impact_scorer=bm25 --impact_order')
+@click.option('--topics_file', required=True, type=click.Path(exists=True),
+              help='Path to a file containing search topics')
+@click.option('--qrels_file', type=click.Path(exists=True),
+              help='Path to the relevance judgements of the topics, to compare MAP')
+@click.option('--budgets', default='10000,100000,1000000', show_default=True,
+              help='Comma separated postings budgets')
+@click.option('--deadlines', default='5,20,50', show_default=True,
+              help='Comma separated deadlines in milliseconds')
+@click.option('--top_k', default=1000, show_default=True,
+              help='Number of documents retrieved per topic')
+def anytime(index_file, topics_file, qrels_file, budgets, deadlines, top_k):
+    """Compares anytime searches of the impact ordered postings with
+    postings budgets and deadlines against the term-at-a-time impact
+    search: time per topic, topics which terminated early, the share of the
+    exact top k which is found and MAP
+    """
+    topics = load_topic_tokens(topics_file)
+    number_of_documents, index = open_index(index_file)
+    docnos = open_docnos(index_file)
+    impacts = load_impacts(index_file)
+    impact_order = open_impact_order(index_file)
+    params = {'k1': 1.2, 'b': 0.75, 'k3': 8.0}
+    qrels = load_qrels(qrels_file) if qrels_file else None
+
+    queries = [topic.title | topic.desc for topic in topics]
+
+    def report(name, results, elapsed, terminated_early):
+        overlap = sum(len({d for d, _ in a} & {d for d, _ in b})
+                      for a, b in zip(results, expected)) / \
+            max(sum(len(b) for b in expected), 1)
+        line = f'{name:<16}{elapsed * 1000 / len(queries):.2f}\t\t{terminated_early}\t\t' \
+               f'{overlap:.3f}'
+
+        if qrels is not None:
+            rankings = {topic.id: [docnos[document_id] for document_id, _ in document_scores]
+                        for topic, document_scores in zip(topics, results)}
+            line += f'\t\t{mean_average_precision(rankings, qrels):.4f}'
+
+        click.echo(line)
+
+    click.echo(f'{len(queries)} topics, top {top_k}')
+    click.echo('Search\t\tTime (ms)\tEarly\t\tOverlap' + ('\t\tMAP' if qrels is not None else ''))
+
+    start = time.perf_counter()
+    expected = [impact_search(index, impacts, search_terms, 'bm25', params, top_k=top_k)
+                for search_terms in queries]
+    report('term-at-a-time', expected, time.perf_counter() - start, 0)
+
+    settings = [('score-at-a-time', {})] + \
+        [(f'{budget} postings', {'max_postings': int(budget)}) for budget in budgets.split(',')] + \
+        [(f'{deadline} ms', {'deadline_ms': float(deadline)}) for deadline in deadlines.split(',')]
+
+    for name, budget in settings:
+        start = time.perf_counter()
+        results = [anytime_search(number_of_documents, index, impacts, impact_order, search_terms,
+                                  'bm25', params, top_k=top_k, **budget)
+                   for search_terms in queries]
+        elapsed = time.perf_counter() - start
+
+        report(name, [result.document_scores for result in results], elapsed,
+               sum(result.terminated_early for result in results))
+
+
+class __FullPositionsTable:
+    """Decodes the complete position list of a term, like a positional
+    index without block-wise access would
+    """
+
+    def __init__(self, positions_table):
+        self.positions_table = positions_table
+
+    def positions(self, token, posting_indices, term_frequencies=None):
+        positions = self.positions_table.positions(token, range(token.document_frequency),
+                                                   term_frequencies)
+        return [positions[i] for i in posting_indices]
+
+
+def __linear_scan(index, search_terms):
+    """The former term lookup of searching.py, scans the whole index
+    """
+    search_tokens = []
+    needles = set(search_terms)
+
+    for token in index:
+        for needle in needles:
+            if needle == token.term:
+                search_tokens.append(token)
+
+                remaining_needles = list(needles)
+                remaining_needles.remove(needle)
+                needles = remaining_needles
+
+            if not needles:
+                break
+
+    return search_tokens
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,481 @@
+from preprocessing import create_preprocessor, split_words
+from indexing import create_index_simple, create_index_spimi, create_index_map_reduce, \
+    open_index, open_docnos, open_positions, load_document_stats, create_impacts, load_impacts, \
+    create_champions, open_champions
+from compression import encode_postings, decode_postings, encode_positions, decode_positions
+from searching import search, check_impacts
+from kernels import numpy_search
+from tiers import check_champions
+from boolean import parse_boolean_query, evaluate_boolean_query
+from sharding import create_shards, ShardedIndex
+from segments import create_segments, add_segment, SegmentedIndex, \
+    __level as segment_level
+from server import SearchService, create_server
+from collections import Counter, defaultdict
+import numpy as np
+import os
+import json
+import threading
+import http.client
+import random
+import tempfile
+import click
+
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel',
+         'india', 'juliet', 'kilo', 'lima', 'mike', 'november', 'oscar', 'papa']
+STOP_WORDS = 'the of and to in'
+
+METHODS = [('tfidf', {}), ('cosine_tfidf', {}),
+           ('bm25', {'k1': 1.2, 'b': 0.75, 'k3': 8.0}),
+           ('bm25va', {'k1': 1.2, 'k3': 8.0})]
+
+
+@click.command()
+@click.option('--num_documents', default=300, show_default=True,
+              help='Number of generated documents with terms')
+@click.option('--seed', default=42, show_default=True,
+              help='Seed of the generated corpus')
+def cli(num_documents, seed):
+    """Builds indexes of a small generated corpus with every index builder
+    and checks them against the documents. The corpus contains documents
+    without any term (empty and stop words only, also as last document),
+    terms with a single posting and a term with several posting blocks.
+    Searches of the shards of an index have to rank like the whole index,
+    the numpy kernels have to score like the python scorers and boolean
+    filters have to match like sets of the expected postings. A segmented
+    index has to score like a single index of the same documents and
+    segments have to be assigned to the merge levels of their sizes, also
+    at exact powers of the merge factor. Impacts and champion lists have to
+    reject other ranking methods and parameters. The preprocessor has to
+    count hits and misses also once its cache is full. The search server
+    has to answer malformed requests with 400.
+    Fails with a non-zero exit status on the first failed check
+    """
+    preprocess = create_preprocessor()
+    random_generator = random.Random(seed)
+
+    __check_compression()
+    click.echo('Compression round trips ok')
+
+    __check_segment_levels()
+    click.echo('Segment levels ok')
+
+    __check_preprocessor_counters()
+    click.echo('Preprocessor counters ok')
+
+    with tempfile.TemporaryDirectory() as directory:
+        texts = __write_corpus(directory, num_documents, random_generator)
+        document_files = sorted(os.path.join(directory, name) for name
+                                in os.listdir(directory) if name.endswith('.sgml'))
+        expected = __invert(texts, preprocess)
+
+        # map/reduce writes its segment files to the working directory
+        working_directory = os.getcwd()
+        os.chdir(directory)
+
+        try:
+            create_index_simple(document_files, preprocess, 'simple.index',
+                                'simple.stats', verbose=False)
+            create_index_spimi(document_files, preprocess, 'spimi.index',
+                               'spimi.stats', verbose=False,
+                               max_tokens_per_block=500, positional=True)
+            create_index_map_reduce(document_files, preprocess, 'map_reduce.index',
+                                    'map_reduce.stats', verbose=False,
+                                    blocksize=1, positional=True)
+
+            for (name, positional) in [('simple', False), ('spimi', True),
+                                       ('map_reduce', True)]:
+                __check_index(name + '.index', name + '.stats', expected, positional)
+                click.echo(f'{name} index ok')
+
+            queries = __create_queries(expected)
+
+            for name in ['simple', 'spimi', 'map_reduce']:
+                __check_kernels(name + '.index', name + '.stats', queries)
+            click.echo('Numpy kernel scores ok')
+
+            __check_boolean('spimi.index', expected, preprocess)
+            click.echo('Boolean filters ok')
+
+            __check_impact_params('simple.index', 'simple.stats')
+            click.echo('Impact parameters ok')
+
+            __check_champion_params('simple.index', 'simple.stats')
+            click.echo('Champion list parameters ok')
+
+            __check_server('simple.index', 'simple.stats', preprocess, queries)
+            click.echo('Search server ok')
+
+            __check_shards('simple.index', 'simple.stats', queries)
+            click.echo('Sharded rankings ok')
+
+            __check_segments('segments', document_files, preprocess,
+                             'spimi.index', 'spimi.stats', queries)
+            click.echo('Segmented scores ok')
+        finally:
+            os.chdir(working_directory)
+
+    click.echo('All checks passed')
+
+
+def __check_compression():
+    postings_lists = [
+        [(0, 1)],
+        [(2 ** 31, 7)],
+        [(i * 3, i % 5 + 1) for i in range(128)],
+        [(i * 3, i % 5 + 1) for i in range(129)],
+        [(i, 1) for i in range(1000)]
+    ]
+
+    for postings_list in postings_lists:
+        decoded = decode_postings(encode_postings(postings_list), len(postings_list))
+        assert decoded == postings_list, \
+            f'Posting list of {len(postings_list)} postings does not round trip'
+
+        positions_lists = [list(range(0, 2 * term_frequency, 2))
+                           for (_, term_frequency) in postings_list]
+        term_frequencies = np.array([term_frequency for (_, term_frequency) in postings_list])
+        decoded = decode_positions(encode_positions(positions_lists), term_frequencies,
+                                   range(len(postings_list)))
+        assert [list(positions) for positions in decoded] == positions_lists, \
+            f'Positions of {len(postings_list)} postings do not round trip'
+
+
+def __check_preprocessor_counters():
+    """Checks the hit and miss counters of a preprocessor whose cache
+    overflows: words which do not fit into the cache are misses every time
+    """
+    preprocess = create_preprocessor(cache_entries=2)
+    calls = [(['alpha', 'bravo', 'charlie', 'alpha'], 0, 4),
+             (['alpha', 'bravo', 'charlie'], 2, 1),
+             (['delta', 'delta', 'alpha', 'bravo', 'charlie'], 2, 3)]
+
+    for (words, hits, misses) in calls:
+        before = preprocess.stats()
+        preprocess(words)
+        after = preprocess.stats()
+
+        assert (after['hits'] - before['hits'], after['misses'] - before['misses']) == \
+            (hits, misses), f'Preprocessing {words} counted {after} after {before}'
+
+    assert preprocess.stats()['words'] == 2, 'The preprocessor cached more than 2 words'
+
+
+def __check_segment_levels():
+    for merge_factor in range(2, 17):
+        for exponent in range(1, 11):
+            power = merge_factor ** exponent
+
+            for (live_documents, expected_level) in [(power - 1, exponent - 1),
+                                                     (power, exponent),
+                                                     (power + 1, exponent)]:
+                segment = {'number_of_ids': live_documents + 5, 'number_of_deleted': 5}
+                level = segment_level(segment, merge_factor)
+
+                assert level == expected_level, \
+                    f'{live_documents} documents on level {level} instead of ' \
+                    f'{expected_level} (merge factor {merge_factor})'
+
+
+def __write_corpus(directory, num_documents, random_generator):
+    """Writes the generated documents to sgml files and returns their
+    (docno, text) pairs in indexing order
+    """
+    texts = [('EMPTY-FIRST', ''), ('STOP-WORDS', STOP_WORDS)]
+
+    for i in range(num_documents):
+        words = [random_generator.choice(WORDS)
+                 for _ in range(random_generator.randint(1, 20))]
+
+        # a term of (almost) all documents and one of this document only
+        if i % 50 != 49:
+            words.append('common')
+        words.append('single' + ''.join(chr(ord('a') + int(digit)) for digit in str(i)))
+
+        random_generator.shuffle(words)
+        texts.append(('DOC-{:04d}'.format(i), ' '.join(words)))
+
+        if i % 100 == 0:
+            texts.append(('EMPTY-{:04d}'.format(i), ''))
+
+    texts.append(('EMPTY-LAST', ''))
+
+    documents_per_file = 40
+
+    for start in range(0, len(texts), documents_per_file):
+        filepath = os.path.join(directory, 'file{:03d}.sgml'.format(start // documents_per_file))
+
+        with open(filepath, 'w') as f:
+            for (docno, text) in texts[start:start + documents_per_file]:
+                f.write(f'<DOC>\n<DOCNO> {docno} </DOCNO>\n<TEXT>\n{text}\n</TEXT>\n</DOC>\n')
+
+    return texts
+
+
+def __invert(texts, preprocess):
+    """Returns the docnos of the documents with terms and the expected
+    postings and positions by term
+    """
+    docnos = []
+    postings = defaultdict(list)
+    positions = defaultdict(list)
+
+    for (docno, text) in texts:
+        terms = preprocess(split_words(text))
+
+        if not terms:
+            continue
+
+        document_id = len(docnos)
+        docnos.append(docno)
+
+        term_positions = defaultdict(list)
+        for position, term in enumerate(terms):
+            term_positions[term].append(position)
+
+        for term, term_frequency in sorted(Counter(terms).items()):
+            postings[term].append((document_id, term_frequency))
+            positions[term].append(term_positions[term])
+
+    return (docnos, postings, positions)
+
+
+def __check_index(index_file, stats_file, expected, positional):
+    (docnos, postings, positions) = expected
+
+    number_of_documents, index = open_index(index_file)
+    document_stats = load_document_stats(stats_file)
+    index_docnos = open_docnos(index_file)
+
+    assert number_of_documents == len(docnos), \
+        f'{index_file}: {number_of_documents} documents instead of {len(docnos)}'
+    assert [index_docnos[i] for i in range(len(index_docnos))] == docnos, \
+        f'{index_file}: docnos differ'
+    assert len(document_stats.norm) == len(docnos), \
+        f'{stats_file}: stats of {len(document_stats.norm)} documents instead of {len(docnos)}'
+
+    terms = [token.term for token in index]
+    assert terms == sorted(postings), f'{index_file}: terms differ'
+
+    positions_table = open_positions(index_file) if positional else None
+
+    for token in index:
+        assert list(token.postings) == postings[token.term], \
+            f'{index_file}: postings of "{token.term}" differ'
+
+        if positional:
+            actual = positions_table.positions(token, range(token.document_frequency))
+            assert [list(p) for p in actual] == positions[token.term], \
+                f'{index_file}: positions of "{token.term}" differ'
+
+    if positional:
+        positions_table.close()
+
+    index.close()
+
+
+def __create_queries(expected):
+    """Returns queries for the single posting, the most frequent and some
+    other terms of the expected postings and a term which is not indexed
+    """
+    (_, postings, _) = expected
+
+    terms = sorted(postings, key=lambda term: (len(postings[term]), term))
+    (single, frequent) = (terms[0], terms[-1])
+    assert len(postings[single]) == 1
+
+    return [[single], [frequent], [frequent, terms[-2], single],
+            terms[-6:-1], ['notindexed'], [single, 'notindexed']]
+
+
+def __check_shards(index_file, stats_file, queries):
+    """Checks the rankings of 3 shards and, while their coordinator is
+    still open, of 2 shards rebuilt to the same files. Both coordinators
+    share the worker processes
+    """
+    number_of_documents, index = open_index(index_file)
+    document_stats = load_document_stats(stats_file)
+    sharded_indexes = []
+
+    for number_of_shards in [3, 2]:
+        create_shards(index_file, stats_file, number_of_shards)
+        sharded_index = ShardedIndex(index_file, num_nodes=2)
+        sharded_indexes.append(sharded_index)
+
+        for ranking_method, params in METHODS:
+            for search_terms in queries:
+                expected = search(number_of_documents, index, document_stats,
+                                  search_terms, ranking_method, params, top_k=None)
+                actual = sharded_index.search(search_terms, ranking_method, params, top_k=None)
+
+                assert actual == expected, \
+                    f'{number_of_shards} shards: {ranking_method} ranking of {search_terms} differs'
+
+    for sharded_index in sharded_indexes:
+        sharded_index.close()
+
+    index.close()
+
+
+def __check_segments(directory, document_files, preprocess, index_file, stats_file, queries):
+    """Checks the scores of a segmented index of the documents against the
+    ones of the given single index of the same documents
+    """
+    create_segments(directory)
+    half = len(document_files) // 2
+
+    for segment_files in [document_files[:half], document_files[half:]]:
+        add_segment(directory, segment_files, preprocess, verbose=False,
+                    max_tokens_per_block=500)
+
+    number_of_documents, index = open_index(index_file)
+    document_stats = load_document_stats(stats_file)
+    docnos = open_docnos(index_file)
+    segmented_index = SegmentedIndex(directory)
+
+    for ranking_method, params in METHODS:
+        for search_terms in queries:
+            expected = search(number_of_documents, index, document_stats,
+                              search_terms, ranking_method, params, top_k=None)
+            actual = segmented_index.search(search_terms, ranking_method, params, top_k=None)
+
+            expected = dict((docnos[document_id], score) for document_id, score in expected)
+            actual = dict((segmented_index.docnos[document_id], score)
+                          for document_id, score in actual)
+
+            assert actual.keys() == expected.keys() and \
+                np.allclose([actual[docno] for docno in expected], list(expected.values()),
+                            rtol=1e-9, atol=1e-12), \
+                f'Segmented {ranking_method} scores of {search_terms} differ'
+
+    segmented_index.close()
+    docnos.close()
+    index.close()
+
+
+def __check_kernels(index_file, stats_file, queries):
+    number_of_documents, index = open_index(index_file)
+    document_stats = load_document_stats(stats_file)
+
+    for ranking_method, params in METHODS:
+        for search_terms in queries:
+            expected = search(number_of_documents, index, document_stats,
+                              search_terms, ranking_method, params, top_k=None)
+            actual = numpy_search(number_of_documents, index, document_stats,
+                                  search_terms, ranking_method, params, top_k=None)
+
+            # documents with (almost) equal scores may swap places
+            assert len(actual) == len(expected) and \
+                np.allclose([s for _, s in actual], [s for _, s in expected],
+                            rtol=1e-9, atol=1e-12), \
+                f'{index_file}: numpy {ranking_method} scores of {search_terms} differ'
+
+    index.close()
+
+
+def __check_boolean(index_file, expected, preprocess):
+    (docnos, postings, _) = expected
+
+    number_of_documents, index = open_index(index_file)
+    all_ids = set(range(len(docnos)))
+
+    def ids(term):
+        return set(document_id for document_id, _ in postings.get(term, []))
+
+    (common,) = preprocess(['common'])
+    (alpha,) = preprocess(['alpha'])
+
+    filters = [('NOT common', all_ids - ids(common)),
+               ('NOT notindexed', all_ids),
+               ('alpha AND NOT common', ids(alpha) - ids(common)),
+               ('common OR NOT alpha', ids(common) | (all_ids - ids(alpha)))]
+
+    for (query, expected_ids) in filters:
+        matches = evaluate_boolean_query(number_of_documents, index,
+                                         parse_boolean_query(query, preprocess))
+
+        assert set(matches.to_array().tolist()) == expected_ids, \
+            f'{index_file}: matches of "{query}" differ'
+
+    index.close()
+
+
+def __check_impact_params(index_file, stats_file):
+    """Checks that impacts are only used with the ranking method and the
+    parameters they were built for
+    """
+    create_impacts(index_file, stats_file, 'bm25', {'k1': 1.2, 'b': 0.75})
+    impacts = load_impacts(index_file)
+
+    check_impacts(impacts, 'bm25', {'k1': 1.2, 'b': 0.75, 'k3': 8.0})
+    check_impacts(impacts, 'bm25', {'k1': 1.2, 'b': 0.75})
+
+    __check_rejected(impacts, check_impacts, [('bm25va', {'k1': 1.2, 'k3': 8.0}),
+                                              ('bm25', {'k1': 1.2, 'b': 0.5, 'k3': 8.0}),
+                                              ('bm25', {'k1': 1.2, 'k3': 8.0}),
+                                              ('bm25', {}),
+                                              ('bm25', {'k1': 1.2, 'b': 0.75, 'k3': 8.0,
+                                                        'k2': 1.0})])
+
+
+def __check_champion_params(index_file, stats_file):
+    """Checks that champion lists are only used with the ranking methods and
+    the parameters of the scorer they were selected by
+    """
+    create_champions(index_file, stats_file, 5, 'tfidf')
+    champions = open_champions(index_file)
+
+    check_champions(champions, 'tfidf', {})
+    check_champions(champions, 'cosine_tfidf', {})
+    __check_rejected(champions, check_champions, [('bm25', {'k1': 1.2, 'b': 0.75, 'k3': 8.0}),
+                                                  ('tfidf', {'k1': 1.2})])
+    champions.index.close()
+
+    create_champions(index_file, stats_file, 5, 'bm25', {'k1': 1.2, 'b': 0.75})
+    champions = open_champions(index_file)
+
+    check_champions(champions, 'bm25', {'k1': 1.2, 'b': 0.75, 'k3': 8.0})
+    __check_rejected(champions, check_champions, [('bm25va', {'k1': 1.2, 'k3': 8.0}),
+                                                  ('tfidf', {}),
+                                                  ('bm25', {'k1': 1.2, 'b': 0.5, 'k3': 8.0}),
+                                                  ('bm25', {'k1': 1.2, 'k3': 8.0})])
+    champions.index.close()
+
+
+def __check_rejected(precomputed, check, searches):
+    for (ranking_method, params) in searches:
+        try:
+            check(precomputed, ranking_method, params)
+        except ValueError:
+            continue
+
+        raise AssertionError(f'{check.__name__} accepted {ranking_method} with {params}')
+
+
+def __check_server(index_file, stats_file, preprocess, queries):
+    service = SearchService(index_file, stats_file, preprocess)
+    server = create_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    requests = [('[]', 400), ('"x"', 400), ('1', 400), ('{}', 400),
+                (json.dumps({'terms': queries[0][0]}), 400),
+                (json.dumps({'terms': [1]}), 400),
+                (json.dumps({'terms': queries[0]}), 200)]
+
+    try:
+        for (body, expected_status) in requests:
+            connection = http.client.HTTPConnection(*server.server_address[:2], timeout=10)
+            connection.request('POST', '/search', body=body,
+                               headers={'Content-Type': 'application/json'})
+            status = connection.getresponse().status
+            connection.close()
+
+            assert status == expected_status, \
+                f'Search request {body} answered with {status} instead of {expected_status}'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    cli()
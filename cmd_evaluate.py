@@ -1,12 +1,15 @@
 from preprocessing import create_preprocessor, split_words
 from evaluation import generate_qrel, load_topic_tokens
-from indexing import create_index_reader, load_document_stats
+from indexing import open_index, open_docnos, load_document_stats
 import gc
 import time
 
 index_filepath = 'spimi.index'
 stats_filepath = 'spimi.stats'
 topics_filepath = './data/TREC8all/topicsTREC8Adhoc.txt'
+# topics are searched in one process, set to the number of cores (or
+# another number of processes) to split them across workers
+num_workers = 1
 
 preprocessor = create_preprocessor(enable_case_folding=True,
                                    enable_remove_stop_words=True,
@@ -22,33 +25,34 @@ print('Loading document stats')
 document_stats = load_document_stats(stats_filepath)
 print('done')
 
-print('Loading search index')
+print('Opening search index')
 start = time.time()
-number_of_documents, index_reader_generator = create_index_reader(index_filepath)
-index_reader = index_reader_generator()
-index = list(index_reader)
+number_of_documents, index = open_index(index_filepath)
+docnos = open_docnos(index_filepath)
 print('done in', time.time() - start, 'seconds')
 
 ranking_method = 'tfidf'
-generate_qrel(number_of_documents, index, document_stats, topics,
+generate_qrel(number_of_documents, index, document_stats, docnos, topics,
               f'{ranking_method}_results.txt',
-              ranking_method, 'dev-run')
+              ranking_method, 'dev-run', num_workers=num_workers)
 gc.collect()
 
 ranking_method = 'cosine_tfidf'
-generate_qrel(number_of_documents, index, document_stats, topics,
+generate_qrel(number_of_documents, index, document_stats, docnos, topics,
               f'{ranking_method}_results.txt',
-              ranking_method, 'dev-run')
+              ranking_method, 'dev-run', num_workers=num_workers)
 gc.collect()
 
 ranking_method = 'bm25'
-generate_qrel(number_of_documents, index, document_stats, topics,
+generate_qrel(number_of_documents, index, document_stats, docnos, topics,
               f'{ranking_method}_results.txt',
-              ranking_method, 'dev-run', { 'k1': 1.2, 'b': 0.75, 'k3': 8.0})
+              ranking_method, 'dev-run', { 'k1': 1.2, 'b': 0.75, 'k3': 8.0},
+              num_workers=num_workers)
 gc.collect()
 
 ranking_method = 'bm25va'
-generate_qrel(number_of_documents, index, document_stats, topics,
+generate_qrel(number_of_documents, index, document_stats, docnos, topics,
               f'{ranking_method}_results.txt',
-              ranking_method, 'dev-run', { 'k1': 1.2, 'k3': 8.0})
+              ranking_method, 'dev-run', { 'k1': 1.2, 'k3': 8.0},
+              num_workers=num_workers)
 gc.collect()
@@ -1,5 +1,6 @@
 from preprocessing import create_preprocessor
 from indexing import create_index_simple, create_index_spimi, create_index_map_reduce
+from sharding import create_shards, remove_shards
 
 import os
 import glob
@@ -38,13 +39,39 @@ import click
 @click.option('--enable_strip_square_bracket_tags/--disable_strip_square_bracket_tags',
               default=True, show_default=True,
               help='Enable/Disable removal of tags in square brackets, like "[BR]"')
+@click.option('--impact_scorer', default='none', show_default=True,
+              type=click.Choice(['none', 'tfidf', 'bm25']),
+              help='Precompute quantized per-posting impacts for the given scorer')
+@click.option('--impact_k1', default=1.2, show_default=True,
+              help='k1 parameter for bm25 impacts and champion lists')
+@click.option('--impact_b', default=0.75, show_default=True,
+              help='b parameter for bm25 impacts and champion lists')
+@click.option('--impact_order/--no_impact_order', default=False, show_default=True,
+              help='Additionally store the postings grouped by descending impact for '
+                   'score-at-a-time search (requires --impact_scorer)')
+@click.option('--champion_list_size', default=0, show_default=True,
+              help='Additionally store champion lists of the given number of postings (0 disables them)')
+@click.option('--champion_scorer', default='bm25', show_default=True,
+              type=click.Choice(['tfidf', 'bm25']),
+              help='Term weight which selects the champion postings (bm25 with --impact_k1 and '
+                   '--impact_b), --use_champions searches have to match it (tfidf for tfidf and '
+                   'cosine_tfidf, bm25 for bm25 with the same k1 and b)')
+@click.option('--num_shards', default=1, show_default=True,
+              help='Additionally split the complete index into the given number of document-partitioned '
+                   'shards for parallel searches (the whole index is built first)')
 @click.pass_context
 def cli(ctx, document_folder, index_file, stats_file,
         enable_case_folding, enable_stemmer, enable_lemmatizer,
         enable_remove_stop_words, min_word_length,
         enable_strip_html_tags, enable_strip_html_entities,
-        enable_strip_square_bracket_tags):
-    nltk.download('wordnet')
+        enable_strip_square_bracket_tags,
+        impact_scorer, impact_k1, impact_b, impact_order, champion_list_size, champion_scorer,
+        num_shards):
+    if impact_order and impact_scorer == 'none':
+        raise click.ClickException('--impact_order requires --impact_scorer')
+
+    if enable_lemmatizer:
+        nltk.download('wordnet')
 
     preprocessor = create_preprocessor(enable_case_folding=enable_case_folding,
                                        enable_remove_stop_words=enable_remove_stop_words,
@@ -68,6 +95,13 @@ def cli(ctx, document_folder, index_file, stats_file,
     ctx.obj['STRIP_HTML_ENTITIES'] = enable_strip_html_entities
     ctx.obj['STRIP_SQUARE_BRACKET_TAGS'] = enable_strip_square_bracket_tags
 
+    ctx.obj['IMPACT_SCORER'] = None if impact_scorer == 'none' else impact_scorer
+    ctx.obj['IMPACT_PARAMS'] = {'k1': impact_k1, 'b': impact_b}
+    ctx.obj['IMPACT_ORDER'] = impact_order
+    ctx.obj['CHAMPION_LIST_SIZE'] = champion_list_size
+    ctx.obj['CHAMPION_SCORER'] = champion_scorer
+    ctx.obj['NUM_SHARDS'] = num_shards
+
 
 @cli.command()
 @click.pass_context
@@ -81,14 +115,24 @@ def simple(ctx):
                         ctx.obj['STATS_FILE'],
                         strip_html_tags=ctx.obj['STRIP_HTML_TAGS'],
                         strip_html_entities=ctx.obj['STRIP_HTML_ENTITIES'],
-                        strip_square_bracket_tags=ctx.obj['STRIP_SQUARE_BRACKET_TAGS'])
+                        strip_square_bracket_tags=ctx.obj['STRIP_SQUARE_BRACKET_TAGS'],
+                        impact_scorer=ctx.obj['IMPACT_SCORER'],
+                        impact_params=ctx.obj['IMPACT_PARAMS'],
+                        impact_order=ctx.obj['IMPACT_ORDER'],
+                        champion_list_size=ctx.obj['CHAMPION_LIST_SIZE'],
+                        champion_scorer=ctx.obj['CHAMPION_SCORER'])
+
+    __echo_preprocessor_stats(ctx)
+    __create_shards(ctx)
 
 
 @cli.command()
 @click.option('--max_tokens_per_block', default=10000000, show_default=True,
               help='Maximum number of tokens allowed in a single spimi block')
+@click.option('--positional/--no_positional', default=False, show_default=True,
+              help='Store the positions of all terms for phrase and proximity queries')
 @click.pass_context
-def spimi(ctx, max_tokens_per_block):
+def spimi(ctx, max_tokens_per_block, positional):
     preprocessor = ctx.obj['PREPROCESSOR']
     click.echo(f'Writing index using spimi method to {ctx.obj["INDEX_FILE"]} and document stats to {ctx.obj["STATS_FILE"]}')
     click.echo('Reading source files')
@@ -99,7 +143,16 @@ def spimi(ctx, max_tokens_per_block):
                        max_tokens_per_block=max_tokens_per_block,
                        strip_html_tags=ctx.obj['STRIP_HTML_TAGS'],
                        strip_html_entities=ctx.obj['STRIP_HTML_ENTITIES'],
-                       strip_square_bracket_tags=ctx.obj['STRIP_SQUARE_BRACKET_TAGS'])
+                       strip_square_bracket_tags=ctx.obj['STRIP_SQUARE_BRACKET_TAGS'],
+                       impact_scorer=ctx.obj['IMPACT_SCORER'],
+                       impact_params=ctx.obj['IMPACT_PARAMS'],
+                       impact_order=ctx.obj['IMPACT_ORDER'],
+                       champion_list_size=ctx.obj['CHAMPION_LIST_SIZE'],
+                       champion_scorer=ctx.obj['CHAMPION_SCORER'],
+                       positional=positional)
+
+    __echo_preprocessor_stats(ctx)
+    __create_shards(ctx)
 
 
 @cli.command()
@@ -107,8 +160,10 @@ def spimi(ctx, max_tokens_per_block):
               help='Size of data the Map Process takes one at a time in Megabyte')
 @click.option('--num_nodes', default=None, show_default=True,
               help='Number of Processes over which the work load is distributed. Typically defaults to the number of cores')
+@click.option('--positional/--no_positional', default=False, show_default=True,
+              help='Store the positions of all terms for phrase and proximity queries')
 @click.pass_context
-def map_reduce(ctx, blocksize, num_nodes):
+def map_reduce(ctx, blocksize, num_nodes, positional):
     preprocessor = ctx.obj['PREPROCESSOR']
     click.echo(f'Writing index using map_redduce to {ctx.obj["INDEX_FILE"]} and document stats to {ctx.obj["STATS_FILE"]}')
     click.echo('Reading source files')
@@ -120,7 +175,29 @@ def map_reduce(ctx, blocksize, num_nodes):
                         strip_html_entities=ctx.obj['STRIP_HTML_ENTITIES'],
                         strip_square_bracket_tags=ctx.obj['STRIP_SQUARE_BRACKET_TAGS'],
                         blocksize=blocksize,
-                        num_nodes=num_nodes)
+                        num_nodes=num_nodes,
+                        impact_scorer=ctx.obj['IMPACT_SCORER'],
+                        impact_params=ctx.obj['IMPACT_PARAMS'],
+                        impact_order=ctx.obj['IMPACT_ORDER'],
+                        champion_list_size=ctx.obj['CHAMPION_LIST_SIZE'],
+                        champion_scorer=ctx.obj['CHAMPION_SCORER'],
+                        positional=positional)
+
+    __create_shards(ctx)
+
+
+def __echo_preprocessor_stats(ctx):
+    # map_reduce workers preprocess with their own copies of the preprocessor
+    click.echo(f'Preprocessor cache: {ctx.obj["PREPROCESSOR"].stats()}')
+
+
+def __create_shards(ctx):
+    if ctx.obj['NUM_SHARDS'] > 1:
+        click.echo(f'Splitting {ctx.obj["INDEX_FILE"]} into {ctx.obj["NUM_SHARDS"]} shards')
+        create_shards(ctx.obj['INDEX_FILE'], ctx.obj['STATS_FILE'], ctx.obj['NUM_SHARDS'])
+    else:
+        # shards of a previous build do not match the new index
+        remove_shards(ctx.obj['INDEX_FILE'])
 
 
 if __name__ == '__main__':
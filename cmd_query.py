@@ -1,17 +1,31 @@
 from preprocessing import split_words, create_preprocessor
-from indexing import create_index_reader, load_document_stats
+from indexing import open_index, open_docnos, open_positions, open_impact_order, \
+    load_document_stats, load_impacts, POSITIONS_SUFFIX
 from searching import simple_tfidf_search, cosine_tfidf_search, simple_bm25_search, simple_bm25va_search
+from phrases import parse_query
+from boolean import parse_boolean_query, boolean_search, BooleanQuery
+from anytime import anytime_search
+import os
 import time
 import click
 
 
 @click.group()
 @click.option('--query', required=True,
-              help='Term to search for')
+              help='Term to search for. Quoted phrases ("a b") and proximity queries ("a b"~N) '
+                   'require an index built with --positional')
 @click.option('--index_file', required=True, type=click.Path(exists=True),
               help='Path to index file')
 @click.option('--stats_file', required=True, type=click.Path(exists=True),
               help='Path to document stats file')
+@click.option('--filter', 'boolean_filter',
+              help='Only retrieve documents matching the given boolean query, '
+                   'e.g. \'drug AND NOT (cartel OR "money laundering")\'')
+@click.option('--max_postings', type=int,
+              help='Search the impact ordered postings (see cmd_index.py --impact_order) '
+                   'and stop after the given number of postings')
+@click.option('--deadline_ms', type=float,
+              help='Search the impact ordered postings and stop after the given number of milliseconds')
 @click.option('--enable_case_folding/--disable_case_folding',
               default=True, show_default=True,
               help='Enable/Disable case folding during preprocessing')
@@ -37,7 +51,7 @@ import click
               default=True, show_default=True,
               help='Enable/Disable removal of tags in square brackets, like "[BR]"')
 @click.pass_context
-def cli(ctx, query, index_file, stats_file,
+def cli(ctx, query, index_file, stats_file, boolean_filter, max_postings, deadline_ms,
         enable_case_folding, enable_stemmer, enable_lemmatizer,
         enable_remove_stop_words, min_word_length,
         enable_strip_html_tags, enable_strip_html_entities,
@@ -55,34 +69,95 @@ def cli(ctx, query, index_file, stats_file,
                                 strip_html_entities=enable_strip_html_entities,
                                 strip_square_bracket_tags=enable_strip_square_bracket_tags)
 
-            search_terms = preprocess(words)
+            try:
+                (search_terms, phrases) = parse_query(query, preprocess,
+                                                      strip_html_tags=enable_strip_html_tags,
+                                                      strip_html_entities=enable_strip_html_entities,
+                                                      strip_square_bracket_tags=enable_strip_square_bracket_tags)
+
+                # phrases of the query filter the documents like the boolean query
+                filter_query = None
+
+                if boolean_filter or phrases:
+                    operands = list(phrases)
+
+                    if boolean_filter:
+                        operands.insert(0, parse_boolean_query(
+                            boolean_filter, preprocess,
+                            strip_html_tags=enable_strip_html_tags,
+                            strip_html_entities=enable_strip_html_entities,
+                            strip_square_bracket_tags=enable_strip_square_bracket_tags))
+
+                    filter_query = BooleanQuery('AND', operands)
+            except ValueError as e:
+                raise click.ClickException(str(e))
+
+            use_impact_order = max_postings is not None or deadline_ms is not None
+
+            if use_impact_order and filter_query:
+                raise click.ClickException(
+                    '--max_postings and --deadline_ms can not be used with filters or phrases')
 
             click.echo(f'Searching for "{query}" using "{ranking_method}"')
             click.echo(f'Words: "{words}"')
             click.echo(f'Terms: "{search_terms}"')
 
+            if filter_query:
+                click.echo(f'Filter: "{filter_query}"')
+
             click.echo(f'Loading document stats from {stats_file}')
             document_stats = load_document_stats(stats_file)
             click.echo('done')
 
-            click.echo(f'Loading search index from {index_file}')
-            click.echo('This might take a while')
+            click.echo(f'Opening search index {index_file}')
             start = time.time()
-            number_of_documents, index_reader_generator = create_index_reader(index_file)
-            index_reader = index_reader_generator()
-            index = list(index_reader)
+            number_of_documents, index = open_index(index_file)
+            docnos = open_docnos(index_file)
             click.echo(f'done in {time.time() - start} seconds')
 
             document_scores = None
 
-            if ranking_method == 'tfidf':
+            if filter_query:
+                positions_table = open_positions(index_file) \
+                    if os.path.exists(index_file + POSITIONS_SUFFIX) else None
+
+                start = time.time()
+
+                try:
+                    document_scores = boolean_search(number_of_documents, index,
+                                                     document_stats, search_terms,
+                                                     filter_query, ranking_method, params,
+                                                     positions_table=positions_table)
+                except ValueError as e:
+                    raise click.ClickException(str(e))
+
+                click.echo(f'Filtered search done in {time.time() - start} seconds')
+            elif use_impact_order:
+                start = time.time()
+
+                try:
+                    result = anytime_search(number_of_documents, index, load_impacts(index_file),
+                                            open_impact_order(index_file), search_terms,
+                                            ranking_method, params,
+                                            max_postings=max_postings,
+                                            deadline_ms=deadline_ms)
+                except (ValueError, OSError) as e:
+                    raise click.ClickException(str(e))
+
+                document_scores = result.document_scores
+                status = 'terminated early' if result.terminated_early else 'complete'
+
+                click.echo(f'Impact ordered search {status} after {result.processed_postings} '
+                           f'postings in {time.time() - start} seconds')
+            elif ranking_method == 'tfidf':
                 document_scores = simple_tfidf_search(number_of_documents,
                                                       index,
                                                       search_terms)
             elif ranking_method == 'cosine_tfidf':
                 document_scores = cosine_tfidf_search(number_of_documents,
                                                       index,
-                                                      search_terms)
+                                                      search_terms,
+                                                      document_stats)
             elif ranking_method == 'bm25':
                 document_scores = simple_bm25_search(number_of_documents,
                                                      index,
@@ -100,7 +175,7 @@ def cli(ctx, query, index_file, stats_file,
                                                        k3=params['k3'])
 
             for document_score in document_scores[:50]:
-                print(f'{document_score[1]}\t{document_score[0]}')
+                print(f'{document_score[1]}\t{docnos[document_score[0]]}')
 
         ctx.obj['RUNNER'] = run_eval
 
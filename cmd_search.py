@@ -1,6 +1,17 @@
 from preprocessing import create_preprocessor
-from indexing import create_index_reader, load_document_stats
-from evaluation import generate_qrel, load_topic_tokens
+from indexing import open_index, open_docnos, open_positions, open_champions, \
+    load_document_stats, load_impacts, POSITIONS_SUFFIX
+from evaluation import generate_qrel, generate_remote_qrel, load_topic_tokens
+from searching import check_impacts
+from sharding import ShardedIndex
+from segments import SegmentedIndex
+from pruning import PRUNING_ALGORITHMS, PRUNING_RANKING_METHODS
+from server import SearchClient
+from caching import PostingCache, highest_document_frequency_terms
+from boolean import parse_boolean_query, evaluate_boolean_query
+from tiers import check_champions
+from collections import Counter
+import os
 import time
 import click
 
@@ -12,10 +23,10 @@ import click
               help='Name for run in results file')
 @click.option('--topics_file', required=True, type=click.Path(exists=True),
               help='Path to a file containing search topics')
-@click.option('--index_file', required=True, type=click.Path(exists=True),
-              help='Path to index file')
-@click.option('--stats_file', required=True, type=click.Path(exists=True),
-              help='Path to document stats file')
+@click.option('--index_file', type=click.Path(exists=True),
+              help='Path to index file (or segments directory, see --use_segments)')
+@click.option('--stats_file', type=click.Path(exists=True),
+              help='Path to document stats file (not needed for segmented indexes)')
 @click.option('--enable_case_folding/--disable_case_folding',
               default=True, show_default=True,
               help='Enable/Disable case folding during preprocessing')
@@ -40,13 +51,54 @@ import click
 @click.option('--enable_strip_square_bracket_tags/--disable_strip_square_bracket_tags',
               default=True, show_default=True,
               help='Enable/Disable removal of tags in square brackets, like "[BR]"')
+@click.option('--use_impacts/--no_use_impacts',
+              default=False, show_default=True,
+              help='Score using the precomputed impacts of the index (see cmd_index.py --impact_scorer)')
+@click.option('--use_shards/--no_use_shards',
+              default=False, show_default=True,
+              help='Search the shards of the index in parallel (see cmd_index.py --num_shards)')
+@click.option('--use_segments/--no_use_segments',
+              default=False, show_default=True,
+              help='Search all segments of a segmented index (see cmd_segments.py)')
+@click.option('--pruning', default='none', show_default=True,
+              type=click.Choice(['none'] + PRUNING_ALGORITHMS),
+              help='Retrieve the top k documents using dynamic pruning (tfidf and bm25 only)')
+@click.option('--top_k', default=1000, show_default=True,
+              help='Number of documents retrieved per topic (0 for all)')
+@click.option('--use_numpy/--no_use_numpy',
+              default=False, show_default=True,
+              help='Score using the vectorized numpy kernels')
+@click.option('--batch_size', default=1, show_default=True,
+              help='Number of topics searched together, sharing the postings of common terms')
+@click.option('--num_workers', default=1, show_default=True,
+              help='Number of processes which search the topics in parallel')
+@click.option('--posting_cache_megabytes', default=0, show_default=True,
+              help='Memory budget for decoded posting lists of frequent terms (0 disables the cache)')
+@click.option('--prewarm_top_terms', default=0, show_default=True,
+              help='Number of terms with the highest document frequencies cached before searching')
+@click.option('--filter', 'boolean_filter',
+              help='Only retrieve documents matching the given boolean query, '
+                   'e.g. \'drug AND NOT (cartel OR "money laundering")\'')
+@click.option('--use_champions/--no_use_champions',
+              default=False, show_default=True,
+              help='Only score the documents of the champion lists of the query terms '
+                   '(see cmd_index.py --champion_list_size), which are selected by the term weight '
+                   'of cmd_index.py --champion_scorer, choose the ranking method accordingly')
+@click.option('--min_candidates', default=0, show_default=True,
+              help='Search the whole index if the champion lists hold less documents (0 for --top_k)')
+@click.option('--server',
+              help='Send the queries to a running search server (see cmd_server.py), '
+                   'either http://host:port or unix:/path/to/socket')
 @click.pass_context
 def cli(ctx, output_file, run_name,
         topics_file, index_file, stats_file,
         enable_case_folding, enable_stemmer, enable_lemmatizer,
         enable_remove_stop_words, min_word_length,
         enable_strip_html_tags, enable_strip_html_entities,
-        enable_strip_square_bracket_tags):
+        enable_strip_square_bracket_tags, use_impacts, use_shards, use_segments,
+        pruning, top_k, use_numpy, batch_size, num_workers,
+        posting_cache_megabytes, prewarm_top_terms, boolean_filter, use_champions,
+        min_candidates, server):
 
         def run_eval(ranking_method, params={}):
             preprocessor = create_preprocessor(enable_case_folding=enable_case_folding,
@@ -65,25 +117,151 @@ def cli(ctx, output_file, run_name,
             )
             click.echo('done')
 
-            click.echo(f'Loading document stats from {stats_file}')
-            document_stats = load_document_stats(stats_file)
-            click.echo('done')
+            if server:
+                if boolean_filter or use_champions:
+                    raise click.ClickException(
+                        '--filter and --use_champions can not be used with --server')
+
+                click.echo(f'Searching using server {server}')
+
+                try:
+                    generate_remote_qrel(SearchClient(server), topics, output_file,
+                                         ranking_method, run_name, params,
+                                         top_k=top_k or None)
+                except (ValueError, OSError) as e:
+                    raise click.ClickException(str(e))
+                return
 
-            click.echo(f'Loading search index from {index_file}')
-            click.echo('This might take a while')
+            if not index_file:
+                raise click.ClickException('Missing option "--index_file"')
+
+            document_stats = None
+
+            if stats_file:
+                click.echo(f'Loading document stats from {stats_file}')
+                document_stats = load_document_stats(stats_file)
+                click.echo('done')
+            elif not use_segments:
+                raise click.ClickException('Missing option "--stats_file"')
+
+            click.echo(f'Opening search index {index_file}')
             start = time.time()
-            number_of_documents, index_reader_generator = create_index_reader(index_file)
-            index_reader = index_reader_generator()
-            index = list(index_reader)
+            if use_shards:
+                index = ShardedIndex(index_file)
+                number_of_documents = index.number_of_documents
+                docnos = index.docnos
+            elif use_segments:
+                index = SegmentedIndex(index_file)
+                number_of_documents = index.number_of_documents
+                docnos = index.docnos
+            else:
+                number_of_documents, index = open_index(index_file)
+                docnos = open_docnos(index_file)
             click.echo(f'done in {time.time() - start} seconds')
 
+            if posting_cache_megabytes > 0:
+                if use_shards or use_segments or num_workers > 1:
+                    raise click.ClickException(
+                        'The posting cache only applies to a single index searched in one process')
+
+                index = PostingCache(index, posting_cache_megabytes * 1024 * 1024)
+
+                if prewarm_top_terms > 0:
+                    click.echo(f'Caching the {prewarm_top_terms} terms with the highest document frequencies')
+                    index.prewarm(highest_document_frequency_terms(index.index, prewarm_top_terms))
+
+            impacts = None
+
+            if use_impacts and (use_shards or use_segments):
+                raise click.ClickException('Impacts can not be used with shards or segments')
+
+            if pruning != 'none' and (use_impacts or use_shards or use_segments or
+                                      ranking_method not in PRUNING_RANKING_METHODS):
+                raise click.ClickException(
+                    'Dynamic pruning only supports tfidf and bm25 on a single index')
+
+            if pruning != 'none' and top_k == 0:
+                raise click.ClickException('Dynamic pruning requires --top_k')
+
+            if batch_size > 1 and (use_impacts or use_shards or use_segments or
+                                   pruning != 'none' or use_numpy):
+                raise click.ClickException('--batch_size only applies to the exhaustive search')
+
+            if num_workers > 1 and (use_shards or use_segments):
+                raise click.ClickException('Shards and segments are searched in parallel already')
+
+            document_filter = None
+
+            if boolean_filter:
+                if use_impacts or use_shards or use_segments or num_workers > 1:
+                    raise click.ClickException(
+                        '--filter only applies to a single index searched without impacts in one process')
+
+                positions_table = open_positions(index_file) \
+                    if os.path.exists(index_file + POSITIONS_SUFFIX) else None
+
+                try:
+                    query = parse_boolean_query(boolean_filter, preprocessor,
+                                                strip_html_tags=enable_strip_html_tags,
+                                                strip_html_entities=enable_strip_html_entities,
+                                                strip_square_bracket_tags=enable_strip_square_bracket_tags)
+                    document_filter = evaluate_boolean_query(number_of_documents, index,
+                                                             query, positions_table)
+                except ValueError as e:
+                    raise click.ClickException(str(e))
+
+                click.echo(f'{len(document_filter)} documents match {query}')
+
+            champions = None
+            counters = Counter()
+
+            if use_champions:
+                if use_impacts or use_shards or use_segments or num_workers > 1 or \
+                        batch_size > 1 or boolean_filter:
+                    raise click.ClickException(
+                        '--use_champions only applies to a single index searched query by query '
+                        'without impacts or filters in one process')
+
+                try:
+                    champions = open_champions(index_file)
+                    check_champions(champions, ranking_method, params)
+                except ValueError as e:
+                    raise click.ClickException(str(e))
+
+            if use_impacts:
+                impacts = load_impacts(index_file)
+
+                try:
+                    check_impacts(impacts, ranking_method, params)
+                except ValueError as e:
+                    raise click.ClickException(str(e))
+
             generate_qrel(number_of_documents,
                           index,
                           document_stats,
+                          docnos,
                           topics,
                           output_file,
                           ranking_method,
-                          run_name, params)
+                          run_name, params,
+                          impacts=impacts,
+                          pruning=None if pruning == 'none' else pruning,
+                          top_k=top_k or None,
+                          use_numpy=use_numpy,
+                          batch_size=batch_size,
+                          num_workers=num_workers,
+                          document_filter=document_filter,
+                          champions=champions,
+                          min_candidates=min_candidates or None,
+                          counters=counters)
+
+            if use_champions:
+                click.echo(f'Champion lists: {counters["candidates"] / max(counters["queries"], 1):.0f} '
+                           f'candidates per topic, {counters["fallbacks"]} of {counters["queries"]} '
+                           f'topics searched the whole index')
+
+            if isinstance(index, PostingCache):
+                click.echo(f'Posting cache: {index.stats()}')
 
         ctx.obj['RUNNER'] = run_eval
 
@@ -0,0 +1,141 @@
+from preprocessing import create_preprocessor
+from segments import create_segments, add_segment, delete_documents, merge_segments, \
+    read_manifest, MANIFEST_FILENAME
+
+import os
+import glob
+import nltk
+import click
+
+
+@click.group()
+@click.option('--segments_dir', required=True,
+              help='Directory of the segmented index')
+@click.pass_context
+def cli(ctx, segments_dir):
+    ctx.obj['SEGMENTS_DIR'] = segments_dir
+
+
+@cli.command()
+@click.option('--document_folder', required=True, type=click.Path(exists=True),
+              help='Path to the folder which contains the documents to be indexed')
+@click.option('--max_tokens_per_block', default=10000000, show_default=True,
+              help='Maximum number of tokens allowed in a single spimi block')
+@click.option('--merge/--no_merge', default=True, show_default=True,
+              help='Apply the merge policy after adding the segment')
+@click.option('--merge_factor', default=10, show_default=True,
+              help='Number of segments of the same size which are merged')
+@click.option('--enable_case_folding/--disable_case_folding',
+              default=True, show_default=True,
+              help='Enable/Disable case folding during preprocessing')
+@click.option('--enable_stemmer/--disable_stemmer',
+              default=True, show_default=True,
+              help='Enable/Disable stemmer during preprocessing')
+@click.option('--enable_lemmatizer/--disable_lemmatizer',
+              default=False, show_default=True,
+              help='Enable/Disable lemmatizer during preprocessing')
+@click.option('--enable_remove_stop_words/--disable_remove_stop_words',
+              default=True, show_default=True,
+              help='Enable/Disable removal of stop words during preprocessing')
+@click.option('--min_word_length',
+              default=2, show_default=True,
+              help='Minimum word length. Words shorter than the given length are ignored')
+@click.option('--enable_strip_html_tags/--disable_strip_html_tags',
+              default=True, show_default=True,
+              help='Enable/Disable removal of html tags')
+@click.option('--enable_strip_html_entities/--disable_strip_html_entities',
+              default=True, show_default=True,
+              help='Enable/Disable removal of html entities, like "&amp;"')
+@click.option('--enable_strip_square_bracket_tags/--disable_strip_square_bracket_tags',
+              default=True, show_default=True,
+              help='Enable/Disable removal of tags in square brackets, like "[BR]"')
+@click.pass_context
+def add(ctx, document_folder, max_tokens_per_block, merge, merge_factor,
+        enable_case_folding, enable_stemmer, enable_lemmatizer,
+        enable_remove_stop_words, min_word_length,
+        enable_strip_html_tags, enable_strip_html_entities,
+        enable_strip_square_bracket_tags):
+    """Indexes the documents of the given folder into a new segment
+    """
+    if enable_lemmatizer:
+        nltk.download('wordnet')
+
+    segments_dir = ctx.obj['SEGMENTS_DIR']
+
+    if not os.path.exists(os.path.join(segments_dir, MANIFEST_FILENAME)):
+        click.echo(f'Creating segmented index in {segments_dir}')
+        create_segments(segments_dir)
+
+    preprocessor = create_preprocessor(enable_case_folding=enable_case_folding,
+                                       enable_remove_stop_words=enable_remove_stop_words,
+                                       enable_stemmer=enable_stemmer,
+                                       enable_lemmatizer=enable_lemmatizer,
+                                       min_length=min_word_length)
+
+    glob_pattern = document_folder + '/**'
+    document_files = [fname for fname in glob.glob(glob_pattern, recursive=True) if os.path.isfile(fname)]
+
+    click.echo()
+    click.echo('Processing {} file(s)'.format(len(document_files)))
+    click.echo()
+
+    name = add_segment(segments_dir, document_files, preprocessor,
+                       max_tokens_per_block=max_tokens_per_block,
+                       strip_html_tags=enable_strip_html_tags,
+                       strip_html_entities=enable_strip_html_entities,
+                       strip_square_bracket_tags=enable_strip_square_bracket_tags)
+    click.echo(f'Added segment {name}')
+
+    if merge:
+        merge_segments(segments_dir, merge_factor=merge_factor)
+
+
+@cli.command()
+@click.option('--docno', multiple=True,
+              help='Document number of a document to delete (can be repeated)')
+@click.option('--docnos_file', type=click.Path(exists=True),
+              help='File containing one document number per line')
+@click.pass_context
+def delete(ctx, docno, docnos_file):
+    """Marks documents as deleted
+    """
+    docnos = list(docno)
+
+    if docnos_file:
+        with open(docnos_file) as f:
+            docnos += [line.strip() for line in f if line.strip()]
+
+    number_of_deleted = delete_documents(ctx.obj['SEGMENTS_DIR'], docnos)
+    click.echo(f'Deleted {number_of_deleted} document(s)')
+
+
+@cli.command()
+@click.option('--merge_factor', default=10, show_default=True,
+              help='Number of segments of the same size which are merged')
+@click.option('--max_deleted_ratio', default=0.3, show_default=True,
+              help='Segments with a higher ratio of deleted documents are rewritten')
+@click.pass_context
+def merge(ctx, merge_factor, max_deleted_ratio):
+    """Applies the merge policy
+    """
+    number_of_merges = merge_segments(ctx.obj['SEGMENTS_DIR'], merge_factor=merge_factor,
+                                      max_deleted_ratio=max_deleted_ratio)
+    click.echo(f'{number_of_merges} merge(s)')
+
+
+@cli.command()
+@click.pass_context
+def info(ctx):
+    """Lists the live segments
+    """
+    manifest = read_manifest(ctx.obj['SEGMENTS_DIR'])
+
+    click.echo('Segment\t\tDocuments\tDeleted')
+
+    for segment in manifest['segments']:
+        click.echo('{}\t{}\t\t{}'.format(segment['name'], segment['number_of_ids'],
+                                         segment['number_of_deleted']))
+
+
+if __name__ == '__main__':
+    cli(obj={})
@@ -0,0 +1,115 @@
+from preprocessing import create_preprocessor, split_words
+from server import SearchService, create_server
+from caching import ResultCache
+import nltk
+import click
+
+
+@click.command()
+@click.option('--index_file', required=True, type=click.Path(exists=True),
+              help='Path to index file')
+@click.option('--stats_file', required=True, type=click.Path(exists=True),
+              help='Path to document stats file')
+@click.option('--host', default='127.0.0.1', show_default=True,
+              help='Host to listen on')
+@click.option('--port', default=8080, show_default=True,
+              help='Port to listen on')
+@click.option('--unix_socket',
+              help='Listen on the given UNIX socket instead of host and port')
+@click.option('--cache_entries', default=10000, show_default=True,
+              help='Maximum number of cached query results (0 disables the cache)')
+@click.option('--cache_megabytes', default=None, type=float,
+              help='Maximum size of the cached query results')
+@click.option('--posting_cache_megabytes', default=0, show_default=True,
+              help='Memory budget for decoded posting lists of frequent terms (0 disables the cache)')
+@click.option('--prewarm_query_log', type=click.Path(exists=True),
+              help='File with one query per line, the posting lists of its most frequent terms are cached at startup')
+@click.option('--prewarm_top_terms', default=0, show_default=True,
+              help='Number of terms with the highest document frequencies cached at startup')
+@click.option('--verbose/--quiet', default=False, show_default=True,
+              help='Log every request')
+@click.option('--enable_case_folding/--disable_case_folding',
+              default=True, show_default=True,
+              help='Enable/Disable case folding during preprocessing')
+@click.option('--enable_stemmer/--disable_stemmer',
+              default=True, show_default=True,
+              help='Enable/Disable stemmer during preprocessing')
+@click.option('--enable_lemmatizer/--disable_lemmatizer',
+              default=False, show_default=True,
+              help='Enable/Disable lemmatizer during preprocessing')
+@click.option('--enable_remove_stop_words/--disable_remove_stop_words',
+              default=True, show_default=True,
+              help='Enable/Disable removal of stop words during preprocessing')
+@click.option('--min_word_length',
+              default=2, show_default=True,
+              help='Minimum word length. Words shorter than the given length are ignored')
+@click.option('--enable_strip_html_tags/--disable_strip_html_tags',
+              default=True, show_default=True,
+              help='Enable/Disable removal of html tags')
+@click.option('--enable_strip_html_entities/--disable_strip_html_entities',
+              default=True, show_default=True,
+              help='Enable/Disable removal of html entities, like "&amp;"')
+@click.option('--enable_strip_square_bracket_tags/--disable_strip_square_bracket_tags',
+              default=True, show_default=True,
+              help='Enable/Disable removal of tags in square brackets, like "[BR]"')
+def cli(index_file, stats_file, host, port, unix_socket,
+        cache_entries, cache_megabytes,
+        posting_cache_megabytes, prewarm_query_log, prewarm_top_terms, verbose,
+        enable_case_folding, enable_stemmer, enable_lemmatizer,
+        enable_remove_stop_words, min_word_length,
+        enable_strip_html_tags, enable_strip_html_entities,
+        enable_strip_square_bracket_tags):
+    """Loads the index once and answers json search requests over HTTP
+    """
+    if enable_lemmatizer:
+        nltk.download('wordnet')
+
+    preprocess = create_preprocessor(enable_case_folding=enable_case_folding,
+                                     enable_remove_stop_words=enable_remove_stop_words,
+                                     enable_stemmer=enable_stemmer,
+                                     enable_lemmatizer=enable_lemmatizer,
+                                     min_length=min_word_length)
+
+    cache = None
+
+    if cache_entries > 0:
+        cache = ResultCache(max_entries=cache_entries,
+                            max_bytes=int(cache_megabytes * 1024 * 1024) if cache_megabytes else None)
+
+    prewarm_queries = []
+
+    if prewarm_query_log:
+        with open(prewarm_query_log) as f:
+            prewarm_queries = [preprocess(split_words(
+                line,
+                strip_html_tags=enable_strip_html_tags,
+                strip_html_entities=enable_strip_html_entities,
+                strip_square_bracket_tags=enable_strip_square_bracket_tags)) for line in f]
+
+    click.echo(f'Opening search index {index_file}')
+    service = SearchService(index_file, stats_file, preprocess,
+                            strip_html_tags=enable_strip_html_tags,
+                            strip_html_entities=enable_strip_html_entities,
+                            strip_square_bracket_tags=enable_strip_square_bracket_tags,
+                            cache=cache,
+                            posting_cache_bytes=posting_cache_megabytes * 1024 * 1024,
+                            prewarm_queries=prewarm_queries,
+                            prewarm_top_terms=prewarm_top_terms)
+    click.echo('done')
+
+    server = create_server(service, host=host, port=port, unix_socket=unix_socket,
+                           verbose=verbose)
+
+    click.echo('Listening on {}'.format(f'unix:{unix_socket}' if unix_socket
+                                        else f'http://{host}:{port}'))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    cli()
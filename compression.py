@@ -0,0 +1,261 @@
+import numpy as np
+from itertools import accumulate
+
+
+POSTINGS_BLOCK_SIZE = 128
+
+
+def encode_postings(postings_list):
+    """Encodes a posting list using delta and variable byte encoding
+
+    The posting list has to be sorted by document id. Postings are split
+    into blocks of POSTINGS_BLOCK_SIZE postings. Document ids are stored as
+    gaps to their predecessor (the first gap of a block refers to the last
+    document of the previous block). Within a block all gaps are written
+    first, followed by all term frequencies:
+    <GAP_1>...<GAP_N><TERM_FREQUENCY_1>...<TERM_FREQUENCY_N>
+
+    Posting lists with more than one block start with a skip table, which
+    contains one entry per block: the block's last document id (as gap to
+    the previous entry) and the block's length in bytes
+    <SKIP_TABLE><BLOCK_1>...<BLOCK_M>
+    """
+    postings_list = list(postings_list)
+    blocks = []
+    skips = []
+    previous_document_id = 0
+    previous_last_document_id = 0
+
+    for start in range(0, len(postings_list), POSTINGS_BLOCK_SIZE):
+        gaps = []
+        term_frequencies = []
+
+        for document_id, term_frequency in postings_list[start:start + POSTINGS_BLOCK_SIZE]:
+            if document_id < previous_document_id:
+                raise ValueError('Posting list is not sorted by document id')
+
+            gaps.append(document_id - previous_document_id)
+            term_frequencies.append(term_frequency)
+            previous_document_id = document_id
+
+        block = encode_variable_byte(gaps + term_frequencies)
+        blocks.append(block)
+
+        skips.append(previous_document_id - previous_last_document_id)
+        skips.append(len(block))
+        previous_last_document_id = previous_document_id
+
+    if len(blocks) > 1:
+        blocks.insert(0, encode_variable_byte(skips))
+
+    return b''.join(blocks)
+
+
+def decode_postings(data, document_frequency):
+    """Decodes a posting list created by encode_postings and returns it as
+    a list of (document_id, term_frequency) tuples
+    """
+    numbers = decode_variable_byte(data)
+
+    number_of_blocks = number_of_posting_blocks(document_frequency)
+    position = 2 * number_of_blocks if number_of_blocks > 1 else 0
+
+    gaps = []
+    term_frequencies = []
+
+    for start in range(0, document_frequency, POSTINGS_BLOCK_SIZE):
+        block_length = min(POSTINGS_BLOCK_SIZE, document_frequency - start)
+
+        gaps += numbers[position:position + block_length]
+        term_frequencies += numbers[position + block_length:position + 2 * block_length]
+        position += 2 * block_length
+
+    return list(zip(accumulate(gaps), term_frequencies))
+
+
+def decode_postings_arrays(data, document_frequency):
+    """Decodes a posting list created by encode_postings into two numpy
+    arrays, the document ids and the term frequencies
+    """
+    numbers = decode_variable_byte_array(data)
+
+    number_of_blocks = number_of_posting_blocks(document_frequency)
+    position = 2 * number_of_blocks if number_of_blocks > 1 else 0
+
+    gaps = np.empty(document_frequency, dtype=np.int64)
+    term_frequencies = np.empty(document_frequency, dtype=np.int64)
+
+    for start in range(0, document_frequency, POSTINGS_BLOCK_SIZE):
+        block_length = min(POSTINGS_BLOCK_SIZE, document_frequency - start)
+
+        gaps[start:start + block_length] = numbers[position:position + block_length]
+        term_frequencies[start:start + block_length] = \
+            numbers[position + block_length:position + 2 * block_length]
+        position += 2 * block_length
+
+    return (np.cumsum(gaps), term_frequencies)
+
+
+def encode_positions(positions_lists):
+    """Encodes the in-document positions of a posting list using delta and
+    variable byte encoding
+
+    positions_lists holds the ascending positions of each posting, in
+    posting order. Like the postings, they are split into blocks of
+    POSTINGS_BLOCK_SIZE postings. Within a block the positions of each
+    posting are stored as gaps to their predecessor (the first one as is):
+    <POSITIONS_1>...<POSITIONS_N>
+
+    The number of positions of a posting is its term frequency, which is
+    not stored again. Position lists with more than one block start with a
+    skip table holding the length in bytes of each block
+    <SKIP_TABLE><BLOCK_1>...<BLOCK_M>
+    """
+    blocks = []
+
+    for start in range(0, len(positions_lists), POSTINGS_BLOCK_SIZE):
+        gaps = []
+
+        for positions in positions_lists[start:start + POSTINGS_BLOCK_SIZE]:
+            previous_position = 0
+
+            for position in positions:
+                if position < previous_position:
+                    raise ValueError('Positions are not sorted')
+
+                gaps.append(position - previous_position)
+                previous_position = position
+
+        blocks.append(encode_variable_byte(gaps))
+
+    if len(blocks) > 1:
+        blocks.insert(0, encode_variable_byte([len(block) for block in blocks]))
+
+    return b''.join(blocks)
+
+
+def decode_positions(data, term_frequencies, posting_indices, offset=0, length=None):
+    """Decodes the positions of the given postings (indexes into the posting
+    list, ascending) from a position list created by encode_positions,
+    which occupies length bytes (by default the rest of data) starting at
+    offset. term_frequencies holds the term frequency of every posting of
+    the list
+
+    Only the blocks which contain the requested postings are decoded.
+    Returns a numpy array of positions per requested posting
+    """
+    document_frequency = len(term_frequencies)
+    number_of_blocks = number_of_posting_blocks(document_frequency)
+
+    if length is None:
+        length = len(data) - offset
+
+    block_offsets = [offset]
+    block_lengths = [length]
+
+    if number_of_blocks > 1:
+        block_lengths = []
+
+        for _ in range(number_of_blocks):
+            (block_length, offset) = read_variable_byte(data, offset)
+            block_lengths.append(block_length)
+
+        block_offsets = list(accumulate([offset] + block_lengths[:-1]))
+
+    result = []
+    current_block = None
+
+    for i in posting_indices:
+        block = i // POSTINGS_BLOCK_SIZE
+
+        if block != current_block:
+            start = block_offsets[block]
+            gaps = decode_variable_byte_array(data[start:start + block_lengths[block]])
+            block_start = block * POSTINGS_BLOCK_SIZE
+            ends = np.cumsum(term_frequencies[block_start:block_start + POSTINGS_BLOCK_SIZE])
+            current_block = block
+
+        j = i - block_start
+        result.append(np.cumsum(gaps[ends[j] - term_frequencies[i]:ends[j]]))
+
+    return result
+
+
+def number_of_posting_blocks(document_frequency):
+    return (document_frequency + POSTINGS_BLOCK_SIZE - 1) // POSTINGS_BLOCK_SIZE
+
+
+def encode_variable_byte(numbers):
+    """Encodes the given non-negative integers using variable byte encoding
+
+    See https://nlp.stanford.edu/IR-book/html/htmledition/variable-byte-codes-1.html
+    """
+    result = bytearray()
+
+    for number in numbers:
+        encoded = [number & 127]
+        number >>= 7
+
+        while number:
+            encoded.append(number & 127)
+            number >>= 7
+
+        # the high bit marks the last byte of a number
+        encoded[0] |= 128
+        encoded.reverse()
+        result += bytes(encoded)
+
+    return bytes(result)
+
+
+def read_variable_byte(data, offset):
+    """Decodes a single variable byte encoded number starting at the given
+    offset. Returns the number and the offset of the following byte
+    """
+    number = 0
+
+    while True:
+        byte = data[offset]
+        offset += 1
+
+        if byte < 128:
+            number = (number << 7) | byte
+        else:
+            return ((number << 7) | (byte & 127), offset)
+
+
+def decode_variable_byte(data):
+    """Decodes a byte sequence created by encode_variable_byte
+    """
+    numbers = []
+    number = 0
+
+    for byte in data:
+        if byte < 128:
+            number = (number << 7) | byte
+        else:
+            numbers.append((number << 7) | (byte & 127))
+            number = 0
+
+    return numbers
+
+
+def decode_variable_byte_array(data):
+    """Decodes a byte sequence created by encode_variable_byte into a numpy
+    array without looping over the bytes in python
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+
+    if not len(data):
+        return np.zeros(0, dtype=np.int64)
+
+    is_last = data >= 128
+    ends = np.flatnonzero(is_last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+
+    # number of bytes which follow each byte within its number
+    number_index = np.cumsum(is_last) - is_last
+    remaining = ends[number_index] - np.arange(len(data))
+
+    values = (data & 127).astype(np.int64) << (7 * remaining)
+    return np.add.reduceat(values, starts)
@@ -1,11 +1,20 @@
 import re
 import codecs
 import gc
+import math
 from tqdm import tqdm
 from collections import namedtuple
 
 from preprocessing import split_words, create_preprocessor
-from searching import simple_tfidf_search, cosine_tfidf_search, simple_bm25_search, simple_bm25va_search
+from searching import search, batch_search, create_lexicon, create_filtered_lexicon, \
+    impact_search, check_impacts, create_scoring_context, DEFAULT_TOP_K
+from sharding import ShardedIndex
+from segments import SegmentedIndex
+from pruning import top_k_search
+from kernels import numpy_search
+from tiers import tiered_lexicon, check_champions
+from indexing import open_index, load_document_stats, load_impacts, load_bounds
+from pathos.multiprocessing import ProcessingPool
 
 
 TOP_PATTERN = re.compile(r'<top>(.*?)<\/top>', re.DOTALL | re.M)
@@ -14,48 +23,222 @@ START_TAG_PATTERN = re.compile(r'^<(.*?)>.*')
 Topic = namedtuple('Topic', ['id', 'title', 'narr', 'desc'])
 
 
-def generate_qrel(number_of_documents, index, document_stats, topics,
-                  output_filepath, ranking_method, run_name, params={}):
+def generate_qrel(number_of_documents, index, document_stats, docnos, topics,
+                  output_filepath, ranking_method, run_name, params={},
+                  impacts=None, pruning=None, top_k=DEFAULT_TOP_K,
+                  use_numpy=False, batch_size=1, num_workers=1, document_filter=None,
+                  champions=None, min_candidates=None, counters=None):
+    """Ranks the documents for all topics and writes the top_k (all if None)
+    documents of each topic to output_filepath in trec_eval format. The
+    results of a topic are written as soon as it has been searched
+
+    If pruning ('wand' or 'maxscore') is given, the top_k documents are
+    retrieved using dynamic pruning (see pruning.py). use_numpy selects the
+    vectorized scoring kernels (see kernels.py). With a batch_size > 1 the
+    topics are searched in batches which share the posting list traversals
+    of their terms (see searching.batch_search)
+
+    With num_workers > 1 the topics are split into slices which are searched
+    by a pool of worker processes. The workers memory-map the index and
+    document stats files themselves instead of receiving a copy, the results
+    are written in topic order
+
+    document_filter optionally restricts the results to the documents of a
+    bitmaps.RoaringBitmap (see boolean.evaluate_boolean_query), only these
+    documents are scored
+
+    champions (see indexing.open_champions) selects the tiered search: only
+    the documents of the champion lists of the query terms are scored,
+    unless there are less than min_candidates (by default top_k) of them
+    (see tiers.tiered_lexicon). counters optionally collects the number of
+    candidates and fallbacks
+    """
+
+    print('Generating ranking using', ranking_method)
+
+    if not isinstance(index, (ShardedIndex, SegmentedIndex)):
+        index = create_lexicon(index)
+
+    if impacts is not None:
+        check_impacts(impacts, ranking_method, params)
+
+    if champions is not None:
+        check_champions(champions, ranking_method, params)
+
+    if batch_size > 1 and (impacts is not None or pruning is not None or use_numpy or
+                           isinstance(index, (ShardedIndex, SegmentedIndex))):
+        raise ValueError('Batches are only supported by the exhaustive search')
+
+    if document_filter is not None and (impacts is not None or num_workers > 1 or
+                                        isinstance(index, (ShardedIndex, SegmentedIndex))):
+        raise ValueError('Document filters are only supported on a single index '
+                         'searched without impacts in one process')
+
+    if champions is not None and (impacts is not None or num_workers > 1 or batch_size > 1 or
+                                  document_filter is not None or
+                                  isinstance(index, (ShardedIndex, SegmentedIndex))):
+        raise ValueError('Champion lists are only supported on a single index searched '
+                         'query by query without impacts or filters in one process')
+
+    if min_candidates is None:
+        min_candidates = top_k if top_k is not None else math.inf
+
+    queries = [topic.title | topic.desc for topic in topics]
+
+    if num_workers > 1:
+        if isinstance(index, (ShardedIndex, SegmentedIndex)):
+            raise ValueError('Sharded and segmented indexes can not be searched by workers')
+
+        if not hasattr(index, 'filepath') or \
+                (document_stats is not None and document_stats.filepath is None):
+            raise ValueError('Workers require an index and document stats opened from files')
+
+        results = __search_in_parallel(index.filepath,
+                                       document_stats.filepath if document_stats else None,
+                                       queries, ranking_method, params, impacts is not None,
+                                       pruning, top_k, use_numpy, batch_size, num_workers)
+    else:
+        bounds = load_bounds(index.filepath) if pruning is not None else None
+        scoring_context = None
+
+        if document_stats is not None and impacts is None and \
+                not isinstance(index, (ShardedIndex, SegmentedIndex)):
+            scoring_context = create_scoring_context(document_stats, ranking_method, params)
+
+        if document_filter is not None:
+            index = create_filtered_lexicon(index, set().union(*queries),
+                                            document_filter.contains)
+
+        results = __search_topics(number_of_documents, index, document_stats, impacts,
+                                  bounds, scoring_context, queries, ranking_method, params,
+                                  pruning, top_k, use_numpy, batch_size,
+                                  champions, min_candidates, counters)
+
+    with open(output_filepath, 'w') as f:
+        for i, (topic, document_scores) in enumerate(zip(topics, tqdm(results, total=len(queries)))):
+            for rank, (document_id, score) in enumerate(document_scores):
+                f.write('{} Q0 {} {} {:6f} {}\n'.format(topic.id, docnos[document_id],
+                                                        rank+1, score, run_name))
+
+            if i % 5 == 0:
+                gc.collect()
+
+
+def search_topics(index_filepath, stats_filepath, queries, ranking_method, params,
+                  use_impacts, pruning, top_k, use_numpy, batch_size):
+    """Searches a slice of the topics and returns their results. Runs in the
+    worker processes of generate_qrel, the index files are opened once per
+    process
+    """
+    key = (index_filepath, stats_filepath, use_impacts, pruning, ranking_method,
+           params.get('b'))
+
+    if key not in __open_indexes:
+        (number_of_documents, index) = open_index(index_filepath)
+
+        document_stats = load_document_stats(stats_filepath) if stats_filepath else None
+        impacts = load_impacts(index_filepath) if use_impacts else None
+        bounds = load_bounds(index_filepath) if pruning is not None else None
+        scoring_context = None
+
+        if document_stats is not None and not use_impacts:
+            scoring_context = create_scoring_context(document_stats, ranking_method, params)
+
+        __open_indexes[key] = (number_of_documents, index, document_stats, impacts, bounds,
+                               scoring_context)
+
+    (number_of_documents, index, document_stats, impacts, bounds,
+     scoring_context) = __open_indexes[key]
+
+    return list(__search_topics(number_of_documents, index, document_stats, impacts,
+                                bounds, scoring_context, queries, ranking_method, params,
+                                pruning, top_k, use_numpy, batch_size))
+
+
+# indexes opened by search_topics, per worker process
+__open_indexes = {}
+
+
+def __search_in_parallel(index_filepath, stats_filepath, queries, ranking_method, params,
+                         use_impacts, pruning, top_k, use_numpy, batch_size, num_workers):
+    """Yields the results of the given queries in order, while slices of the
+    queries are searched by num_workers processes
+    """
+    # several slices per worker, so that workers which finish early pick up
+    # the remaining ones
+    slice_size = max(1, math.ceil(len(queries) / (num_workers * 4)))
+    slices = [queries[i:i + slice_size] for i in range(0, len(queries), slice_size)]
+
+    n = len(slices)
+    pool = ProcessingPool(nodes=num_workers)
+
+    for slice_results in pool.imap(search_topics, [index_filepath] * n, [stats_filepath] * n,
+                                   slices, [ranking_method] * n, [params] * n,
+                                   [use_impacts] * n, [pruning] * n, [top_k] * n,
+                                   [use_numpy] * n, [batch_size] * n):
+        yield from slice_results
+
+
+def __search_topics(number_of_documents, index, document_stats, impacts, bounds,
+                    scoring_context, queries, ranking_method, params, pruning, top_k,
+                    use_numpy, batch_size, champions=None, min_candidates=None,
+                    counters=None):
+    """Yields the results of the given queries
+    """
+    if batch_size > 1:
+        for i in range(0, len(queries), batch_size):
+            yield from batch_search(number_of_documents, index, document_stats,
+                                    queries[i:i + batch_size], ranking_method, params,
+                                    top_k=top_k, scoring_context=scoring_context)
+        return
+
+    for search_terms in queries:
+        query_index = index
+
+        if champions is not None:
+            query_index = tiered_lexicon(index, champions, search_terms, min_candidates,
+                                         counters)
+
+        if impacts is not None:
+            yield impact_search(index, impacts, search_terms,
+                                ranking_method, params, top_k=top_k)
+        elif pruning is not None:
+            yield top_k_search(number_of_documents, query_index, bounds,
+                               search_terms, ranking_method,
+                               document_stats, params, top_k,
+                               algorithm=pruning,
+                               scoring_context=scoring_context)
+        elif isinstance(index, (ShardedIndex, SegmentedIndex)):
+            yield index.search(search_terms, ranking_method, params,
+                               top_k=top_k)
+        elif use_numpy:
+            yield numpy_search(number_of_documents, query_index, document_stats,
+                               search_terms, ranking_method, params,
+                               top_k=top_k, scoring_context=scoring_context)
+        else:
+            yield search(number_of_documents, query_index, document_stats,
+                         search_terms, ranking_method, params,
+                         top_k=top_k, scoring_context=scoring_context)
+
+
+def generate_remote_qrel(client, topics, output_filepath, ranking_method, run_name,
+                         params={}, top_k=DEFAULT_TOP_K):
+    """Like generate_qrel, but sends the topics to a search server (see
+    server.SearchClient) instead of searching a local index
+    """
 
     print('Generating ranking using', ranking_method)
-    topic_scores = []
-
-    for i, topic in enumerate(tqdm(topics)):
-        search_terms = topic.title | topic.desc
-
-        document_scores = None
-
-        if ranking_method == 'tfidf':
-            document_scores = simple_tfidf_search(number_of_documents, index,
-                                                  search_terms)
-        elif ranking_method == 'cosine_tfidf':
-            document_scores = cosine_tfidf_search(number_of_documents, index,
-                                                  search_terms)
-        elif ranking_method == 'bm25':
-            document_scores = simple_bm25_search(number_of_documents, index,
-                                                 search_terms, document_stats,
-                                                 k1=params['k1'],
-                                                 b=params['b'],
-                                                 k3=params['k3'])
-        elif ranking_method == 'bm25va':
-            document_scores = simple_bm25va_search(number_of_documents, index,
-                                                   search_terms,
-                                                   document_stats,
-                                                   k1=params['k1'],
-                                                   k3=params['k3'])
-
-        for document_score in document_scores:
-            topic_scores.append((topic.id, document_score[1], document_score[0]))
-
-        if i % 5 == 0:
-            gc.collect()
 
     with open(output_filepath, 'w') as f:
-        for rank, topic_score in enumerate(topic_scores):
-            (topic_id, score, document_id) = topic_score
+        for topic in tqdm(topics):
+            search_terms = sorted(topic.title | topic.desc)
 
-            f.write('{} Q0 {} {} {:6f} {}\n'.format(topic_id, document_id,
-                                                    rank+1, score, run_name))
+            document_scores = client.search(search_terms, ranking_method, params,
+                                            top_k=top_k)
+
+            for rank, (docno, score) in enumerate(document_scores):
+                f.write('{} Q0 {} {} {:6f} {}\n'.format(topic.id, docno,
+                                                        rank+1, score, run_name))
 
 
 def load_topic_tokens(file_path, encoding='latin-1',
@@ -87,6 +270,54 @@ def load_topic_tokens(file_path, encoding='latin-1',
     return result
 
 
+def load_qrels(file_path):
+    """Loads relevance judgements in trec_eval format ('<topic> 0 <docno>
+    <relevance>') and returns a dict which maps topic ids to the set of
+    document numbers judged relevant
+    """
+    qrels = {}
+
+    with open(file_path) as f:
+        for line in f:
+            fields = line.split()
+
+            if len(fields) != 4:
+                continue
+
+            (topic_id, _, docno, relevance) = fields
+            relevant = qrels.setdefault(topic_id, set())
+
+            if int(relevance) > 0:
+                relevant.add(docno)
+
+    return qrels
+
+
+def mean_average_precision(rankings, qrels):
+    """Returns the mean average precision of the given rankings (a dict
+    which maps topic ids to ranked lists of document numbers) like
+    trec_eval -c -m map: topics without relevant documents are ignored,
+    topics without results count as 0
+    """
+    average_precisions = []
+
+    for topic_id, relevant in qrels.items():
+        if not relevant:
+            continue
+
+        hits = 0
+        precisions = 0.0
+
+        for rank, docno in enumerate(rankings.get(topic_id, []), 1):
+            if docno in relevant:
+                hits += 1
+                precisions += hits / rank
+
+        average_precisions.append(precisions / len(relevant))
+
+    return sum(average_precisions) / len(average_precisions) if average_precisions else 0.0
+
+
 def __regex_parse_topics_from_file(file_path, encoding='latin-1'):
     """Loads all topic from the given file using REGEX and returns them
     """
@@ -1,23 +1,112 @@
 import json
+import math
 import tempfile
 import gc
 import os
 import glob
-import shutil
+import mmap
+import struct
+import numpy as np
 from collections import defaultdict, namedtuple, Counter
+from itertools import groupby
+from operator import itemgetter
 from pathos.multiprocessing import ProcessingPool
+from compression import encode_postings, encode_positions, decode_positions, \
+    encode_variable_byte, decode_variable_byte_array, read_variable_byte
+from postings import BlockPostingCursor, LazyPostings, postings_arrays
 from tokenization import generate_tokens_for_files, generate_tokens_for_files_distributed
 
 
 Token = namedtuple('Token', ['position', 'term', 'document_frequency', 'postings'])
 
+Impacts = namedtuple('Impacts', ['scorer', 'params', 'scale', 'bases', 'values'])
+
+# champion lists and the scorer which selected them, see create_champions
+Champions = namedtuple('Champions', ['scorer', 'params', 'index'])
+
+# postings of a term which share the same impact, see create_impact_order
+ImpactSegment = namedtuple('ImpactSegment', ['impact', 'number_of_postings', 'offset', 'length'])
+
+DocumentStats = namedtuple('DocumentStats', ['number_of_documents', 'total_length',
+                                             'average_document_length',
+                                             'mean_average_term_frequency',
+                                             'length', 'terms', 'norm', 'filepath'],
+                           defaults=[None, None])
+
+INDEX_FORMAT_VERSION = 7
+LEXICON_SUFFIX = '.lexicon'
+DOCNOS_SUFFIX = '.docnos'
+IMPACTS_SUFFIX = '.impacts'
+BOUNDS_SUFFIX = '.bounds'
+POSITIONS_SUFFIX = '.positions'
+CHAMPIONS_SUFFIX = '.champions'
+CHAMPIONS_METADATA_SUFFIX = '.metadata'
+IMPACT_ORDER_SUFFIX = '.impact_order'
+
+# files which are only written if requested, a rebuild removes the ones of
+# the previous index so they can not be mistaken for the new index's files
+OPTIONAL_SUFFIXES = [POSITIONS_SUFFIX, IMPACTS_SUFFIX, IMPACT_ORDER_SUFFIX,
+                     CHAMPIONS_SUFFIX, CHAMPIONS_SUFFIX + LEXICON_SUFFIX,
+                     CHAMPIONS_SUFFIX + CHAMPIONS_METADATA_SUFFIX]
+
+IMPACT_SCORERS = ['tfidf', 'bm25']
+IMPACT_BITS = 8
+
+POSTINGS_MAGIC = b'IRPS'
+LEXICON_MAGIC = b'IRLX'
+DOCNOS_MAGIC = b'IRDN'
+DOCUMENT_STATS_MAGIC = b'IRDS'
+IMPACTS_MAGIC = b'IRIM'
+BOUNDS_MAGIC = b'IRUB'
+POSITIONS_MAGIC = b'IRPO'
+IMPACT_ORDER_MAGIC = b'IRIO'
+CHAMPIONS_METADATA_MAGIC = b'IRCM'
+
+# magic, format version
+POSTINGS_HEADER = struct.Struct('<4sI')
+# magic, format version, number of documents, number of terms,
+# number of lexicon blocks, number of terms per block
+LEXICON_HEADER = struct.Struct('<4sIQQII')
+LEXICON_BLOCK_OFFSET = struct.Struct('<Q')
+LEXICON_BLOCK_SIZE = 16
+# magic, format version, number of document ids
+DOCNOS_HEADER = struct.Struct('<4sIQ')
+DOCNOS_OFFSET = struct.Struct('<Q')
+# magic, format version, number of documents, total length of all documents,
+# average document length, mean average term frequency
+DOCUMENT_STATS_HEADER = struct.Struct('<4sIQQdd')
+DOCUMENT_STATS_DTYPE = np.dtype('<u4')
+DOCUMENT_NORMS_DTYPE = np.dtype('<f8')
+# magic, format version, scale, number of terms, number of postings,
+# length of the json encoded metadata
+IMPACTS_HEADER = struct.Struct('<4sIdQQQ')
+IMPACTS_BASE_DTYPE = np.dtype('<u8')
+IMPACTS_DTYPE = np.dtype('i1')
+# magic, format version, number of terms
+BOUNDS_HEADER = struct.Struct('<4sIQ')
+BOUNDS_DTYPE = np.dtype('<u4')
+# magic, format version, number of terms, offset of the position list offsets
+POSITIONS_HEADER = struct.Struct('<4sIQQ')
+POSITIONS_OFFSET = struct.Struct('<Q')
+
+IMPACT_ORDER_HEADER = struct.Struct('<4sIQQ')
+IMPACT_ORDER_OFFSET = struct.Struct('<Q')
+# magic, format version, length of the json encoded metadata
+CHAMPIONS_METADATA_HEADER = struct.Struct('<4sIQ')
+
 
 def create_index_simple(document_files, preprocess, output_filepath,
                         document_stats_path,
                         verbose=True,
                         strip_html_tags=True,
                         strip_html_entities=True,
-                        strip_square_bracket_tags=True):
+                        strip_square_bracket_tags=True,
+                        impact_scorer=None,
+                        impact_params=None,
+                        impact_order=False,
+                        champion_list_size=0,
+                        champion_scorer='bm25'):
+    __remove_optional_files(output_filepath)
 
     token_stream = generate_tokens_for_files(document_files,
                                              strip_html_tags=strip_html_tags,
@@ -27,9 +116,9 @@ def create_index_simple(document_files, preprocess, output_filepath,
 
     document_terms_counter = Counter()
     document_length_counter = Counter()
+    docnos = []
 
-    token_list = list(token_stream)
-    num_documents_processed = token_list[-1][-1]
+    token_list = list(__assign_document_ids(token_stream, docnos))
 
     # sort by term
     token_list.sort(key=lambda token: token[1])
@@ -37,15 +126,13 @@ def create_index_simple(document_files, preprocess, output_filepath,
     current_term = None
     document_ids = []
 
-    with open(output_filepath, 'w') as output_file:
-        output_file.write('{}\n'.format(num_documents_processed))
-
+    with IndexWriter(output_filepath, len(docnos)) as index_writer:
         for i, (doc_id, term, _) in enumerate(token_list):
             if term != current_term:
                 # we have encountered a new term. write current term to file
                 # and reset state
                 if document_ids:
-                    __flush_index_entry(output_file, current_term,
+                    __flush_index_entry(index_writer, current_term,
                                         __to_bag_of_words(document_ids),
                                         document_terms_counter,
                                         document_length_counter)
@@ -60,14 +147,30 @@ def create_index_simple(document_files, preprocess, output_filepath,
 
         # write last entry
         if document_ids:
-            __flush_index_entry(output_file, current_term,
+            __flush_index_entry(index_writer, current_term,
                                 __to_bag_of_words(document_ids),
                                 document_terms_counter,
                                 document_length_counter)
 
-    __write_document_stats(document_stats_path,
-                           document_terms_counter,
-                           document_length_counter)
+    write_docnos(output_filepath + DOCNOS_SUFFIX, docnos)
+    write_document_stats_counters(document_stats_path,
+                                  document_terms_counter,
+                                  document_length_counter,
+                                  len(docnos))
+
+    create_document_norms(output_filepath, document_stats_path)
+    create_bounds(output_filepath, document_stats_path)
+
+    if impact_scorer:
+        create_impacts(output_filepath, document_stats_path,
+                       impact_scorer, impact_params)
+
+        if impact_order:
+            create_impact_order(output_filepath)
+
+    if champion_list_size:
+        create_champions(output_filepath, document_stats_path, champion_list_size,
+                         champion_scorer, impact_params)
 
 
 def create_index_spimi(document_files, preprocess, output_filepath,
@@ -76,34 +179,67 @@ def create_index_spimi(document_files, preprocess, output_filepath,
                        max_tokens_per_block=10000000,
                        strip_html_tags=True,
                        strip_html_entities=True,
-                       strip_square_bracket_tags=True):
+                       strip_square_bracket_tags=True,
+                       impact_scorer=None,
+                       impact_params=None,
+                       impact_order=False,
+                       champion_list_size=0,
+                       champion_scorer='bm25',
+                       positional=False):
     """Creates an index using the SPIMI methods
+
+    Positional indexes additionally store the positions of every posting,
+    see IndexWriter
     """
+    __remove_optional_files(output_filepath)
 
     token_stream = generate_tokens_for_files(document_files,
                                              strip_html_tags=strip_html_tags,
                                              strip_html_entities=strip_html_entities,
                                              strip_square_bracket_tags=strip_square_bracket_tags,
-                                             preprocess=preprocess)
+                                             preprocess=preprocess,
+                                             with_positions=positional)
+
+    docnos = []
+    token_stream = __assign_document_ids(token_stream, docnos)
 
     block_filenames = []
     is_exhausted = False
 
-    num_documents_processed = 0
-
     while not is_exhausted:
-        filename, is_exhausted, num_documents_processed = \
-            __spimi_invert(token_stream, max_tokens_per_block=max_tokens_per_block)
+        filename, is_exhausted, _ = \
+            __spimi_invert(token_stream, max_tokens_per_block=max_tokens_per_block,
+                           positional=positional)
 
-        block_filenames.append(filename)
+        # the last block is empty if the number of tokens is a multiple
+        # of max_tokens_per_block
+        if filename:
+            block_filenames.append(filename)
 
     if verbose:
         print('Merging {} block(s)'.format(len(block_filenames)))
         print('This might take a while...')
 
-    with open(output_filepath, 'w') as output_file:
-        output_file.write('{}\n'.format(num_documents_processed))
-        __merge_spimi_blocks(output_file, document_stats_path, block_filenames)
+    with IndexWriter(output_filepath, len(docnos),
+                     positional=positional) as index_writer:
+        __merge_spimi_blocks(index_writer, document_stats_path, block_filenames,
+                             docnos)
+
+    write_docnos(output_filepath + DOCNOS_SUFFIX, docnos)
+
+    create_document_norms(output_filepath, document_stats_path)
+    create_bounds(output_filepath, document_stats_path)
+
+    if impact_scorer:
+        create_impacts(output_filepath, document_stats_path,
+                       impact_scorer, impact_params)
+
+        if impact_order:
+            create_impact_order(output_filepath)
+
+    if champion_list_size:
+        create_champions(output_filepath, document_stats_path, champion_list_size,
+                         champion_scorer, impact_params)
 
 
 def create_index_map_reduce(document_files, preprocess, output_filepath,
@@ -113,7 +249,13 @@ def create_index_map_reduce(document_files, preprocess, output_filepath,
                         strip_html_entities=True,
                         strip_square_bracket_tags=True,
                         blocksize=16,
-                        num_nodes=None):
+                        num_nodes=None,
+                        impact_scorer=None,
+                        impact_params=None,
+                        impact_order=False,
+                        champion_list_size=0,
+                        champion_scorer='bm25',
+                        positional=False):
 
     def __setup():
         if os.path.isdir(segment_path):
@@ -151,6 +293,7 @@ def create_index_map_reduce(document_files, preprocess, output_filepath,
         print("Setting up directories...")
 
     __setup()
+    __remove_optional_files(output_filepath)
 
     if verbose:
         print("Splitting up tasks...")
@@ -177,60 +320,88 @@ def create_index_map_reduce(document_files, preprocess, output_filepath,
     pool.map(__map, splits, [strip_html_tags]*mul,
              [strip_html_entities]*mul,
              [strip_square_bracket_tags]*mul,
-             [preprocess]*mul)
+             [preprocess]*mul,
+             range(mul),
+             [positional]*mul)
+
+    # document ids are assigned per split during the map phase, the global
+    # id of a document is the id within its split plus the split's base
+    docnos = []
+    split_bases = []
+
+    for split_id in range(mul):
+        split_bases.append(len(docnos))
+        with open(segment_path + "docnos_" + str(split_id), "r") as f:
+            docnos.extend(line.rstrip("\n") for line in f)
 
     if verbose:
         print("Map Phase finished")
         print("Starting Reducing/Inverting into {} partitions".format(partitions.__len__()))
 
-    pool.map(__reduce, partitions)
+    pool.map(__reduce, partitions, [split_bases]*len(partitions),
+             [len(docnos)]*len(partitions), [positional]*len(partitions))
 
     if verbose:
         print("Merge Partitions and remove temporary directories")
 
-    with open(output_filepath, 'w') as output_file:
-        files = sorted(glob.glob(posting_path +"res_"+'*'))
-        files_meta = glob.glob(segment_path +"meta_"+"*")
-        num_documents = 0
-
-        for file in files_meta:
-            with open(file, "r") as f:
-                for line in f:
-                    num_documents += int(line.split("\n")[0])
-
-        output_file.write("{}\n".format(num_documents))
-
+    files = sorted([f for f in glob.glob(posting_path + "res_" + '*')
+                    if not f.endswith((LEXICON_SUFFIX, POSITIONS_SUFFIX))])
+    # partitions cover consecutive term ranges, so their posting lists
+    # can be copied over as they are
+    with IndexWriter(output_filepath, len(docnos), positional=positional) as index_writer:
         for file in files:
-            with open(file, 'r') as f:
-                shutil.copyfileobj(f, output_file)
+            partition_index = MappedIndex(file)
+            partition_positions = PositionsTable(file) if positional else None
+            for position, (term, document_frequency, data) in enumerate(partition_index.entries()):
+                index_writer.write_encoded(term, document_frequency, data,
+                                           partition_positions.data(position) if positional else None)
+            partition_index.close()
+            if positional:
+                partition_positions.close()
 
     files = sorted(glob.glob(posting_path+"doc_*"))
 
-    document_length_counter = Counter()
-    document_terms_counter = Counter()
+    document_length_counter = np.zeros(len(docnos), dtype=DOCUMENT_STATS_DTYPE)
+    document_terms_counter = np.zeros(len(docnos), dtype=DOCUMENT_STATS_DTYPE)
 
     for file in files:
         document_stats = load_document_stats(file)
-        document_terms = document_stats['terms']
-        document_length = document_stats['length']
-        for c in document_terms:
-            document_terms_counter[c] += document_terms[c]
-            document_length_counter[c] += document_length[c]
+        document_terms_counter += document_stats.terms
+        document_length_counter += document_stats.length
 
-    __write_document_stats(document_stats_path, document_terms_counter, document_length_counter)
+    write_docnos(output_filepath + DOCNOS_SUFFIX, docnos)
+    write_document_stats_counters(document_stats_path, document_terms_counter, document_length_counter,
+                                  len(docnos))
 
     __down()
 
+    create_document_norms(output_filepath, document_stats_path)
+    create_bounds(output_filepath, document_stats_path)
+
+    if impact_scorer:
+        create_impacts(output_filepath, document_stats_path,
+                       impact_scorer, impact_params)
+
+        if impact_order:
+            create_impact_order(output_filepath)
+
+    if champion_list_size:
+        create_champions(output_filepath, document_stats_path, champion_list_size,
+                         champion_scorer, impact_params)
 
-def __map(split, strip_html_tags,strip_html_entities,strip_square_bracket_tags, preprocess):
+
+def __map(split, strip_html_tags,strip_html_entities,strip_square_bracket_tags, preprocess, split_id,
+          positional=False):
     generate_tokens_for_files_distributed(split,
                                           strip_html_tags=strip_html_tags,
                                           strip_html_entities=strip_html_entities,
                                           strip_square_bracket_tags=strip_square_bracket_tags,
-                                          preprocess=preprocess)
+                                          preprocess=preprocess,
+                                          split_id=split_id,
+                                          with_positions=positional)
 
 
-def __reduce(partition):
+def __reduce(partition, split_bases, number_of_ids, positional=False):
     segment_path = "./segmented_files/"
     posting_path = "./postings/"
 
@@ -269,41 +440,63 @@ def __reduce(partition):
 
     print("reducing {} partition started".format(partition))
 
-    with open(posting_path + partition, "r") as file:
-        output_file = open(posting_path +"res_"+partition, "w")
-        old_key, old_value = file.readline().strip("\n").split(" ")
-        posts = [old_value]
-        document_terms_counter = Counter()
-        document_length_counter = Counter()
+    document_terms_counter = Counter()
+    document_length_counter = Counter()
+
+    def flush(key, posts):
+        if positional:
+            (postings_list, positions) = __to_positional_postings(posts)
+            __flush_index_entry(index_writer, key, postings_list,
+                                document_terms_counter, document_length_counter,
+                                positions)
+        else:
+            __flush_index_entry(index_writer, key, sorted(__to_bag_of_words(posts)),
+                                document_terms_counter, document_length_counter)
+
+    with open(posting_path + partition, "r") as file, \
+            IndexWriter(posting_path + "res_" + partition, positional=positional) as index_writer:
+        old_key = None
+        posts = []
         for line in file:
-            key, value = line.strip("\n").split(" ")
+            fields = line.strip("\n").split(" ")
+            key, split_id, document_id = fields[:3]
+            value = split_bases[int(split_id)] + int(document_id)
             if old_key != key:
-                __flush_index_entry(output_file, old_key, __to_bag_of_words(posts),
-                                    document_terms_counter, document_length_counter)
+                if posts:
+                    flush(old_key, posts)
                 old_key = key
                 posts = []
-            posts.append(value)
-        output_file.flush()
-        output_file.close()
+            # positions are sorted as strings, they are sorted numerically on flush
+            posts.append((value, int(fields[3])) if positional else value)
+
+        # write last entry
+        if posts:
+            flush(old_key, posts)
 
-    __write_document_stats(posting_path + "doc_" + partition, document_terms_counter, document_length_counter)
+    write_document_stats_counters(posting_path + "doc_" + partition, document_terms_counter, document_length_counter,
+                                  number_of_ids)
 
     print("reducing {} partition finished".format(partition))
 
 
-def __spimi_invert(token_stream, max_tokens_per_block):
+def __spimi_invert(token_stream, max_tokens_per_block, positional=False):
     """SPIMI-Invert implementation
 
     See https://nlp.stanford.edu/IR-book/html/htmledition/single-pass-in-memory-indexing-1.html
     """
 
     processed_tokens = 0
+    num_documents_processed = None
     dictionary = defaultdict(list)
 
-    for (doc_id, term, num_documents_processed) in token_stream:
+    for (doc_id, term, num_documents_processed, *position) in token_stream:
         #  returns empty list if term is not yet present (defaultdict)
         postings_list = dictionary[term]
-        postings_list.append(doc_id)
+
+        if positional:
+            postings_list.append((doc_id, position[0]))
+        else:
+            postings_list.append(doc_id)
 
         processed_tokens += 1
 
@@ -318,19 +511,60 @@ def __spimi_invert(token_stream, max_tokens_per_block):
         return (None, is_exhausted, num_documents_processed)
 
     # write block to file
-    filename = __write_spimi_block(dictionary)
+    filename = __write_spimi_block(dictionary, positional)
 
     return (filename, is_exhausted, num_documents_processed)
 
 
-def __merge_spimi_blocks(output_file, document_stats_path, block_filepaths):
-    block_files = list(map(lambda filepath: open(filepath, 'r'), block_filepaths))
+def __merge_spimi_blocks(index_writer, document_stats_path, block_filepaths,
+                         docnos):
+    block_indexes = list(map(lambda filepath: MappedIndex(filepath), block_filepaths))
+    block_positions = None
+
+    if index_writer.positional:
+        block_positions = list(map(lambda filepath: PositionsTable(filepath), block_filepaths))
+
+    # blocks are created in document order, a document might be split
+    # across two blocks though
+    (document_terms_counter, document_length_counter) = \
+        merge_indexes(index_writer, block_indexes, positions_tables=block_positions)
+
+    for block_index in block_indexes:
+        block_index.close()
+        os.remove(block_index.filepath)
+        os.remove(block_index.filepath + LEXICON_SUFFIX)
+
+    for positions_table in block_positions or []:
+        positions_table.close()
+        os.remove(positions_table.filepath)
+
+    write_document_stats_counters(document_stats_path,
+                                  document_terms_counter,
+                                  document_length_counter,
+                                  len(docnos))
 
-    head_entries = list(map(lambda file: __read_token(file), block_files))
-    head_terms = list(map(lambda entry: entry.term, head_entries))
 
-    num_files = len(block_filepaths)
-    num_closed = 0
+def merge_indexes(index_writer, indexes, document_id_maps=None,
+                  positions_tables=None):
+    """Merges the posting lists of the given indexes term by term and writes
+    them using the given index writer. Returns counters of the number of
+    unique terms and the length of each (merged) document
+
+    document_id_maps optionally provides an array per index which maps its
+    document ids to the ids in the merged index, postings of documents
+    mapped to -1 are dropped
+
+    For positional indexes, positions_tables provides the PositionsTable of
+    each index. Positions of a document which occurs in several indexes are
+    concatenated in index order
+    """
+    index_files = list(map(lambda index: iter(index), indexes))
+
+    head_entries = list(map(lambda file: next(file, None), index_files))
+    head_terms = list(map(lambda entry: entry.term if entry else None, head_entries))
+
+    num_files = len(indexes)
+    num_closed = len([entry for entry in head_entries if entry is None])
 
     document_terms_counter = Counter()
     document_length_counter = Counter()
@@ -344,153 +578,1148 @@ def __merge_spimi_blocks(output_file, document_stats_path, block_filepaths):
         smallest_idx = [i for i, term in enumerate(head_terms) if term and term == smallest_term]
 
         merged_postings = Counter()
+        merged_positions = defaultdict(list)
 
         for i in smallest_idx:
             token = head_entries[i]
 
-            merged_postings += Counter(dict(token.postings))
+            if positions_tables is not None:
+                token_positions = positions_tables[i].positions(
+                    token, range(token.document_frequency))
+
+                for (document_id, _), document_positions in zip(token.postings, token_positions):
+                    if document_id_maps is not None:
+                        document_id = int(document_id_maps[i][document_id])
+
+                    if document_id >= 0:
+                        merged_positions[document_id].append(document_positions)
+
+            if document_id_maps is None:
+                merged_postings += Counter(dict(token.postings))
+            else:
+                document_id_map = document_id_maps[i]
+
+                for document_id, term_frequency in token.postings:
+                    document_id = int(document_id_map[document_id])
 
-            head_entries[i] = __read_token(block_files[i])
+                    if document_id >= 0:
+                        merged_postings[document_id] += term_frequency
+
+            head_entries[i] = next(index_files[i], None)
 
             if head_entries[i]:
                 head_terms[i] = head_entries[i].term
             else:
-                block_files[i].close()
                 num_closed += 1
 
                 head_entries[i] = None
                 head_terms[i] = None
 
-        __flush_index_entry(output_file, smallest_term,
-                            merged_postings.items(),
-                            document_terms_counter, document_length_counter)
+        if merged_postings:
+            postings_list = sorted(merged_postings.items())
+            positions = None
+
+            if positions_tables is not None:
+                positions = [np.concatenate(merged_positions[document_id]).tolist()
+                             for document_id, _ in postings_list]
+
+            __flush_index_entry(index_writer, smallest_term, postings_list,
+                                document_terms_counter, document_length_counter,
+                                positions)
+
+    return (document_terms_counter, document_length_counter)
+
+
+def create_impacts(index_filepath, document_stats_path, scorer, params=None):
+    """Precomputes the score contribution of every posting for the given
+    scorer ('tfidf', or 'bm25' with the parameters k1 and b) and stores it
+    quantized to IMPACT_BITS bits in '<index file>.impacts'
+
+    Impacts only cover the document side of a score, query term weights
+    are applied during search. Impacts are signed, since bm25 contributions
+    of terms which appear in more than half of all documents are negative.
+
+    The file starts with a header ('IRIM', format version, scale, number of
+    terms, number of postings, metadata length) followed by the json encoded
+    metadata (scorer and parameters), the position of each term's first
+    impact (uint64, indexed by term position) and the impacts (int8, in
+    posting order). The score of a posting is impact / scale
+    """
+    if scorer not in IMPACT_SCORERS:
+        raise ValueError('Unknown impact scorer "{}"'.format(scorer))
+
+    params = __scorer_params(scorer, params)
+
+    document_stats = load_document_stats(document_stats_path)
+    number_of_documents, index = open_index(index_filepath)
+
+    def weights(document_frequency, postings):
+        return __posting_weights(number_of_documents, document_stats, scorer, params,
+                                 document_frequency, postings)
+
+    # first pass: find the largest absolute weight, which determines the scale
+    max_weight = 0
+    number_of_postings = 0
+
+    for token in index:
+        token_weights = weights(token.document_frequency, token.postings)
+        max_weight = max(max_weight, np.abs(token_weights).max())
+        number_of_postings += token.document_frequency
+
+    max_impact = (1 << (IMPACT_BITS - 1)) - 1
+    scale = max_impact / max_weight if max_weight > 0 else 1.0
+    metadata = json.dumps({'scorer': scorer, 'params': params}).encode('utf-8')
+
+    # second pass: quantize
+    with open(index_filepath + IMPACTS_SUFFIX + '.tmp', 'wb') as f:
+        f.write(IMPACTS_HEADER.pack(IMPACTS_MAGIC, INDEX_FORMAT_VERSION, scale,
+                                    len(index), number_of_postings, len(metadata)))
+        f.write(metadata)
+
+        bases = np.zeros(len(index), dtype=IMPACTS_BASE_DTYPE)
+        base = 0
+
+        for token in index:
+            bases[token.position] = base
+            base += token.document_frequency
+
+        f.write(bases.tobytes())
+
+        for token in index:
+            impacts = np.rint(weights(token.document_frequency, token.postings) * scale)
+            f.write(np.clip(impacts, -max_impact, max_impact).astype(IMPACTS_DTYPE).tobytes())
+
+    os.replace(index_filepath + IMPACTS_SUFFIX + '.tmp', index_filepath + IMPACTS_SUFFIX)
+    index.close()
+
+
+def create_impact_order(index_filepath):
+    """Stores the postings of every term grouped into segments of equal
+    impact (see create_impacts), ordered by descending impact, in
+    '<index file>.impact_order'. They allow processing the postings of all
+    query terms in global impact order, see anytime.py
+
+    The file starts with a header ('IRIO', format version, number of
+    terms, offset of the offsets table) followed by the segments of all
+    terms and the offsets table (uint64 start of each term's segments,
+    indexed by term position, and the end of the last one). The segments
+    of a term start with their number and, per segment, the impact (offset
+    by 2 ** (IMPACT_BITS - 1) to be non-negative), the number of postings
+    and the length in bytes, followed by the document ids of each segment.
+    All numbers are variable byte encoded, document ids are stored as gaps
+    """
+    impacts = load_impacts(index_filepath)
+    number_of_documents, index = open_index(index_filepath)
+
+    impact_offset = 1 << (IMPACT_BITS - 1)
+    offsets = np.zeros(len(index) + 1, dtype=np.int64)
+
+    with open(index_filepath + IMPACT_ORDER_SUFFIX + '.tmp', 'wb') as f:
+        f.write(IMPACT_ORDER_HEADER.pack(IMPACT_ORDER_MAGIC, INDEX_FORMAT_VERSION,
+                                         len(index), 0))
+
+        for token in index:
+            (document_ids, _) = token.postings.arrays()
+            base = int(impacts.bases[token.position])
+            token_impacts = impacts.values[base:base + token.document_frequency].astype(np.int64)
+
+            # descending impact, ascending document ids within a segment
+            order = np.argsort(-token_impacts, kind='stable')
+            (segment_impacts, starts) = np.unique(-token_impacts[order], return_index=True)
+            ends = np.append(starts[1:], len(order))
+
+            header = [len(starts)]
+            segments = []
 
-    for block_file in block_files:
-        if not block_file.closed:
-            block_file.close()
+            for impact, start, end in zip((-segment_impacts).tolist(), starts.tolist(),
+                                          ends.tolist()):
+                segment_document_ids = document_ids[order[start:end]]
+                segment = encode_variable_byte(np.diff(segment_document_ids, prepend=0).tolist())
 
-    __write_document_stats(document_stats_path,
-                           document_terms_counter,
-                           document_length_counter)
+                header += [impact + impact_offset, end - start, len(segment)]
+                segments.append(segment)
+
+            offsets[token.position] = f.tell()
+            f.write(encode_variable_byte(header))
+            f.write(b''.join(segments))
+
+        offsets[len(index)] = f.tell()
+        table_offset = f.tell()
+        f.write(offsets.astype('<u8').tobytes())
+
+        f.seek(0)
+        f.write(IMPACT_ORDER_HEADER.pack(IMPACT_ORDER_MAGIC, INDEX_FORMAT_VERSION,
+                                         len(index), table_offset))
+
+    os.replace(index_filepath + IMPACT_ORDER_SUFFIX + '.tmp', index_filepath + IMPACT_ORDER_SUFFIX)
+    index.close()
+
+
+def open_impact_order(index_filepath):
+    """Opens the impact ordered postings of the given index, see
+    create_impact_order
+    """
+    if not os.path.exists(index_filepath + IMPACT_ORDER_SUFFIX):
+        raise ValueError('{} has no impact ordered postings'.format(index_filepath))
+
+    return ImpactOrderTable(index_filepath)
+
+
+def __scorer_params(scorer, params):
+    """Returns the parameters the given impact scorer depends on, with
+    defaults for the missing ones
+    """
+    params = params or {}
+
+    if scorer == 'bm25':
+        return {'k1': params.get('k1', 1.2), 'b': params.get('b', 0.75)}
+
+    return {}
+
+
+def __posting_weights(number_of_documents, document_stats, scorer, params,
+                      document_frequency, postings, with_idf=True):
+    """Returns the score contribution of each posting of a posting list for
+    the given scorer ('tfidf', or 'bm25' with the parameters k1 and b).
+    Without idf, only the document dependent factor of the scores is
+    returned, which orders the postings of a term regardless of the sign of
+    its idf
+    """
+    document_ids = np.fromiter((p[0] for p in postings), dtype=np.int64,
+                               count=document_frequency)
+    term_frequencies = np.fromiter((p[1] for p in postings), dtype=np.float64,
+                                   count=document_frequency)
+
+    if scorer == 'tfidf':
+        weights = np.log(1 + term_frequencies)
+        idf = math.log(number_of_documents / document_frequency)
+    else:
+        k1 = params['k1']
+        b = params['b']
+        length_ratio = document_stats.length[document_ids] / \
+            document_stats.average_document_length
+        K = k1 * ((1 - b) + (b * length_ratio))
+        weights = ((k1 + 1) * term_frequencies) / (K + term_frequencies)
+        idf = math.log((number_of_documents - document_frequency + 0.5) /
+                       (document_frequency + 0.5))
+
+    return weights * idf if with_idf else weights
+
+
+def load_impacts(index_filepath):
+    """Loads the quantized impacts of the given index, see create_impacts
+    """
+    with open(index_filepath + IMPACTS_SUFFIX, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    (magic, version, scale, number_of_terms, number_of_postings, metadata_length) = \
+        IMPACTS_HEADER.unpack_from(data, 0)
+
+    if magic != IMPACTS_MAGIC or version != INDEX_FORMAT_VERSION:
+        raise ValueError('{} is not a version {} impacts file'.format(
+            index_filepath + IMPACTS_SUFFIX, INDEX_FORMAT_VERSION))
+
+    offset = IMPACTS_HEADER.size
+    metadata = json.loads(data[offset:offset + metadata_length].decode('utf-8'))
+    offset += metadata_length
+
+    bases = np.frombuffer(data, dtype=IMPACTS_BASE_DTYPE, count=number_of_terms,
+                          offset=offset)
+    offset += number_of_terms * IMPACTS_BASE_DTYPE.itemsize
+
+    values = np.frombuffer(data, dtype=IMPACTS_DTYPE, count=number_of_postings,
+                           offset=offset)
+
+    return Impacts(metadata['scorer'], metadata['params'], scale, bases, values)
+
+
+def create_champions(index_filepath, document_stats_path, size, scorer='bm25', params=None,
+                     output_filepath=None):
+    """Stores the champion list of each term, the size postings with the
+    highest weights for the given scorer (see create_impacts, the weights
+    of a term only differ by their document dependent factor), as an index
+    in '<index file>.champions' (or output_filepath). Champion lists are
+    sorted by document id, like posting lists. Terms with at most size
+    postings are left out, their posting list is their champion list
+
+    The scorer and its parameters are stored in '<champions file>.metadata',
+    which consists of a header ('IRCM', format version, metadata length)
+    followed by the json encoded metadata, see open_champions
+
+    The champion lists form the first tier of the index, see tiers.py
+    """
+    if scorer not in IMPACT_SCORERS:
+        raise ValueError('Unknown champion scorer "{}"'.format(scorer))
+
+    if size < 1:
+        raise ValueError('Champion lists need at least one posting')
+
+    params = __scorer_params(scorer, params)
+    champions_filepath = output_filepath or index_filepath + CHAMPIONS_SUFFIX
+
+    document_stats = load_document_stats(document_stats_path)
+    number_of_documents, index = open_index(index_filepath)
+
+    with IndexWriter(champions_filepath, number_of_documents) as index_writer:
+        for token in index:
+            if token.document_frequency <= size:
+                continue
+
+            weights = __posting_weights(number_of_documents, document_stats, scorer, params,
+                                        token.document_frequency, token.postings,
+                                        with_idf=False)
+
+            # highest weights first, ties by document id
+            champions = np.sort(np.argsort(-weights, kind='stable')[:size])
+            postings = [token.postings[i] for i in champions.tolist()]
+
+            index_writer.write(token.term, postings)
+
+    index.close()
+
+    metadata = json.dumps({'scorer': scorer, 'params': params}).encode('utf-8')
+    metadata_filepath = champions_filepath + CHAMPIONS_METADATA_SUFFIX
+
+    with open(metadata_filepath + '.tmp', 'wb') as f:
+        f.write(CHAMPIONS_METADATA_HEADER.pack(CHAMPIONS_METADATA_MAGIC, INDEX_FORMAT_VERSION,
+                                               len(metadata)))
+        f.write(metadata)
+
+    os.replace(metadata_filepath + '.tmp', metadata_filepath)
+
+
+def open_champions(index_filepath, champions_filepath=None):
+    """Opens the champion lists of the given index (or the ones stored in
+    champions_filepath) and returns them as Champions, see
+    create_champions
+    """
+    champions_filepath = champions_filepath or index_filepath + CHAMPIONS_SUFFIX
+    metadata_filepath = champions_filepath + CHAMPIONS_METADATA_SUFFIX
+
+    if not os.path.exists(champions_filepath) or not os.path.exists(metadata_filepath):
+        raise ValueError('{} has no champion lists'.format(index_filepath))
+
+    with open(metadata_filepath, 'rb') as f:
+        data = f.read()
+
+    (magic, version, metadata_length) = CHAMPIONS_METADATA_HEADER.unpack_from(data, 0)
+
+    if magic != CHAMPIONS_METADATA_MAGIC or version != INDEX_FORMAT_VERSION:
+        raise ValueError('{} is not a version {} champions metadata file'.format(
+            metadata_filepath, INDEX_FORMAT_VERSION))
+
+    offset = CHAMPIONS_METADATA_HEADER.size
+    metadata = json.loads(data[offset:offset + metadata_length].decode('utf-8'))
+
+    return Champions(metadata['scorer'], metadata['params'], MappedIndex(champions_filepath))
+
+
+def create_document_norms(index_filepath, document_stats_path):
+    """Computes the length of each document's tf-idf vector over all terms of
+    the index and stores it in the norm column of the document stats, see
+    write_document_stats. Cosine scores are normalized by it
+    """
+    document_stats = load_document_stats(document_stats_path)
+    number_of_documents, index = open_index(index_filepath)
+
+    norms = np.zeros(document_stats.number_of_documents, dtype=DOCUMENT_NORMS_DTYPE)
+
+    for token in index:
+        (document_ids, term_frequencies) = token.postings.arrays()
+
+        idf = math.log(number_of_documents / token.document_frequency)
+        weights = np.log(1 + term_frequencies) * idf
+
+        # document ids are unique within a posting list
+        norms[document_ids] += weights * weights
+
+    index.close()
+
+    lengths = np.array(document_stats.length)
+    terms = np.array(document_stats.terms)
+    del document_stats
+
+    write_document_stats(document_stats_path, lengths, terms, np.sqrt(norms))
+
+
+def create_bounds(index_filepath, document_stats_path):
+    """Collects the largest term frequency and the smallest document length
+    of each term's posting list and stores them in '<index file>.bounds'.
+    Both are needed to compute per-term upper bound scores for dynamic
+    pruning (see pruning.py)
+
+    The file starts with a header ('IRUB', format version, number of terms)
+    followed by two uint32 columns indexed by term position: the maximum
+    term frequencies and the minimum document lengths
+    """
+    document_stats = load_document_stats(document_stats_path)
+    number_of_documents, index = open_index(index_filepath)
+
+    max_term_frequencies = np.zeros(len(index), dtype=BOUNDS_DTYPE)
+    min_document_lengths = np.zeros(len(index), dtype=BOUNDS_DTYPE)
+
+    for token in index:
+        document_ids = np.fromiter((p[0] for p in token.postings), dtype=np.int64,
+                                   count=token.document_frequency)
+
+        max_term_frequencies[token.position] = max([p[1] for p in token.postings])
+        min_document_lengths[token.position] = document_stats.length[document_ids].min()
+
+    with open(index_filepath + BOUNDS_SUFFIX + '.tmp', 'wb') as f:
+        f.write(BOUNDS_HEADER.pack(BOUNDS_MAGIC, INDEX_FORMAT_VERSION, len(index)))
+        f.write(max_term_frequencies.tobytes())
+        f.write(min_document_lengths.tobytes())
+
+    os.replace(index_filepath + BOUNDS_SUFFIX + '.tmp', index_filepath + BOUNDS_SUFFIX)
+    index.close()
+
+
+def load_bounds(index_filepath):
+    """Loads the per-term bounds of the given index, see create_bounds.
+    Returns the maximum term frequencies and the minimum document lengths
+    as arrays indexed by term position
+    """
+    with open(index_filepath + BOUNDS_SUFFIX, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    (magic, version, number_of_terms) = BOUNDS_HEADER.unpack_from(data, 0)
+
+    if magic != BOUNDS_MAGIC or version != INDEX_FORMAT_VERSION:
+        raise ValueError('{} is not a version {} bounds file'.format(
+            index_filepath + BOUNDS_SUFFIX, INDEX_FORMAT_VERSION))
+
+    def column(i):
+        offset = BOUNDS_HEADER.size + i * number_of_terms * BOUNDS_DTYPE.itemsize
+        return np.frombuffer(data, dtype=BOUNDS_DTYPE, count=number_of_terms,
+                             offset=offset)
+
+    return (column(0), column(1))
 
 
 def create_index_reader(filepath):
     """ Returns index stats (number of documents) and a generator for iterating 
     over each index entry
+
+    Posting lists of the returned tokens are decoded lazily on first access
+    (see postings.LazyPostings)
     """
-    f = open(filepath)
-    
-    number_of_documents = int(f.readline())
+    index = MappedIndex(filepath)
 
     def generator():
-        position = 0
-        with f:
-            token = __read_token(f, position)
+        try:
+            yield from index
+        finally:
+            index.close()
+
+    return (index.number_of_documents, generator)
 
-            while token:
-                yield token
-                position += 1
-                token = __read_token(f, position)
 
-    return (number_of_documents, generator)
+def open_index(filepath):
+    """Opens the index for searching and returns index stats (number of
+    documents) and the index. Posting lists are decoded on lookup only
+    """
+    index = MappedIndex(filepath)
+    return (index.number_of_documents, index)
 
 
-def load_document_stats(filepath):
-    """Loads document level stats which were collected
-    during index creation
+def file_version(filepath):
+    """Returns an identifier for the current contents of the given index or
+    stats file, which changes whenever the file is rebuilt or replaced
+    """
+    stat = os.stat(filepath)
+    return (INDEX_FORMAT_VERSION, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def open_positions(index_filepath):
+    """Opens the position lists of the given index, which has to be built
+    with positions (see create_index_spimi and create_index_map_reduce)
+    """
+    if not os.path.exists(index_filepath + POSITIONS_SUFFIX):
+        raise ValueError('{} is not a positional index'.format(index_filepath))
+
+    return PositionsTable(index_filepath)
+
+
+def open_docnos(index_filepath):
+    """Opens the table which maps the document ids of the given index to
+    document numbers
+    """
+    return DocnoTable(index_filepath + DOCNOS_SUFFIX)
+
+
+class IndexWriter:
+    """Writes posting lists to a binary postings file and collects the
+    term table, which is written to the lexicon file on close.
+
+    Terms have to be written in ascending order.
+
+    The postings file starts with a header ('IRPS', format version) followed
+    by the concatenated posting lists. Posting lists have to be sorted by
+    (integer) document id and are delta and variable byte encoded in blocks
+    with a skip table, see compression.encode_postings.
+
+    The lexicon file ('<index file>.lexicon') is a front-coded dictionary.
+    It starts with a header ('IRLX', format version, number of documents,
+    number of terms, number of blocks, terms per block) followed by the
+    offsets of all blocks and the blocks themselves. Each block holds
+    LEXICON_BLOCK_SIZE consecutive terms and is variable byte encoded:
+
+    <POSTINGS_OFFSET>
+    <TERM_LENGTH><TERM><POSTINGS_LENGTH><DOCUMENT_FREQUENCY>
+    <PREFIX_LENGTH><SUFFIX_LENGTH><SUFFIX><POSTINGS_LENGTH><DOCUMENT_FREQUENCY>
+    ...
+
+    The first term of a block is stored as a whole, every other term only
+    stores the suffix which differs from its predecessor. Posting lists are
+    written back to back, so only the first postings offset is stored.
+
+    The number of documents is the number of document ids. Documents without
+    any term after preprocessing get no id, so it matches the document stats
+    and dense per-document arrays can be sized by it.
+
+    Positional indexes additionally store the in-document positions of
+    every posting in '<index file>.positions'. The file starts with a header
+    ('IRPO', format version, number of terms, offset of the offsets table)
+    followed by the position lists of all terms (see
+    compression.encode_positions) and the offsets table, which holds the
+    start of each term's position list (uint64, indexed by term position)
+    and the end of the last one. Searches which do not need positions never
+    read this file.
+    """
+
+    def __init__(self, filepath, number_of_documents=0, positional=False):
+        self.filepath = filepath
+        self.number_of_documents = number_of_documents
+        self.positional = positional
+
+        # all files are written next to their target and replace it on
+        # close, so readers which still map the previous files (a running
+        # server) are not affected by the rebuild
+        self.__postings_file = open(filepath + '.tmp', 'wb')
+        self.__postings_file.write(POSTINGS_HEADER.pack(POSTINGS_MAGIC,
+                                                        INDEX_FORMAT_VERSION))
+        self.__positions_file = None
+        self.__positions_offsets = []
+
+        if positional:
+            self.__positions_file = open(filepath + POSITIONS_SUFFIX + '.tmp', 'wb')
+            self.__positions_file.write(bytes(POSITIONS_HEADER.size))
+
+        self.__entries = []
+        self.__last_term = None
+
+    def write(self, term, postings_list, positions=None):
+        """Writes the posting list of a term. Positional indexes also need the
+        ascending positions of each posting
+        """
+        self.write_encoded(term, len(postings_list), encode_postings(postings_list),
+                           encode_positions(positions) if positions is not None else None)
+
+    def write_encoded(self, term, document_frequency, data, positions_data=None):
+        """Writes an already serialized posting list (and position list)
+        """
+        if self.__last_term is not None and term <= self.__last_term:
+            raise ValueError('Terms have to be written in ascending order, '
+                             'got "{}" after "{}"'.format(term, self.__last_term))
+
+        if self.positional:
+            if positions_data is None:
+                raise ValueError('Missing positions of "{}"'.format(term))
+
+            self.__positions_offsets.append(self.__positions_file.tell())
+            self.__positions_file.write(positions_data)
+
+        offset = self.__postings_file.tell()
+        self.__postings_file.write(data)
+
+        self.__entries.append((term, offset, len(data), document_frequency))
+        self.__last_term = term
+
+    def close(self):
+        self.__postings_file.close()
+
+        if self.positional:
+            self.__close_positions()
+
+        blocks = []
+
+        for i in range(0, len(self.__entries), LEXICON_BLOCK_SIZE):
+            blocks.append(self.__encode_block(self.__entries[i:i + LEXICON_BLOCK_SIZE]))
+
+        with open(self.filepath + LEXICON_SUFFIX + '.tmp', 'wb') as f:
+            f.write(LEXICON_HEADER.pack(LEXICON_MAGIC, INDEX_FORMAT_VERSION,
+                                        self.number_of_documents,
+                                        len(self.__entries), len(blocks),
+                                        LEXICON_BLOCK_SIZE))
+
+            block_offset = 0
+
+            for block in blocks:
+                f.write(LEXICON_BLOCK_OFFSET.pack(block_offset))
+                block_offset += len(block)
+
+            for block in blocks:
+                f.write(block)
+
+        os.replace(self.filepath + '.tmp', self.filepath)
+        os.replace(self.filepath + LEXICON_SUFFIX + '.tmp', self.filepath + LEXICON_SUFFIX)
+
+    def __close_positions(self):
+        f = self.__positions_file
+        table_offset = f.tell()
+
+        for offset in self.__positions_offsets + [table_offset]:
+            f.write(POSITIONS_OFFSET.pack(offset))
+
+        f.seek(0)
+        f.write(POSITIONS_HEADER.pack(POSITIONS_MAGIC, INDEX_FORMAT_VERSION,
+                                      len(self.__entries), table_offset))
+        f.close()
+
+        os.replace(self.filepath + POSITIONS_SUFFIX + '.tmp', self.filepath + POSITIONS_SUFFIX)
+
+    @staticmethod
+    def __encode_block(entries):
+        block = bytearray(encode_variable_byte([entries[0][1]]))
+        previous_term = b''
+
+        for i, (term, _, length, document_frequency) in enumerate(entries):
+            encoded_term = term.encode('utf-8')
+
+            if i == 0:
+                block += encode_variable_byte([len(encoded_term)])
+                block += encoded_term
+            else:
+                prefix_length = 0
+                max_prefix_length = min(len(previous_term), len(encoded_term))
+
+                while prefix_length < max_prefix_length and \
+                        previous_term[prefix_length] == encoded_term[prefix_length]:
+                    prefix_length += 1
+
+                block += encode_variable_byte([prefix_length,
+                                               len(encoded_term) - prefix_length])
+                block += encoded_term[prefix_length:]
+
+            block += encode_variable_byte([length, document_frequency])
+            previous_term = encoded_term
+
+        return block
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MappedIndex:
+    """Read-only view on an index created by IndexWriter.
+
+    Both the postings file and the lexicon are memory-mapped. Terms are
+    looked up via binary search over the first terms of the lexicon blocks
+    followed by a scan of a single block, only the posting lists of
+    requested terms are decoded.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+        with open(filepath, 'rb') as f:
+            self.__postings = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        with open(filepath + LEXICON_SUFFIX, 'rb') as f:
+            self.__lexicon = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version) = POSTINGS_HEADER.unpack_from(self.__postings, 0)
+        self.__check_header(filepath, magic, POSTINGS_MAGIC, version)
+
+        (magic, version, self.number_of_documents, self.number_of_terms,
+         self.__number_of_blocks, self.__block_size) = \
+            LEXICON_HEADER.unpack_from(self.__lexicon, 0)
+        self.__check_header(filepath + LEXICON_SUFFIX, magic, LEXICON_MAGIC, version)
+
+        self.__blocks_offset = LEXICON_HEADER.size + \
+            self.__number_of_blocks * LEXICON_BLOCK_OFFSET.size
+
+    def get(self, term, default=None):
+        """Returns the token for the given term or the default value if the
+        term is not part of the index
+        """
+        entry = self.__find_entry(term)
+
+        if entry is None:
+            return default
+
+        return self.__read_token(entry)
+
+    def cursor(self, term):
+        """Returns a posting cursor (see postings.BlockPostingCursor) for the
+        given term or None if the term is not part of the index
+        """
+        entry = self.__find_entry(term)
+
+        if entry is None:
+            return None
+
+        (_, _, offset, length, document_frequency) = entry
+        return BlockPostingCursor(self.__postings, offset, length, document_frequency)
+
+    def entries(self):
+        """Generator which provides (term, document_frequency, data) for
+        each entry in the index without decoding its posting list
+        """
+        for block_number in range(self.__number_of_blocks):
+            for (_, term, offset, length, document_frequency) in self.__read_block(block_number):
+                yield (term.decode('utf-8'), document_frequency,
+                       self.__postings[offset:offset + length])
+
+    def close(self):
+        self.__postings.close()
+        self.__lexicon.close()
+
+    def __contains__(self, term):
+        return self.__find_entry(term) is not None
+
+    def __len__(self):
+        return self.number_of_terms
+
+    def __iter__(self):
+        for block_number in range(self.__number_of_blocks):
+            for entry in self.__read_block(block_number):
+                yield self.__read_token(entry)
+
+    def __find_entry(self, term):
+        needle = term.encode('utf-8')
+
+        # find the last block whose first term is not greater than the needle
+        low = 0
+        high = self.__number_of_blocks
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self.__read_first_term(middle) <= needle:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == 0:
+            return None
+
+        for entry in self.__read_block(low - 1):
+            if entry[1] == needle:
+                return entry
+
+            if entry[1] > needle:
+                break
+
+        return None
+
+    def __block_offset(self, block_number):
+        (offset,) = LEXICON_BLOCK_OFFSET.unpack_from(
+            self.__lexicon, LEXICON_HEADER.size + block_number * LEXICON_BLOCK_OFFSET.size)
+
+        return self.__blocks_offset + offset
+
+    def __read_first_term(self, block_number):
+        lexicon = self.__lexicon
+
+        (_, offset) = read_variable_byte(lexicon, self.__block_offset(block_number))
+        (term_length, offset) = read_variable_byte(lexicon, offset)
+
+        return lexicon[offset:offset + term_length]
+
+    def __read_block(self, block_number):
+        """Generator which decodes the given lexicon block and provides
+        (position, term, postings offset, postings length, document frequency)
+        for each of its entries. Terms are provided as utf-8 encoded bytes
+        """
+        lexicon = self.__lexicon
+        first_position = block_number * self.__block_size
+        number_of_entries = min(self.__block_size,
+                                self.number_of_terms - first_position)
+
+        (postings_offset, offset) = read_variable_byte(lexicon, self.__block_offset(block_number))
+
+        term = b''
+
+        for i in range(number_of_entries):
+            if i == 0:
+                (term_length, offset) = read_variable_byte(lexicon, offset)
+                term = lexicon[offset:offset + term_length]
+                offset += term_length
+            else:
+                (prefix_length, offset) = read_variable_byte(lexicon, offset)
+                (suffix_length, offset) = read_variable_byte(lexicon, offset)
+                term = term[:prefix_length] + lexicon[offset:offset + suffix_length]
+                offset += suffix_length
+
+            (length, offset) = read_variable_byte(lexicon, offset)
+            (document_frequency, offset) = read_variable_byte(lexicon, offset)
+
+            yield (first_position + i, term, postings_offset, length,
+                   document_frequency)
+            postings_offset += length
+
+    def __read_token(self, entry):
+        (position, term, offset, length, document_frequency) = entry
+
+        postings = LazyPostings(self.__postings[offset:offset + length],
+                                document_frequency)
+
+        return Token(position, term.decode('utf-8'), document_frequency, postings)
+
+    @staticmethod
+    def __check_header(filepath, magic, expected_magic, version):
+        if magic != expected_magic or version != INDEX_FORMAT_VERSION:
+            raise ValueError('{} is not a version {} index file'.format(
+                filepath, INDEX_FORMAT_VERSION))
+
+
+class DocnoTable:
+    """Memory-mapped table which maps document ids to document numbers
+
+    The file starts with a header ('IRDN', format version, number of
+    document ids) followed by an array of (number of document ids + 1)
+    offsets and a blob containing all document numbers. The document
+    number of id i is stored in blob[offsets[i]:offsets[i + 1]]
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+        with open(filepath, 'rb') as f:
+            self.__table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.__length) = DOCNOS_HEADER.unpack_from(self.__table, 0)
+
+        if magic != DOCNOS_MAGIC or version != INDEX_FORMAT_VERSION:
+            raise ValueError('{} is not a version {} document number table'.format(
+                filepath, INDEX_FORMAT_VERSION))
+
+        self.__blob_offset = DOCNOS_HEADER.size + \
+            (self.__length + 1) * DOCNOS_OFFSET.size
+
+    def close(self):
+        self.__table.close()
+
+    def __getitem__(self, document_id):
+        if not 0 <= document_id < self.__length:
+            raise IndexError('Document id {} out of range'.format(document_id))
+
+        position = DOCNOS_HEADER.size + document_id * DOCNOS_OFFSET.size
+        (start,) = DOCNOS_OFFSET.unpack_from(self.__table, position)
+        (end,) = DOCNOS_OFFSET.unpack_from(self.__table, position + DOCNOS_OFFSET.size)
+
+        return self.__table[self.__blob_offset + start:
+                            self.__blob_offset + end].decode('utf-8')
+
+    def __len__(self):
+        return self.__length
+
+
+class PositionsTable:
+    """Memory-mapped position lists of a positional index, see IndexWriter
+
+    Position lists are looked up by the position of a term in the lexicon,
+    only the blocks which contain requested postings are decoded
+    """
+
+    def __init__(self, index_filepath):
+        self.filepath = index_filepath + POSITIONS_SUFFIX
+
+        with open(self.filepath, 'rb') as f:
+            self.__data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.__length, self.__table_offset) = \
+            POSITIONS_HEADER.unpack_from(self.__data, 0)
+
+        if magic != POSITIONS_MAGIC or version != INDEX_FORMAT_VERSION:
+            raise ValueError('{} is not a version {} positions file'.format(
+                self.filepath, INDEX_FORMAT_VERSION))
+
+    def positions(self, token, posting_indices, term_frequencies=None):
+        """Returns the positions of the given postings (indexes into the
+        token's posting list, ascending) as numpy arrays. term_frequencies are
+        the ones of the token's postings, they are decoded if not given
+        """
+        if term_frequencies is None:
+            (_, term_frequencies) = postings_arrays(token.postings)
+
+        (start, end) = self.__range(token.position)
+
+        return decode_positions(self.__data, term_frequencies, posting_indices,
+                                start, end - start)
+
+    def data(self, term_position):
+        """Returns the encoded position list of the term at the given
+        position of the lexicon
+        """
+        (start, end) = self.__range(term_position)
+        return self.__data[start:end]
+
+    def close(self):
+        self.__data.close()
+
+    def __len__(self):
+        return self.__length
+
+    def __range(self, term_position):
+        if not 0 <= term_position < self.__length:
+            raise IndexError('Term position {} out of range'.format(term_position))
+
+        offset = self.__table_offset + term_position * POSITIONS_OFFSET.size
+        (start,) = POSITIONS_OFFSET.unpack_from(self.__data, offset)
+        (end,) = POSITIONS_OFFSET.unpack_from(self.__data, offset + POSITIONS_OFFSET.size)
+
+        return (start, end)
+
+
+class ImpactOrderTable:
+    """Memory-mapped impact ordered postings of an index, see
+    create_impact_order
+
+    Segments are looked up by the position of a term in the lexicon, the
+    document ids of a segment are only decoded when requested
     """
 
-    with open(filepath, 'r') as f:
-        return json.loads(f.read())
+    def __init__(self, index_filepath):
+        self.filepath = index_filepath + IMPACT_ORDER_SUFFIX
 
+        with open(self.filepath, 'rb') as f:
+            self.__data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
-def __read_token(file, position=None):
-    line = file.readline()
+        (magic, version, self.__length, self.__table_offset) = \
+            IMPACT_ORDER_HEADER.unpack_from(self.__data, 0)
 
-    if not line:
-        return None  # EOF
+        if magic != IMPACT_ORDER_MAGIC or version != INDEX_FORMAT_VERSION:
+            raise ValueError('{} is not a version {} impact order file'.format(
+                self.filepath, INDEX_FORMAT_VERSION))
 
-    parts = line.split('\t')
+    def segments(self, term_position):
+        """Returns the segments of the term at the given position of the
+        lexicon as ImpactSegments, by descending impact
+        """
+        if not 0 <= term_position < self.__length:
+            raise IndexError('Term position {} out of range'.format(term_position))
 
-    term = parts[0]
-    document_frequency = int(parts[1])
+        (offset,) = IMPACT_ORDER_OFFSET.unpack_from(
+            self.__data, self.__table_offset + term_position * IMPACT_ORDER_OFFSET.size)
 
-    postings_entries = parts[2].split(',')
+        (number_of_segments, offset) = read_variable_byte(self.__data, offset)
+        header = []
 
-    def to_tuple(e):
-        p = e.split('|')
-        return (p[0], int(p[1]))  # (document_id, term_freq)
+        for _ in range(3 * number_of_segments):
+            (number, offset) = read_variable_byte(self.__data, offset)
+            header.append(number)
 
-    postings = list(map(to_tuple, postings_entries))
+        impact_offset = 1 << (IMPACT_BITS - 1)
+        segments = []
 
-    return Token(position, term, document_frequency, postings)
+        for i in range(0, len(header), 3):
+            (impact, number_of_postings, length) = header[i:i + 3]
+            segments.append(ImpactSegment(impact - impact_offset, number_of_postings,
+                                          offset, length))
+            offset += length
 
+        return segments
 
-def __write_spimi_block(dictionary):
+    def document_ids(self, segment):
+        """Returns the ascending document ids of the given segment as a numpy
+        array
+        """
+        gaps = decode_variable_byte_array(self.__data[segment.offset:segment.offset + segment.length])
+        return np.cumsum(gaps)
+
+    def close(self):
+        self.__data.close()
+
+    def __len__(self):
+        return self.__length
+
+
+def load_document_stats(filepath):
+    """Loads document level stats which were collected
+    during index creation
+
+    The per document columns are memory-mapped numpy arrays indexed by
+    document id, see write_document_stats for the file format
+    """
+
+    with open(filepath, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    (magic, version, number_of_documents, total_length,
+     average_document_length, mean_average_term_frequency) = \
+        DOCUMENT_STATS_HEADER.unpack_from(data, 0)
+
+    if magic != DOCUMENT_STATS_MAGIC or version != INDEX_FORMAT_VERSION:
+        raise ValueError('{} is not a version {} document stats file'.format(
+            filepath, INDEX_FORMAT_VERSION))
+
+    def column(i):
+        offset = DOCUMENT_STATS_HEADER.size + \
+            i * number_of_documents * DOCUMENT_STATS_DTYPE.itemsize
+        return np.frombuffer(data, dtype=DOCUMENT_STATS_DTYPE,
+                             count=number_of_documents, offset=offset)
+
+    norm = np.frombuffer(data, dtype=DOCUMENT_NORMS_DTYPE, count=number_of_documents,
+                         offset=DOCUMENT_STATS_HEADER.size +
+                         2 * number_of_documents * DOCUMENT_STATS_DTYPE.itemsize)
+
+    return DocumentStats(number_of_documents, total_length,
+                         average_document_length, mean_average_term_frequency,
+                         length=column(0), terms=column(1), norm=norm,
+                         filepath=filepath)
+
+
+def __write_spimi_block(dictionary, positional=False):
     """Write the given dictionary to a temporary file and returns the filename
 
-    See __write_index_entry for details on how an entry is serialized
+    Blocks use the same format as the final index, see IndexWriter. The
+    postings of positional blocks are (document id, position) pairs
     """
     default_tmp_dir = tempfile._get_default_tempdir()
     tempfile_name = next(tempfile._get_candidate_names())
 
     filename = default_tmp_dir + '/' + tempfile_name + '.blk'
 
-    with open(filename, 'w') as f:
+    with IndexWriter(filename, positional=positional) as index_writer:
         # sort terms
         sorted_terms = sorted(dictionary.keys())
 
         for term in sorted_terms:
-            __write_index_entry(f, term, __to_bag_of_words(dictionary[term]))
+            if positional:
+                index_writer.write(term, *__to_positional_postings(dictionary[term]))
+            else:
+                index_writer.write(term, __to_bag_of_words(dictionary[term]))
 
     return filename
 
 
-def __flush_index_entry(file, term, postings_list,
-                        document_terms_counter, document_length_counter):
-    """Collects document stats and write the given index entry to disk
+def __flush_index_entry(index_writer, term, postings_list,
+                        document_terms_counter, document_length_counter,
+                        positions=None):
+    """Collects document stats and writes the given index entry to disk
     """
 
     for document_id, term_frequency in postings_list:
         document_terms_counter[document_id] += 1
         document_length_counter[document_id] += term_frequency
 
-    __write_index_entry(file, term, postings_list)
+    index_writer.write(term, postings_list, positions)
+
+
+def write_document_stats_counters(filepath, document_terms_counter,
+                                  document_length_counter, number_of_ids):
+    """Writes document stats from counters of the number of unique terms and
+    the length of each document, see write_document_stats
+    """
+    lengths = np.fromiter((document_length_counter[i] for i in range(number_of_ids)),
+                          dtype=DOCUMENT_STATS_DTYPE, count=number_of_ids)
+    terms = np.fromiter((document_terms_counter[i] for i in range(number_of_ids)),
+                        dtype=DOCUMENT_STATS_DTYPE, count=number_of_ids)
+
+    write_document_stats(filepath, lengths, terms)
+
+
+def write_document_stats(filepath, lengths, terms, norms=None):
+    """Writes the given document lengths, numbers of unique terms and tf-idf
+    vector norms (arrays indexed by document id) along with the derived
+    collection stats to disk. The norms are zero until they are computed
+    by create_document_norms
+
+    The file starts with a header ('IRDS', format version, number of
+    documents, total length of all documents, average document length,
+    mean average term frequency) followed by two uint32 columns indexed by
+    document id, the length and the number of unique terms of each
+    document, and a float64 column with the norm of each document
 
+    The file is replaced atomically, as it may still be memory-mapped
+    """
+    number_of_ids = len(lengths)
+
+    total_length = sum(lengths.tolist())
+    average_document_length = total_length / number_of_ids if number_of_ids else 0
+    # documents without terms only occur in map reduce partitions
+    mean_average_term_frequency = \
+        sum([l / t for l, t in zip(lengths.tolist(), terms.tolist()) if t]) / number_of_ids \
+        if number_of_ids else 0
+
+    if norms is None:
+        norms = np.zeros(number_of_ids, dtype=DOCUMENT_NORMS_DTYPE)
 
-def __write_index_entry(file, term, postings_list):
-    """Writes s single index entry into the given file
+    with open(filepath + '.tmp', 'wb') as f:
+        f.write(DOCUMENT_STATS_HEADER.pack(DOCUMENT_STATS_MAGIC, INDEX_FORMAT_VERSION,
+                                           number_of_ids, total_length,
+                                           average_document_length,
+                                           mean_average_term_frequency))
+        f.write(np.asarray(lengths, dtype=DOCUMENT_STATS_DTYPE).tobytes())
+        f.write(np.asarray(terms, dtype=DOCUMENT_STATS_DTYPE).tobytes())
+        f.write(np.asarray(norms, dtype=DOCUMENT_NORMS_DTYPE).tobytes())
 
-    An entry looks as follows: '<TERM> <DOCUMENT_FREQUENCY> <POSTINGS>'
+    os.replace(filepath + '.tmp', filepath)
 
-    * TERM - The term itself
-    * DOCUMENT_FREQUENCY - Document Frequency (Number of documents the term appears in)
-    * POSTINGS - A comma-separated list of documents the term appears in
-      along with the term frequency separated by pipe in the given document:
-      <DOCUMENT_ID>|<TERM_FREQUENCY>,<DOCUMENT_ID>|<TERM_FREQUENCY>,...
-    * TERM_FREQUENCY - Number of times the term appears in the corresponding document 
 
+def __remove_optional_files(index_filepath):
+    """Removes the optional files (see OPTIONAL_SUFFIXES) of a previous
+    index at the given path
     """
-    postings = list(map(lambda e: '{}|{}'.format(e[0], e[1]), postings_list))
+    for suffix in OPTIONAL_SUFFIXES:
+        if os.path.exists(index_filepath + suffix):
+            os.remove(index_filepath + suffix)
 
-    line = '{}\t{}\t{}\n'.format(
-        term, str(len(postings_list)), ','.join(postings))
 
-    file.write(line)
+def __assign_document_ids(token_stream, docnos):
+    """Replaces the document numbers of the given token stream by dense
+    integer ids (in order of appearance). The document numbers are appended
+    to docnos, the id of a document is its position in this list
+    """
+    for (docno, term, num_documents_processed, *position) in token_stream:
+        if not docnos or docnos[-1] != docno:
+            docnos.append(docno)
+
+        yield (len(docnos) - 1, term, num_documents_processed, *position)
 
 
-def __write_document_stats(filepath, document_terms_counter,
-                           document_length_counter):
-    """Writes various document level stats to disk
+def write_docnos(filepath, docnos):
+    """Writes the document number table, see DocnoTable
     """
-    stats = {
-        'terms': document_terms_counter,
-        'length': document_length_counter
-    }
+    encoded_docnos = [docno.encode('utf-8') for docno in docnos]
 
-    with open(filepath, 'w') as f:
-        f.write(json.dumps(stats))
+    with open(filepath + '.tmp', 'wb') as f:
+        f.write(DOCNOS_HEADER.pack(DOCNOS_MAGIC, INDEX_FORMAT_VERSION,
+                                   len(encoded_docnos)))
+
+        offset = 0
+        f.write(DOCNOS_OFFSET.pack(offset))
+
+        for encoded_docno in encoded_docnos:
+            offset += len(encoded_docno)
+            f.write(DOCNOS_OFFSET.pack(offset))
+
+        for encoded_docno in encoded_docnos:
+            f.write(encoded_docno)
+
+    os.replace(filepath + '.tmp', filepath)
 
 
 def __to_bag_of_words(words):
-    return Counter(words).items()
\ No newline at end of file
+    return Counter(words).items()
+
+
+def __to_positional_postings(occurrences):
+    """Groups (document_id, position) pairs by document and returns the
+    posting list along with the positions of each posting
+    """
+    postings_list = []
+    positions = []
+
+    for document_id, group in groupby(sorted(occurrences), key=itemgetter(0)):
+        document_positions = [position for _, position in group]
+
+        postings_list.append((document_id, len(document_positions)))
+        positions.append(document_positions)
+
+    return (postings_list, positions)
\ No newline at end of file
@@ -0,0 +1,201 @@
+import math
+import numpy as np
+from collections import Counter
+
+from postings import postings_arrays
+from searching import create_lexicon, tfidf_score, check_scoring_context, DEFAULT_TOP_K
+
+
+def numpy_tfidf_search(number_of_documents, index, search_terms,
+                       top_k=DEFAULT_TOP_K):
+    """Vectorized version of searching.simple_tfidf_search
+    """
+    scores = np.zeros(number_of_documents)
+    matched = np.zeros(number_of_documents, dtype=bool)
+
+    for token, document_ids, term_frequencies in __find_postings(index, search_terms):
+        idf = math.log(number_of_documents / token.document_frequency)
+
+        scores[document_ids] += np.log(1 + term_frequencies) * idf
+        matched[document_ids] = True
+
+    return select_top_k_array(scores, matched, top_k)
+
+
+def numpy_cosine_tfidf_search(number_of_documents, index, search_terms,
+                              document_stats=None, top_k=DEFAULT_TOP_K):
+    """Vectorized version of searching.cosine_tfidf_search
+    """
+    search_term_counter = Counter(search_terms)
+
+    # the dense arrays are sized by the norms, which cover every document
+    # id, so they line up with them even for indexes whose number of
+    # documents also counted documents without any term
+    if document_stats is not None:
+        document_norms = document_stats.norm
+    else:
+        document_norms = np.zeros(number_of_documents)
+
+    scores = np.zeros(len(document_norms))
+    matched = np.zeros(len(document_norms), dtype=bool)
+    query_norm = 0
+
+    for token, document_ids, term_frequencies in __find_postings(index, search_terms):
+        w_tq = tfidf_score(number_of_documents, token.document_frequency,
+                           search_term_counter[token.term])
+        query_norm += w_tq * w_tq
+
+        idf = math.log(number_of_documents / token.document_frequency)
+        w_tf = np.log(1 + term_frequencies) * idf
+
+        scores[document_ids] += w_tq * w_tf
+        matched[document_ids] = True
+
+        if document_stats is None:
+            document_norms[document_ids] += w_tf * w_tf
+
+    query_norm = math.sqrt(query_norm)
+
+    if document_stats is None:
+        document_norms = np.sqrt(document_norms)
+
+    # documents which only contain terms of all documents
+    normalized = matched & (document_norms > 0)
+    scores[normalized] /= document_norms[normalized] * query_norm
+
+    return select_top_k_array(scores, matched, top_k)
+
+
+def numpy_bm25_search(number_of_documents, index, search_terms,
+                      document_stats, k1=1.2, b=0.75, k3=100,
+                      top_k=DEFAULT_TOP_K, scoring_context=None):
+    """Vectorized version of searching.simple_bm25_search
+    """
+    check_scoring_context(scoring_context, 'bm25', {'b': b})
+
+    if scoring_context is not None:
+        B = scoring_context.normalization_array
+    else:
+        length_ratio = document_stats.length / document_stats.average_document_length
+        B = (1 - b) + (b * length_ratio)
+
+    return __bm25(number_of_documents, index, search_terms, B, k1, k3, top_k)
+
+
+def numpy_bm25va_search(number_of_documents, index, search_terms,
+                        document_stats, k1=1.2, k3=100,
+                        top_k=DEFAULT_TOP_K, scoring_context=None):
+    """Vectorized version of searching.simple_bm25va_search
+    """
+    check_scoring_context(scoring_context, 'bm25va')
+
+    if scoring_context is not None:
+        Bva = scoring_context.normalization_array
+    else:
+        mean_average_term_frequency = document_stats.mean_average_term_frequency
+
+        lengths = document_stats.length.astype(np.float64)
+        terms = document_stats.terms.astype(np.float64)
+        length_ratio = lengths / document_stats.average_document_length
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Bva = 1 / (mean_average_term_frequency * mean_average_term_frequency)
+            Bva = Bva * (lengths / terms)
+            Bva += (1 - (1 / mean_average_term_frequency)) * length_ratio
+
+    return __bm25(number_of_documents, index, search_terms, Bva, k1, k3, top_k)
+
+
+def numpy_search(number_of_documents, index, document_stats, search_terms,
+                 ranking_method, params={}, top_k=DEFAULT_TOP_K, scoring_context=None):
+    """Vectorized version of searching.search
+    """
+    if ranking_method == 'tfidf':
+        return numpy_tfidf_search(number_of_documents, index, search_terms,
+                                  top_k=top_k)
+    elif ranking_method == 'cosine_tfidf':
+        return numpy_cosine_tfidf_search(number_of_documents, index, search_terms,
+                                         document_stats, top_k=top_k)
+    elif ranking_method == 'bm25':
+        return numpy_bm25_search(number_of_documents, index,
+                                 search_terms, document_stats,
+                                 k1=params['k1'],
+                                 b=params['b'],
+                                 k3=params['k3'],
+                                 top_k=top_k,
+                                 scoring_context=scoring_context)
+    elif ranking_method == 'bm25va':
+        return numpy_bm25va_search(number_of_documents, index,
+                                   search_terms, document_stats,
+                                   k1=params['k1'],
+                                   k3=params['k3'],
+                                   top_k=top_k,
+                                   scoring_context=scoring_context)
+
+    raise ValueError('Unknown ranking method "{}"'.format(ranking_method))
+
+
+def select_top_k_array(scores, matched, top_k=DEFAULT_TOP_K):
+    """Returns the top_k (all if None) matched documents as (document_id,
+    score) tuples ordered like searching.rank_key. Uses argpartition to
+    select the candidates, ties at the k-th score are resolved by document
+    id
+    """
+    document_ids = np.flatnonzero(matched)
+    candidate_scores = scores[document_ids]
+
+    if top_k is not None and top_k < len(document_ids):
+        if top_k <= 0:
+            return []
+
+        kth_score = candidate_scores[np.argpartition(-candidate_scores, top_k - 1)[top_k - 1]]
+
+        above = candidate_scores > kth_score
+        ties = np.flatnonzero(candidate_scores == kth_score)[:top_k - np.count_nonzero(above)]
+
+        selected = np.flatnonzero(above)
+        selected = np.concatenate((selected, ties))
+
+        document_ids = document_ids[selected]
+        candidate_scores = candidate_scores[selected]
+
+    order = np.lexsort((document_ids, -candidate_scores))
+
+    return list(zip(document_ids[order].tolist(), candidate_scores[order].tolist()))
+
+
+def __bm25(number_of_documents, index, search_terms, B, k1, k3, top_k):
+    search_term_counter = Counter(search_terms)
+
+    scores = np.zeros(number_of_documents)
+    matched = np.zeros(number_of_documents, dtype=bool)
+
+    for token, document_ids, term_frequencies in __find_postings(index, search_terms):
+        tfq = search_term_counter[token.term]
+        dft = token.document_frequency
+
+        query_weight = ((k3+1)*tfq)/(k3+tfq)
+        idf = math.log((number_of_documents-dft+0.5)/(dft+0.5))
+
+        K = k1 * B[document_ids]
+
+        scores[document_ids] += query_weight * (((k1+1)*term_frequencies)/(K+term_frequencies)) * idf
+        matched[document_ids] = True
+
+    return select_top_k_array(scores, matched, top_k)
+
+
+def __find_postings(index, search_terms):
+    """Yields token, document ids and term frequencies (numpy arrays) for
+    each of the given terms which is part of the index
+    """
+    lexicon = create_lexicon(index)
+
+    for term in sorted(set(search_terms)):
+        token = lexicon.get(term)
+
+        if token is None:
+            continue
+
+        (document_ids, term_frequencies) = postings_arrays(token.postings)
+        yield (token, document_ids, term_frequencies.astype(np.float64))
@@ -0,0 +1,187 @@
+import re
+import numpy as np
+from collections import namedtuple, Counter
+
+from bitmaps import RoaringBitmap
+from postings import postings_arrays
+from preprocessing import split_words
+from searching import search, create_lexicon, create_filtered_lexicon, DEFAULT_TOP_K
+
+# "term term ..." matches the terms in this order at consecutive positions,
+# "term term ..."~N matches the terms in any order within N positions
+PHRASE_PATTERN = re.compile(r'"([^"]*)"(?:~(\d+))?')
+
+Phrase = namedtuple('Phrase', ['terms', 'window'])
+
+
+def parse_query(query, preprocess,
+                strip_html_tags=True,
+                strip_html_entities=True,
+                strip_square_bracket_tags=True):
+    """Splits the given query text into its (preprocessed) search terms and
+    phrases. Phrases are quoted, a quoted phrase followed by ~N is a
+    proximity query with a window of N positions. The terms of phrases are
+    part of the search terms as well
+
+    Positions are counted after preprocessing, so removed stop words do not
+    take up a position
+    """
+    def terms(text):
+        return preprocess(split_words(text,
+                                      strip_html_tags=strip_html_tags,
+                                      strip_html_entities=strip_html_entities,
+                                      strip_square_bracket_tags=strip_square_bracket_tags))
+
+    phrases = []
+
+    for match in PHRASE_PATTERN.finditer(query):
+        phrase_terms = terms(match.group(1))
+        window = int(match.group(2)) if match.group(2) else None
+
+        if window is not None and window < len(set(phrase_terms)):
+            raise ValueError('The window of "{}" is smaller than its number of terms'.format(
+                match.group(0)))
+
+        if phrase_terms:
+            phrases.append(Phrase(phrase_terms, window))
+
+    return (terms(PHRASE_PATTERN.sub(r' \1 ', query)), phrases)
+
+
+def match_phrase(index, positions_table, phrase):
+    """Returns a dict which maps the ids of the documents matching the given
+    phrase to the number of matches
+
+    The posting lists of the phrase terms are intersected first, positions
+    are only decoded for the postings of the remaining candidate documents.
+    Exact phrases count the positions they start at, proximity phrases the
+    positions at which a window of at most phrase.window positions, which
+    contains all terms, ends
+    """
+    lexicon = create_lexicon(index)
+    tokens = {}
+
+    for term in set(phrase.terms):
+        token = lexicon.get(term)
+
+        if token is None:
+            return {}
+
+        tokens[term] = token
+
+    arrays = {term: postings_arrays(token.postings) for term, token in tokens.items()}
+
+    # intersect starting with the shortest posting list
+    candidates = None
+
+    for term in sorted(arrays, key=lambda term: len(arrays[term][0])):
+        document_ids = arrays[term][0]
+
+        if candidates is None:
+            candidates = document_ids
+        else:
+            candidates = np.intersect1d(candidates, document_ids, assume_unique=True)
+
+        if not len(candidates):
+            return {}
+
+    candidate_positions = {}
+
+    for term, token in tokens.items():
+        (document_ids, term_frequencies) = arrays[term]
+        posting_indices = np.searchsorted(document_ids, candidates)
+
+        candidate_positions[term] = positions_table.positions(token, posting_indices,
+                                                              term_frequencies)
+
+    matches = {}
+
+    for i, document_id in enumerate(candidates.tolist()):
+        term_positions = {term: positions[i] for term, positions in candidate_positions.items()}
+
+        if phrase.window is None:
+            number_of_matches = __count_phrases(phrase.terms, term_positions)
+        else:
+            number_of_matches = __count_windows(term_positions, phrase.window)
+
+        if number_of_matches:
+            matches[document_id] = number_of_matches
+
+    return matches
+
+
+def match_phrases(index, positions_table, phrases):
+    """Returns the ids of the documents matching all given phrases as a
+    sorted numpy array
+    """
+    document_ids = None
+
+    for phrase in phrases:
+        matches = np.array(sorted(match_phrase(index, positions_table, phrase)),
+                           dtype=np.int64)
+
+        if document_ids is None:
+            document_ids = matches
+        else:
+            document_ids = np.intersect1d(document_ids, matches, assume_unique=True)
+
+    return document_ids if document_ids is not None else np.zeros(0, dtype=np.int64)
+
+
+def phrase_search(number_of_documents, index, document_stats, positions_table,
+                  search_terms, phrases, ranking_method, params={},
+                  top_k=DEFAULT_TOP_K, scoring_context=None):
+    """Ranks the documents which match all given phrases by the search
+    terms, see searching.search. Phrases only filter the documents, the
+    scores are the ones of the unfiltered search. Without phrases this is
+    a regular search which does not touch the positions
+    """
+    if not phrases:
+        return search(number_of_documents, index, document_stats, search_terms,
+                      ranking_method, params, top_k=top_k,
+                      scoring_context=scoring_context)
+
+    lexicon = create_lexicon(index)
+    matches = RoaringBitmap.from_sorted(match_phrases(lexicon, positions_table, phrases))
+    filtered_lexicon = create_filtered_lexicon(lexicon, search_terms, matches.contains)
+
+    return search(number_of_documents, filtered_lexicon, document_stats, search_terms,
+                  ranking_method, params, top_k=top_k, scoring_context=scoring_context)
+
+
+def __count_phrases(terms, term_positions):
+    starts = term_positions[terms[0]]
+
+    for offset, term in enumerate(terms[1:], 1):
+        starts = np.intersect1d(starts, term_positions[term] - offset, assume_unique=True)
+
+        if not len(starts):
+            break
+
+    return len(starts)
+
+
+def __count_windows(term_positions, window):
+    occurrences = sorted((position, term)
+                         for term, positions in term_positions.items()
+                         for position in positions.tolist())
+
+    counts = Counter()
+    number_of_windows = 0
+    left = 0
+
+    for (position, term) in occurrences:
+        counts[term] += 1
+
+        if len(counts) < len(term_positions):
+            continue
+
+        # shrink to the shortest window ending at this position
+        while counts[occurrences[left][1]] > 1:
+            counts[occurrences[left][1]] -= 1
+            left += 1
+
+        if position - occurrences[left][0] < window:
+            number_of_windows += 1
+
+    return number_of_windows
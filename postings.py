@@ -0,0 +1,264 @@
+import sys
+import numpy as np
+from bisect import bisect_left
+from collections.abc import Sequence
+from itertools import accumulate
+from compression import POSTINGS_BLOCK_SIZE, number_of_posting_blocks, \
+    read_variable_byte, decode_variable_byte, decode_postings, decode_postings_arrays
+
+NO_MORE_DOCUMENTS = sys.maxsize
+
+
+def open_cursor(index, term):
+    """Returns a posting cursor for the given term or None if the term is not
+    part of the index. Works for indexes opened via indexing.open_index and
+    for in-memory lexicons (see searching.create_lexicon)
+    """
+    if hasattr(index, 'cursor'):
+        return index.cursor(term)
+
+    token = index.get(term)
+
+    if token is None:
+        return None
+
+    return PostingCursor(token.postings)
+
+
+def gallop(values, target, low=0):
+    """Returns the index of the first of the given sorted values at or after
+    low which is equal to or greater than target (len(values) if there is
+    none)
+
+    Exponential (galloping) search: probes low + 1, low + 2, low + 4, ...
+    until the target is passed and then bisects the last step. Finding a
+    target d positions ahead takes O(log d) comparisons instead of O(log n),
+    which makes intersecting a short with a long list cheap
+    """
+    if low >= len(values) or values[low] >= target:
+        return low
+
+    step = 1
+
+    while low + step < len(values) and values[low + step] < target:
+        low += step
+        step *= 2
+
+    return bisect_left(values, target, low + 1, min(low + step, len(values)))
+
+
+def postings_arrays(postings):
+    """Returns the document ids and term frequencies of the given posting
+    list as numpy arrays
+    """
+    if hasattr(postings, 'arrays'):
+        return postings.arrays()
+
+    postings = np.array(postings, dtype=np.int64).reshape(-1, 2)
+    return (postings[:, 0], postings[:, 1])
+
+
+class LazyPostings(Sequence):
+    """Posting list which keeps the compressed bytes (see
+    compression.encode_postings) until it is accessed for the first time,
+    then decodes and caches the (document_id, term_frequency) tuples
+
+    The length is known without decoding
+    """
+
+    def __init__(self, data, document_frequency):
+        self.__data = data
+        self.__document_frequency = document_frequency
+        self.__postings = None
+
+    @property
+    def decoded(self):
+        return self.__postings is not None
+
+    def arrays(self):
+        """Returns the document ids and term frequencies as numpy arrays
+        """
+        if self.__postings is None:
+            return decode_postings_arrays(self.__data, self.__document_frequency)
+
+        return postings_arrays(self.__postings)
+
+    def __len__(self):
+        return self.__document_frequency
+
+    def __getitem__(self, i):
+        return self.__decode()[i]
+
+    def __iter__(self):
+        return iter(self.__decode())
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        if self.__postings is None:
+            return '<LazyPostings {} postings, {} bytes>'.format(
+                self.__document_frequency, len(self.__data))
+
+        return repr(self.__postings)
+
+    def __decode(self):
+        if self.__postings is None:
+            self.__postings = decode_postings(self.__data, self.__document_frequency)
+            self.__data = None
+
+        return self.__postings
+
+
+class PostingCursor:
+    """Iterates over an in-memory posting list in document id order
+
+    The cursor starts before the first posting. next() moves to the next
+    posting, advance(target) to the first posting whose document id is
+    equal to or greater than target. Both return the current document id or
+    NO_MORE_DOCUMENTS once the posting list is exhausted
+    """
+
+    def __init__(self, postings):
+        self.document_frequency = len(postings)
+        self.document_id = -1
+        self.term_frequency = 0
+
+        self.__postings = postings
+        self.__document_ids = None
+        self.__index = -1
+
+    def next(self):
+        self.__index += 1
+        return self.__update()
+
+    def advance(self, target):
+        if self.document_id >= target:
+            return self.document_id
+
+        if self.__document_ids is None:
+            self.__document_ids = [document_id for document_id, _ in self.__postings]
+
+        self.__index = gallop(self.__document_ids, target, self.__index + 1)
+        return self.__update()
+
+    def __update(self):
+        if self.__index >= len(self.__postings):
+            self.document_id = NO_MORE_DOCUMENTS
+            self.term_frequency = 0
+        else:
+            (self.document_id, self.term_frequency) = self.__postings[self.__index]
+
+        return self.document_id
+
+
+class BlockPostingCursor:
+    """Iterates over a compressed posting list (see compression.encode_postings)
+    in document id order, see PostingCursor for the semantics of next and
+    advance
+
+    Blocks are decoded on demand. advance gallops over the skip table to
+    jump over blocks which can not contain the target document
+    """
+
+    def __init__(self, data, offset, length, document_frequency):
+        self.document_frequency = document_frequency
+        self.document_id = -1
+        self.term_frequency = 0
+
+        self.__data = data
+        self.__number_of_blocks = number_of_posting_blocks(document_frequency)
+
+        # last document id and start offset of each block
+        self.__last_document_ids = []
+        self.__block_offsets = []
+
+        end = offset + length
+
+        if self.__number_of_blocks > 1:
+            last_document_id = 0
+            block_lengths = []
+
+            for _ in range(self.__number_of_blocks):
+                (gap, offset) = read_variable_byte(data, offset)
+                (block_length, offset) = read_variable_byte(data, offset)
+
+                last_document_id += gap
+                self.__last_document_ids.append(last_document_id)
+                block_lengths.append(block_length)
+
+            self.__block_offsets = [offset + block_offset for block_offset
+                                    in accumulate([0] + block_lengths[:-1])]
+        else:
+            self.__block_offsets = [offset]
+
+        self.__block_offsets.append(end)
+
+        self.__block = -1
+        self.__document_ids = []
+        self.__term_frequencies = []
+        self.__index = -1
+
+    def next(self):
+        self.__index += 1
+
+        if self.__index >= len(self.__document_ids):
+            self.__load_block(self.__block + 1)
+
+        return self.__update()
+
+    def advance(self, target):
+        if self.document_id >= target:
+            return self.document_id
+
+        block = max(self.__block, 0)
+
+        # skip blocks whose last document is smaller than the target, the
+        # last block is never skipped
+        if self.__number_of_blocks > 1:
+            block = min(gallop(self.__last_document_ids, target, block),
+                        self.__number_of_blocks - 1)
+
+        if block != self.__block:
+            self.__load_block(block)
+
+        self.__index = gallop(self.__document_ids, target, max(self.__index, 0))
+
+        if self.__index >= len(self.__document_ids):
+            # only happens in the last block
+            self.__load_block(self.__number_of_blocks)
+
+        return self.__update()
+
+    def __load_block(self, block):
+        self.__block = block
+        self.__index = 0
+
+        if block >= self.__number_of_blocks:
+            self.__document_ids = []
+            self.__term_frequencies = []
+            return
+
+        start = self.__block_offsets[block]
+        end = self.__block_offsets[block + 1]
+        numbers = decode_variable_byte(self.__data[start:end])
+
+        block_length = min(POSTINGS_BLOCK_SIZE,
+                           self.document_frequency - block * POSTINGS_BLOCK_SIZE)
+        base = self.__last_document_ids[block - 1] if block > 0 else 0
+
+        gaps = numbers[:block_length]
+        gaps[0] += base
+
+        self.__document_ids = list(accumulate(gaps))
+        self.__term_frequencies = numbers[block_length:]
+
+    def __update(self):
+        if self.__index >= len(self.__document_ids):
+            self.document_id = NO_MORE_DOCUMENTS
+            self.term_frequency = 0
+        else:
+            self.document_id = self.__document_ids[self.__index]
+            self.term_frequency = self.__term_frequencies[self.__index]
+
+        return self.document_id
@@ -1,6 +1,8 @@
 import re
 import Stemmer
+from collections import Counter, ChainMap
 from functools import partial
+from itertools import islice
 from nltk.stem import WordNetLemmatizer
 
 STEMMER = Stemmer.Stemmer('english')
@@ -9,6 +11,9 @@ HTML_TAG_PATTERN = re.compile(r'<.*?>')
 HTML_ENTITY_PATTERN = re.compile('&[a-zA-Z][-.a-zA-Z0-9]*[^a-zA-Z0-9]')
 SQUARE_BRACKET_TAG_PATTERN = re.compile(r'\[.*?\]')
 
+# maximum number of words a preprocessor remembers the term of, a few MB
+DEFAULT_CACHE_ENTRIES = 100000
+
 SPLIT_WORDS_PATTERN = re.compile(r'\s|\.|\:|\?|\(|\)|\[|\]|\{|\}|\<|\>|\'|\!|\"|\-|,|;|\$|\*|\%|#')
 
 # From https://www.textfixer.com/tutorials/common-english-words.txt via https://en.wikipedia.org/wiki/Stop_words
@@ -40,10 +45,12 @@ def create_preprocessor(enable_case_folding=True,
                         enable_remove_stop_words=True,
                         enable_stemmer=True,
                         enable_lemmatizer=False,
-                        min_length=2):
+                        min_length=2,
+                        cache_entries=DEFAULT_CACHE_ENTRIES):
 
     """Generates a preprocessing function configured to apply the specified
-    processing steps
+    processing steps. The function remembers the term of up to
+    cache_entries words, see Preprocessor
     """
     steps = []
 
@@ -60,39 +67,115 @@ def create_preprocessor(enable_case_folding=True,
         steps.append(__lemmatize)
 
     if min_length:
-        steps.append(lambda words: __remove_short_words(words, min_length))
+        steps.append(partial(__remove_short_words, min_length=min_length))
+
+    return Preprocessor(steps, cache_entries)
+
+
+class Preprocessor:
+    """Preprocessing function which memoizes the term of each word
+
+    Every step of the preprocessing works on a single word, so a word always
+    results in the same term (or in no term, e.g. for stop words). Due to
+    Zipf's law most words of a document have been seen before, their terms
+    are looked up instead of stemming and lemmatizing them again. The words
+    which are not known yet are preprocessed together, each distinct word
+    once per call and with a single stemWords call
+
+    The cache is shared by all documents and holds up to max_entries words.
+    Once it is full, further words are preprocessed but not remembered, the
+    frequent words usually occur early. counters holds the number of hits
+    and misses (words which were not cached yet, whether they are cached
+    afterwards or not), see stats
+    """
+
+    def __init__(self, steps, max_entries=DEFAULT_CACHE_ENTRIES):
+        self.steps = steps
+        self.max_entries = max_entries
+
+        self.counters = Counter()
+
+        # word -> term, None if the word is removed
+        self.__terms = {}
+
+    def __call__(self, words):
+        words = list(words)
+        terms = self.__terms
+        missing = list(set(words).difference(terms))
+        computed = {}
+
+        if missing:
+            computed = dict(zip(missing, normalize_words(missing, self.steps)))
+            free_entries = max(self.max_entries - len(terms), 0)
 
-    #def fn_preprocess(words):
-    #    for step in steps:
-    #        words = step(words)
-    #    return words
+            if len(computed) <= free_entries:
+                terms.update(computed)
+            else:
+                terms.update(islice(computed.items(), free_entries))
+                terms = ChainMap(computed, terms)
+
+        # every occurrence of a word which had to be preprocessed is a miss
+        misses = sum(map(computed.__contains__, words)) if computed else 0
+
+        self.counters['hits'] += len(words) - misses
+        self.counters['misses'] += misses
+
+        return [term for term in map(terms.__getitem__, words) if term is not None]
+
+    def stats(self):
+        """Returns the hit/miss counters along with the number of cached words
+        """
+        lookups = self.counters['hits'] + self.counters['misses']
+
+        return {'hits': self.counters['hits'],
+                'misses': self.counters['misses'],
+                'hit_ratio': self.counters['hits'] / lookups if lookups else 0,
+                'words': len(self.__terms)}
+
+
+def fn_preprocess(words, steps):
+    """Applies the given preprocessing steps without caching
+    """
+    return [term for term in normalize_words(list(words), steps) if term is not None]
+
+
+def normalize_words(words, steps):
+    """Applies the given preprocessing steps to a list of words, returns the
+    term of each word or None if a step removed the word
+
+    Each step gets the list of remaining words and returns the list of
+    their terms, None for removed words
+    """
+    terms = list(words)
 
-    return partial(fn_preprocess, steps=steps)
+    for step in steps:
+        if None not in terms:
+            terms = list(step(terms))
+            continue
 
+        indices = [i for i, term in enumerate(terms) if term is not None]
 
-def fn_preprocess(words,steps):
-    words = list(words)
+        for i, term in zip(indices, step([terms[i] for i in indices])):
+            terms[i] = term
 
-    for i, step in enumerate(steps):
-        words = list(step(words))
+    return terms
 
-    return words
 
 def __case_folding(words):
-    return map(lambda word: word.casefold(), words)
+    return [word.casefold() for word in words]
 
 
 def __remove_stop_words(words):
-    return filter(lambda word: word not in STOP_WORDS, words)
+    return [None if word in STOP_WORDS else word for word in words]
 
 
 def __stem(words):
-    return map(lambda word: STEMMER.stemWord(word), words)
+    return STEMMER.stemWords(words)
 
 
 def __lemmatize(words):
-    return map(lambda word: LEMMATIZER.lemmatize(word), words)
+    return [LEMMATIZER.lemmatize(word) for word in words]
 
 
 def __remove_short_words(words, min_length):
-    return filter(lambda word: len(word) >= min_length, words)
+    return [word if len(word) >= min_length else None for word in words]
@@ -0,0 +1,312 @@
+import heapq
+from collections import Counter
+
+from postings import open_cursor, NO_MORE_DOCUMENTS
+from searching import tfidf_score, bm25_score, rank_key, check_scoring_context, \
+    DEFAULT_TOP_K
+
+PRUNING_ALGORITHMS = ['wand', 'maxscore']
+PRUNING_RANKING_METHODS = ['tfidf', 'bm25']
+
+# upper bounds and scores are summed up in different orders, so documents are
+# only skipped if their upper bound is below the threshold by a small margin
+BOUND_TOLERANCE = 1e-9
+
+
+def top_k_search(number_of_documents, index, bounds, search_terms,
+                 ranking_method, document_stats=None, params={}, top_k=DEFAULT_TOP_K,
+                 algorithm='maxscore', counters=None, scoring_context=None):
+    """Returns the top_k documents for the given query using document-at-a-time
+    dynamic pruning (WAND or MaxScore) instead of scoring every posting
+
+    bounds are the per-term maximum term frequencies and minimum document
+    lengths of the index (see indexing.load_bounds), which provide upper
+    bound scores for each query term. Documents whose upper bound can not
+    beat the current k-th score are skipped. Only 'tfidf' and 'bm25' (with
+    0 <= b <= 1) are supported, the results are exactly the first top_k
+    results of the exhaustive search functions
+
+    If counters (a Counter) is given, the number of postings of the query
+    terms ('postings') and the number of scored postings ('scored_postings')
+    are added to it. The bm25 length normalization is taken from the
+    scoring context (see searching.create_scoring_context) if given
+    """
+    if ranking_method not in PRUNING_RANKING_METHODS:
+        raise ValueError('Dynamic pruning does not support {}'.format(ranking_method))
+
+    if algorithm not in PRUNING_ALGORITHMS:
+        raise ValueError('Unknown pruning algorithm "{}"'.format(algorithm))
+
+    if ranking_method == 'bm25':
+        check_scoring_context(scoring_context, ranking_method, params)
+
+    query_terms = __create_query_terms(number_of_documents, index, bounds,
+                                       search_terms, ranking_method,
+                                       document_stats, params, scoring_context)
+    top_documents = []
+    scored_postings = 0
+
+    if top_k > 0 and query_terms:
+        if algorithm == 'wand':
+            scored_postings = __wand(query_terms, top_documents, top_k)
+        else:
+            scored_postings = __max_score(query_terms, top_documents, top_k)
+
+    if counters is not None:
+        counters['postings'] += sum([query_term.cursor.document_frequency
+                                     for query_term in query_terms])
+        counters['scored_postings'] += scored_postings
+
+    document_scores = [(-negative_document_id, score)
+                       for score, negative_document_id in top_documents]
+    document_scores.sort(key=rank_key)
+    return document_scores
+
+
+class QueryTerm:
+    """Posting cursor of a query term along with its upper bound score and a
+    function which scores its postings
+    """
+
+    def __init__(self, order, cursor, upper_bound, score):
+        # position of the term in sorted order, scores are summed up in this
+        # order (like in the exhaustive search functions)
+        self.order = order
+        self.cursor = cursor
+        self.upper_bound = upper_bound
+        self.score = score
+
+
+def __create_query_terms(number_of_documents, index, bounds, search_terms,
+                         ranking_method, document_stats, params, scoring_context):
+    (max_term_frequencies, min_document_lengths) = bounds
+    search_term_counter = Counter(search_terms)
+
+    query_terms = []
+
+    for term in sorted(set(search_terms)):
+        token = index.get(term)
+
+        if token is None:
+            continue
+
+        dft = token.document_frequency
+        max_term_frequency = int(max_term_frequencies[token.position])
+
+        if ranking_method == 'tfidf':
+            score = __tfidf_scorer(number_of_documents, dft)
+            upper_bound = tfidf_score(number_of_documents, dft, max_term_frequency)
+        else:
+            score = __bm25_scorer(number_of_documents, dft,
+                                  search_term_counter[term], document_stats,
+                                  params['k1'], params['b'], params['k3'],
+                                  scoring_context)
+
+            length_ratio = (min_document_lengths[token.position] /
+                            document_stats.average_document_length)
+            B = ((1 - params['b']) + (params['b'] * length_ratio))
+
+            # terms which occur in more than half of all documents have
+            # negative scores
+            upper_bound = max(0, bm25_score(number_of_documents,
+                                            search_term_counter[term],
+                                            max_term_frequency, dft, B,
+                                            params['k1'], params['k3']))
+
+        query_terms.append(QueryTerm(len(query_terms), open_cursor(index, term),
+                                     upper_bound, score))
+
+    return query_terms
+
+
+def __tfidf_scorer(number_of_documents, document_frequency):
+    def score(document_id, tfd):
+        return tfidf_score(number_of_documents, document_frequency, tfd)
+
+    return score
+
+
+def __bm25_scorer(number_of_documents, dft, tfq, document_stats, k1, b, k3,
+                  scoring_context):
+    if scoring_context is not None:
+        normalization = scoring_context.normalization
+
+        def score(document_id, tfd):
+            return bm25_score(number_of_documents, tfq, tfd, dft,
+                              normalization[document_id], k1, k3)
+
+        return score
+
+    document_length_counter = document_stats.length
+    average_document_length = document_stats.average_document_length
+
+    def score(document_id, tfd):
+        document_length = document_length_counter[document_id]
+
+        length_ratio = (document_length / average_document_length)
+        Bd = ((1 - b) + (b * length_ratio))
+
+        return bm25_score(number_of_documents, tfq, tfd, dft, Bd, k1, k3)
+
+    return score
+
+
+def __wand(query_terms, top_documents, top_k):
+    """Weak AND: sorts the cursors by document id and only scores a
+    document once the upper bounds of the terms which can occur in it
+    exceed the threshold. Returns the number of scored postings
+    """
+    scored_postings = 0
+
+    for query_term in query_terms:
+        query_term.cursor.next()
+
+    active = [query_term for query_term in query_terms
+              if query_term.cursor.document_id != NO_MORE_DOCUMENTS]
+
+    while active:
+        active.sort(key=lambda query_term: query_term.cursor.document_id)
+        threshold = __threshold(top_documents, top_k)
+
+        pivot = None
+        upper_bound = 0
+
+        for i, query_term in enumerate(active):
+            upper_bound += query_term.upper_bound
+
+            if __can_enter(upper_bound, threshold):
+                pivot = i
+                break
+
+        if pivot is None:
+            break
+
+        pivot_document_id = active[pivot].cursor.document_id
+
+        if active[0].cursor.document_id == pivot_document_id:
+            matching = [query_term for query_term in active
+                        if query_term.cursor.document_id == pivot_document_id]
+
+            contributions = [(query_term.order,
+                              query_term.score(pivot_document_id,
+                                               query_term.cursor.term_frequency))
+                             for query_term in matching]
+            scored_postings += len(contributions)
+
+            __push(top_documents, top_k, pivot_document_id, contributions)
+
+            for query_term in matching:
+                query_term.cursor.next()
+        else:
+            # none of the documents before the pivot can enter the top k
+            for query_term in active[:pivot]:
+                query_term.cursor.advance(pivot_document_id)
+
+        active = [query_term for query_term in active
+                  if query_term.cursor.document_id != NO_MORE_DOCUMENTS]
+
+    return scored_postings
+
+
+def __max_score(query_terms, top_documents, top_k):
+    """MaxScore: terms are sorted by upper bound, the terms whose summed up
+    upper bounds can not beat the threshold are non-essential. Only
+    documents of the essential terms are candidates, non-essential terms
+    are looked up (via skipping) as long as the candidate can still enter
+    the top k. Returns the number of scored postings
+    """
+    scored_postings = 0
+
+    query_terms = sorted(query_terms, key=lambda query_term: query_term.upper_bound)
+
+    cumulative_upper_bounds = []
+    upper_bound = 0
+
+    for query_term in query_terms:
+        upper_bound += query_term.upper_bound
+        cumulative_upper_bounds.append(upper_bound)
+
+        query_term.cursor.next()
+
+    while True:
+        threshold = __threshold(top_documents, top_k)
+
+        number_of_non_essential = 0
+
+        while number_of_non_essential < len(query_terms) and \
+                not __can_enter(cumulative_upper_bounds[number_of_non_essential], threshold):
+            number_of_non_essential += 1
+
+        essential = query_terms[number_of_non_essential:]
+
+        if not essential:
+            break
+
+        document_id = min([query_term.cursor.document_id for query_term in essential])
+
+        if document_id == NO_MORE_DOCUMENTS:
+            break
+
+        contributions = []
+        partial_score = 0
+
+        for query_term in essential:
+            if query_term.cursor.document_id == document_id:
+                contribution = query_term.score(document_id, query_term.cursor.term_frequency)
+                contributions.append((query_term.order, contribution))
+                partial_score += contribution
+
+                query_term.cursor.next()
+
+        can_enter = True
+
+        for i in reversed(range(number_of_non_essential)):
+            if not __can_enter(partial_score + cumulative_upper_bounds[i], threshold):
+                can_enter = False
+                break
+
+            query_term = query_terms[i]
+
+            if query_term.cursor.advance(document_id) == document_id:
+                contribution = query_term.score(document_id, query_term.cursor.term_frequency)
+                contributions.append((query_term.order, contribution))
+                partial_score += contribution
+
+        scored_postings += len(contributions)
+
+        if can_enter:
+            __push(top_documents, top_k, document_id, contributions)
+
+    return scored_postings
+
+
+def __threshold(top_documents, top_k):
+    """Score a document has to beat to enter the top k
+    """
+    if len(top_documents) < top_k:
+        return float('-inf')
+
+    return top_documents[0][0]
+
+
+def __can_enter(upper_bound, threshold):
+    if threshold == float('-inf'):
+        return True
+
+    return upper_bound + BOUND_TOLERANCE * max(1, abs(threshold)) > threshold
+
+
+def __push(top_documents, top_k, document_id, contributions):
+    """Adds a document to the top k heap, which holds (score, -document_id)
+    tuples. Documents are processed in ascending document id order, so a
+    document with the same score as the k-th document ranks below it
+    """
+    score = 0
+
+    for _, contribution in sorted(contributions):
+        score += contribution
+
+    if len(top_documents) < top_k:
+        heapq.heappush(top_documents, (score, -document_id))
+    elif score > top_documents[0][0]:
+        heapq.heapreplace(top_documents, (score, -document_id))
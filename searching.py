@@ -1,10 +1,29 @@
 import math
+import heapq
+import numpy as np
 from collections import namedtuple, Counter
 
+from indexing import Token
+from postings import postings_arrays
+
 Document = namedtuple('Document', ['id', 'terms'])
 
+ScoringContext = namedtuple('ScoringContext', ['ranking_method', 'b', 'normalization',
+                                               'normalization_array'])
+
+# number of documents retrieved per topic in TREC runs
+DEFAULT_TOP_K = 1000
+
+# the last token list passed to create_lexicon, its length and its lexicon
+__last_lexicon = (None, 0, {})
+
+# parameters which only weight the query terms, precomputed impacts do not
+# depend on them
+QUERY_PARAMS = ['k3']
 
-def simple_tfidf_search(number_of_documents, index, search_terms):
+
+def simple_tfidf_search(number_of_documents, index, search_terms,
+                        top_k=DEFAULT_TOP_K):
     """Runs a simple tf-idf search through the index
 
     Optimization: Pre-calculate tf / idf score and store it in index
@@ -16,18 +35,20 @@ def simple_tfidf_search(number_of_documents, index, search_terms):
 
     for token in tokens:
         for document_id, tfd in token.postings:
-            document_scores[document_id] += __tfidf_score(number_of_documents,
-                                                          token.document_frequency,
-                                                          tfd)
-
-    document_scores = list(document_scores.items())
-    document_scores.sort(key=lambda ds: ds[1], reverse=True)
+            document_scores[document_id] += tfidf_score(number_of_documents,
+                                                        token.document_frequency,
+                                                        tfd)
 
-    return document_scores
+    return select_top_k(document_scores.items(), top_k)
 
 
-def cosine_tfidf_search(number_of_documents, index, search_terms):
+def cosine_tfidf_search(number_of_documents, index, search_terms,
+                        document_stats=None, top_k=DEFAULT_TOP_K):
     """Runs a cosine tf-idf search through the index
+
+    Document vectors are normalized by their norms over all terms, which
+    are stored in the document stats (see indexing.create_document_norms).
+    Without document stats, only the query terms make up the document norms
     """
     search_term_counter = Counter(search_terms)
 
@@ -41,37 +62,65 @@ def cosine_tfidf_search(number_of_documents, index, search_terms):
     for token in tokens:
         tfq = search_term_counter[token.term]
 
-        w_tq = __tfidf_score(number_of_documents, token.document_frequency,
-                             tfq)
+        w_tq = tfidf_score(number_of_documents, token.document_frequency,
+                           tfq)
         query_norm += w_tq * w_tq
 
-        for document_id, tfd in token.postings:
-            w_tf = __tfidf_score(number_of_documents, token.document_frequency,
-                                 tfd)
-            document_scores[document_id] += w_tq * w_tf
-            document_norms[document_id] += w_tf * w_tf
+        if document_stats is not None:
+            for document_id, tfd in token.postings:
+                w_tf = tfidf_score(number_of_documents, token.document_frequency,
+                                   tfd)
+                document_scores[document_id] += w_tq * w_tf
+        else:
+            for document_id, tfd in token.postings:
+                w_tf = tfidf_score(number_of_documents, token.document_frequency,
+                                   tfd)
+                document_scores[document_id] += w_tq * w_tf
+                document_norms[document_id] += w_tf * w_tf
 
     query_norm = math.sqrt(query_norm)
 
+    __normalize_cosine_scores(document_scores, query_norm, document_stats, document_norms)
+
+    return select_top_k(document_scores.items(), top_k)
+
+
+def __normalize_cosine_scores(document_scores, query_norm, document_stats=None,
+                            document_norms=None):
+    """Divides the given scores (a dict) by the query norm and the document
+    norms of the document stats, or if not available, by the square roots
+    of the given sums of squared query term weights
+    """
+    stored_norms = document_stats.norm if document_stats is not None else None
+
     for document_id in document_scores:
-        document_norm = math.sqrt(document_norms[document_id])
-        document_scores[document_id] /= (document_norm * query_norm)
+        if stored_norms is not None:
+            document_norm = float(stored_norms[document_id])
+        else:
+            document_norm = math.sqrt(document_norms[document_id])
 
-    document_scores = list(document_scores.items())
-    document_scores.sort(key=lambda ds: ds[1], reverse=True)
-    return document_scores
+        # documents which only contain terms of all documents
+        if document_norm > 0:
+            document_scores[document_id] /= (document_norm * query_norm)
 
 
 def simple_bm25_search(number_of_documents, index, search_terms,
-                       document_stats, k1=1.2, b=0.75, k3=100):
+                       document_stats, k1=1.2, b=0.75, k3=100,
+                       top_k=DEFAULT_TOP_K, scoring_context=None):
     """Runs a simple bm25 search through the index
+
+    If a scoring context (see create_scoring_context) is given, the length
+    normalization of the documents is looked up instead of computed
     """
+    check_scoring_context(scoring_context, 'bm25', {'b': b})
+    normalization = scoring_context.normalization if scoring_context else None
+
     tokens = __find_tokens_for_terms(index, search_terms)
 
     document_scores = Counter()
-    document_length_counter = document_stats['length']
+    document_length_counter = document_stats.length
 
-    average_document_length = __calculate_average_document_length(document_length_counter)
+    average_document_length = document_stats.average_document_length
 
     search_term_counter = Counter(search_terms)
 
@@ -80,32 +129,40 @@ def simple_bm25_search(number_of_documents, index, search_terms,
         dft = token.document_frequency
 
         for (document_id, tfd) in token.postings:
-            document_length = document_length_counter[document_id]
+            if normalization is not None:
+                Bd = normalization[document_id]
+            else:
+                document_length = document_length_counter[document_id]
 
-            length_ratio = (document_length / average_document_length)
-            Bd = ((1 - b) + (b * length_ratio))
+                length_ratio = (document_length / average_document_length)
+                Bd = ((1 - b) + (b * length_ratio))
 
-            document_scores[document_id] += __bm25_score(number_of_documents,
-                                                         tfq, tfd, dft,
-                                                         Bd, k1, k3)
+            document_scores[document_id] += bm25_score(number_of_documents,
+                                                       tfq, tfd, dft,
+                                                       Bd, k1, k3)
 
-    document_scores = list(document_scores.items())
-    document_scores.sort(key=lambda ds: ds[1], reverse=True)
-    return document_scores
+    return select_top_k(document_scores.items(), top_k)
 
 
 def simple_bm25va_search(number_of_documents, index, search_terms,
-                         document_stats, k1=1.2, k3=100):
+                         document_stats, k1=1.2, k3=100,
+                         top_k=DEFAULT_TOP_K, scoring_context=None):
     """Runs a simple bm25va search through the index
+
+    If a scoring context (see create_scoring_context) is given, the length
+    normalization of the documents is looked up instead of computed
     """
+    check_scoring_context(scoring_context, 'bm25va')
+    normalization = scoring_context.normalization if scoring_context else None
+
     tokens = __find_tokens_for_terms(index, search_terms)
 
     document_scores = Counter()
-    document_terms_counter = document_stats['terms']
-    document_length_counter = document_stats['length']
+    document_terms_counter = document_stats.terms
+    document_length_counter = document_stats.length
 
-    average_document_length = __calculate_average_document_length(document_length_counter)
-    mean_average_term_frequency = __calculate_mean_average_term_frequency(document_length_counter, document_terms_counter)
+    average_document_length = document_stats.average_document_length
+    mean_average_term_frequency = document_stats.mean_average_term_frequency
 
     search_term_counter = Counter(search_terms)
 
@@ -114,46 +171,271 @@ def simple_bm25va_search(number_of_documents, index, search_terms,
         dft = token.document_frequency
 
         for (document_id, tfd) in token.postings:
-            document_length = document_length_counter[document_id]
+            if normalization is not None:
+                Bva = normalization[document_id]
+            else:
+                document_length = document_length_counter[document_id]
 
-            length_ratio = (document_length / average_document_length)
-            Bva =  1 / (mean_average_term_frequency * mean_average_term_frequency)
-            Bva *= (document_length / document_terms_counter[document_id])
-            Bva += (1 - (1 / mean_average_term_frequency)) * length_ratio
+                length_ratio = (document_length / average_document_length)
+                Bva =  1 / (mean_average_term_frequency * mean_average_term_frequency)
+                Bva *= (document_length / document_terms_counter[document_id])
+                Bva += (1 - (1 / mean_average_term_frequency)) * length_ratio
+
+            document_scores[document_id] += bm25_score(number_of_documents,
+                                                       tfq, tfd, dft,
+                                                       Bva, k1, k3)
+
+    return select_top_k(document_scores.items(), top_k)
 
-            document_scores[document_id] += __bm25_score(number_of_documents,
-                                                         tfq, tfd, dft,
-                                                         Bva, k1, k3)
 
-    document_scores = list(document_scores.items())
-    document_scores.sort(key=lambda ds: ds[1], reverse=True)
-    return document_scores
+def batch_search(number_of_documents, index, document_stats, queries,
+                 ranking_method, params={}, top_k=DEFAULT_TOP_K,
+                 scoring_context=None):
+    """Runs a search for each of the given queries (collections of search
+    terms) and returns their results in the same order
+
+    The posting list of every term is looked up and decoded once for all
+    queries, its scores are computed once per distinct query term frequency
+    and added to every query which contains the term. The results are the
+    same as the ones of search
+    """
+    if ranking_method not in ['tfidf', 'cosine_tfidf', 'bm25', 'bm25va']:
+        raise ValueError('Unknown ranking method "{}"'.format(ranking_method))
+
+    lexicon = create_lexicon(index)
 
+    search_term_counters = [Counter(search_terms) for search_terms in queries]
+    term_queries = {}
 
-def __calculate_mean_average_term_frequency(document_length_counter,
-                                            document_terms_counter):
-    document_ids = list(document_length_counter.keys())
-    return sum([__calculate_average_term_frequency(document_id,
-                                                   document_length_counter,
-                                                   document_terms_counter) for document_id in document_ids]) / len(document_ids)
+    for query_id, search_term_counter in enumerate(search_term_counters):
+        for term in search_term_counter:
+            term_queries.setdefault(term, []).append(query_id)
 
+    document_scores = [Counter() for _ in queries]
+    document_norms = [Counter() for _ in queries]
+    query_norms = [0] * len(queries)
 
-def __calculate_average_term_frequency(document_id, document_length_counter,
-                                       document_terms_counter):
-    return document_length_counter[document_id] / document_terms_counter[document_id]
+    score = __posting_scorer(number_of_documents, document_stats,
+                             ranking_method, params, scoring_context)
 
+    # terms are processed in sorted order, so the scores of each query are
+    # summed up in the same order as in the single query search functions
+    for term in sorted(term_queries):
+        token = lexicon.get(term)
 
-def __calculate_average_document_length(document_length_counter):
-    lengths = list(document_length_counter.values())
-    return sum(lengths) / len(lengths)
+        if token is None:
+            continue
 
+        dft = token.document_frequency
+        postings = list(token.postings)
+        scored_postings = {}
+
+        for query_id in term_queries[term]:
+            tfq = search_term_counters[query_id][term]
+
+            if tfq not in scored_postings:
+                scored_postings[tfq] = [(document_id, score(tfq, dft, document_id, tfd))
+                                        for document_id, tfd in postings]
+
+            query_scores = document_scores[query_id]
+
+            if ranking_method == 'cosine_tfidf':
+                w_tq = tfidf_score(number_of_documents, dft, tfq)
+                query_norms[query_id] += w_tq * w_tq
+
+                query_document_norms = document_norms[query_id]
+
+                if document_stats is not None:
+                    for document_id, w_tf in scored_postings[tfq]:
+                        query_scores[document_id] += w_tq * w_tf
+                else:
+                    for document_id, w_tf in scored_postings[tfq]:
+                        query_scores[document_id] += w_tq * w_tf
+                        query_document_norms[document_id] += w_tf * w_tf
+            else:
+                for document_id, posting_score in scored_postings[tfq]:
+                    query_scores[document_id] += posting_score
+
+    if ranking_method == 'cosine_tfidf':
+        for query_scores, query_document_norms, query_norm in zip(document_scores,
+                                                                  document_norms,
+                                                                  query_norms):
+            __normalize_cosine_scores(query_scores, math.sqrt(query_norm),
+                                    document_stats, query_document_norms)
+
+    return [select_top_k(query_scores.items(), top_k)
+            for query_scores in document_scores]
+
+
+def impact_search(index, impacts, search_terms, ranking_method, params={},
+                  top_k=DEFAULT_TOP_K):
+    """Runs a search through an index with precomputed impacts (see
+    indexing.create_impacts). Instead of scoring every posting, the
+    quantized impacts of the matching postings are added up
+
+    Raises a ValueError if the impacts were not built for the given ranking
+    method and parameters
+    """
+    check_impacts(impacts, ranking_method, params)
+
+    tokens = __find_tokens_for_terms(index, search_terms)
+    search_term_counter = Counter(search_terms)
+
+    document_scores = Counter()
+
+    for token in tokens:
+        base = int(impacts.bases[token.position])
+        token_impacts = impacts.values[base:base + token.document_frequency].tolist()
+
+        if ranking_method == 'bm25':
+            # query term weight, 1 for terms which occur once in the query
+            k3 = params.get('k3', 100)
+            tfq = search_term_counter[token.term]
+            query_weight = ((k3+1)*tfq)/(k3+tfq)
+        else:
+            query_weight = 1
+
+        if query_weight == 1:
+            for (document_id, _), impact in zip(token.postings, token_impacts):
+                document_scores[document_id] += impact
+        else:
+            for (document_id, _), impact in zip(token.postings, token_impacts):
+                document_scores[document_id] += impact * query_weight
+
+    return select_top_k([(document_id, score / impacts.scale)
+                         for document_id, score in document_scores.items()], top_k)
+
+
+def check_impacts(impacts, ranking_method, params={}):
+    """Raises a ValueError if the given impacts were built for a different
+    ranking method or different parameters. Apart from the query term
+    weights (QUERY_PARAMS), the parameters have to be the ones of the
+    impacts, missing or additional ones are rejected
+    """
+    if impacts.scorer != ranking_method:
+        raise ValueError('Impacts were built for {}, not for {}'.format(
+            impacts.scorer, ranking_method))
+
+    check_scorer_params('Impacts', impacts.params, params)
+
+
+def check_scorer_params(description, scorer_params, params):
+    """Raises a ValueError if the given search parameters, apart from the
+    query term weights (QUERY_PARAMS), are not the scorer_params something
+    precomputed (described by description) was built for
+    """
+    document_params = {name: value for name, value in params.items()
+                       if name not in QUERY_PARAMS}
+
+    if set(document_params) != set(scorer_params):
+        raise ValueError('{} were built for the parameters {}, not for {}'.format(
+            description, sorted(scorer_params), sorted(document_params)))
+
+    for name, value in scorer_params.items():
+        if not math.isclose(document_params[name], value):
+            raise ValueError('{} were built for {}={}, not for {}={}'.format(
+                description, name, value, name, document_params[name]))
+
+
+def create_scoring_context(document_stats, ranking_method, params={}):
+    """Precomputes the length normalization of every document for bm25 (Bd,
+    for the given b) or bm25va (Bva), so that searches only do work per
+    posting. Create it once per index and ranking method and pass it to the
+    search functions. Returns None for the other ranking methods
+    """
+    if ranking_method not in ['bm25', 'bm25va']:
+        return None
+
+    lengths = document_stats.length.astype(np.float64)
+    length_ratio = lengths / document_stats.average_document_length
+
+    if ranking_method == 'bm25':
+        b = params['b']
+        normalization = (1 - b) + (b * length_ratio)
+    else:
+        b = None
+        mean_average_term_frequency = document_stats.mean_average_term_frequency
+
+        # documents without terms have no postings
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normalization = 1 / (mean_average_term_frequency * mean_average_term_frequency)
+            normalization = normalization * (lengths / document_stats.terms)
+            normalization += (1 - (1 / mean_average_term_frequency)) * length_ratio
+
+    return ScoringContext(ranking_method, b, normalization.tolist(), normalization)
+
+
+def check_scoring_context(scoring_context, ranking_method, params={}):
+    """Raises a ValueError if the given scoring context was created for a
+    different ranking method or a different b
+    """
+    if scoring_context is None:
+        return
 
-def __tfidf_score(number_of_documents, document_frequency, term_frequency):
+    if scoring_context.ranking_method != ranking_method:
+        raise ValueError('Scoring context was created for {}, not for {}'.format(
+            scoring_context.ranking_method, ranking_method))
+
+    if ranking_method == 'bm25' and scoring_context.b != params['b']:
+        raise ValueError('Scoring context was created for b={}, not for b={}'.format(
+            scoring_context.b, params['b']))
+
+
+def rank_key(document_score):
+    """Sort key which orders (document_id, score) tuples by descending score,
+    ties are broken by ascending document id
+    """
+    return (-document_score[1], document_score[0])
+
+
+def select_top_k(document_scores, top_k=DEFAULT_TOP_K):
+    """Returns the top_k (all if None) of the given (document_id, score)
+    tuples ordered by rank_key. Uses heap-based partial selection instead of
+    sorting all documents
+    """
+    if top_k is None:
+        return sorted(document_scores, key=rank_key)
+
+    return heapq.nsmallest(top_k, document_scores, key=rank_key)
+
+
+def search(number_of_documents, index, document_stats, search_terms,
+           ranking_method, params={}, top_k=DEFAULT_TOP_K, scoring_context=None):
+    """Runs a search using the given ranking method ('tfidf', 'cosine_tfidf',
+    'bm25' or 'bm25va') and its parameters. The scoring context (see
+    create_scoring_context) is used by bm25 and bm25va
+    """
+    if ranking_method == 'tfidf':
+        return simple_tfidf_search(number_of_documents, index, search_terms,
+                                   top_k=top_k)
+    elif ranking_method == 'cosine_tfidf':
+        return cosine_tfidf_search(number_of_documents, index, search_terms,
+                                   document_stats, top_k=top_k)
+    elif ranking_method == 'bm25':
+        return simple_bm25_search(number_of_documents, index,
+                                  search_terms, document_stats,
+                                  k1=params['k1'],
+                                  b=params['b'],
+                                  k3=params['k3'],
+                                  top_k=top_k,
+                                  scoring_context=scoring_context)
+    elif ranking_method == 'bm25va':
+        return simple_bm25va_search(number_of_documents, index,
+                                    search_terms, document_stats,
+                                    k1=params['k1'],
+                                    k3=params['k3'],
+                                    top_k=top_k,
+                                    scoring_context=scoring_context)
+
+    raise ValueError('Unknown ranking method "{}"'.format(ranking_method))
+
+
+def tfidf_score(number_of_documents, document_frequency, term_frequency):
     idf = math.log(number_of_documents / document_frequency)
     return math.log(1 + term_frequency) * idf
 
 
-def __bm25_score(number_of_documents, tfq, tfd, dft, B, k1, k3):
+def bm25_score(number_of_documents, tfq, tfd, dft, B, k1, k3):
     K = k1 * B
 
     bm25 = ((k3+1)*tfq)/(k3+tfq)
@@ -163,22 +445,121 @@ def __bm25_score(number_of_documents, tfq, tfd, dft, B, k1, k3):
     return bm25
 
 
-def __find_tokens_for_terms(index, search_terms):
-    """Returns matching token objects for the given terms
+def create_lexicon(index):
+    """Returns a lexicon (an object providing get(term)) for the given index
+
+    Indexes opened via indexing.open_index already provide lookups, for
+    in-memory indexes (lists of tokens) a hash map from term to token is
+    created. The hash map of the last token list is kept, so searching the
+    same list again does not build it for every query. Token lists must
+    not be changed in place once they have been searched
+    """
+    global __last_lexicon
+
+    if hasattr(index, 'get'):
+        return index
+
+    (last_index, last_length, lexicon) = __last_lexicon
+
+    if index is not last_index or len(index) != last_length:
+        lexicon = {token.term: token for token in index}
+        __last_lexicon = (index, len(index), lexicon)
+
+    return lexicon
+
+
+def create_filtered_lexicon(index, search_terms, document_filter):
+    """Returns an in-memory lexicon of the given search terms whose posting
+    lists only hold the documents accepted by document_filter, a function
+    which maps an array of document ids to a boolean array (like
+    bitmaps.RoaringBitmap.contains)
+
+    Document frequencies stay the ones of the index, so searching the
+    lexicon scores only the accepted documents, with the same scores as
+    searching the whole index
+    """
+    lexicon = create_lexicon(index)
+    filtered_lexicon = {}
+
+    for term in set(search_terms):
+        token = lexicon.get(term)
+
+        if token is None:
+            continue
+
+        (document_ids, term_frequencies) = postings_arrays(token.postings)
+        accepted = document_filter(document_ids)
+
+        postings = list(zip(document_ids[accepted].tolist(),
+                            term_frequencies[accepted].tolist()))
+        filtered_lexicon[term] = Token(token.position, term, token.document_frequency,
+                                       postings)
+
+    return filtered_lexicon
+
+
+def __posting_scorer(number_of_documents, document_stats, ranking_method, params,
+                     scoring_context=None):
+    """Returns a function which scores a single posting of a term for the
+    given ranking method, the same way as the search functions. For
+    cosine_tfidf this is the tf-idf weight of the posting
     """
-    search_tokens = []
-    needles = set(search_terms)
+    if ranking_method in ['tfidf', 'cosine_tfidf']:
+        def score(tfq, dft, document_id, tfd):
+            return tfidf_score(number_of_documents, dft, tfd)
+
+        return score
+
+    document_terms_counter = document_stats.terms
+    document_length_counter = document_stats.length
+
+    average_document_length = document_stats.average_document_length
+    mean_average_term_frequency = document_stats.mean_average_term_frequency
+
+    k1 = params['k1']
+    k3 = params['k3']
+
+    check_scoring_context(scoring_context, ranking_method, params)
+
+    if scoring_context is not None:
+        normalization = scoring_context.normalization
+
+        def score(tfq, dft, document_id, tfd):
+            return bm25_score(number_of_documents, tfq, tfd, dft,
+                              normalization[document_id], k1, k3)
+
+        return score
+
+    if ranking_method == 'bm25':
+        b = params['b']
 
-    for token in index:
-        for needle in needles:
-            if needle == token.term:
-                search_tokens.append(token)
+        def score(tfq, dft, document_id, tfd):
+            document_length = document_length_counter[document_id]
+
+            length_ratio = (document_length / average_document_length)
+            Bd = ((1 - b) + (b * length_ratio))
+
+            return bm25_score(number_of_documents, tfq, tfd, dft, Bd, k1, k3)
+
+        return score
+
+    def score(tfq, dft, document_id, tfd):
+        document_length = document_length_counter[document_id]
 
-                remaining_needles = list(needles)
-                remaining_needles.remove(needle)
-                needles = remaining_needles
+        length_ratio = (document_length / average_document_length)
+        Bva =  1 / (mean_average_term_frequency * mean_average_term_frequency)
+        Bva *= (document_length / document_terms_counter[document_id])
+        Bva += (1 - (1 / mean_average_term_frequency)) * length_ratio
 
-            if not needles:
-                break
+        return bm25_score(number_of_documents, tfq, tfd, dft, Bva, k1, k3)
+
+    return score
+
+
+def __find_tokens_for_terms(index, search_terms):
+    """Returns matching token objects for the given terms
+    """
+    lexicon = create_lexicon(index)
 
-    return search_tokens
+    tokens = [lexicon.get(term) for term in sorted(set(search_terms))]
+    return [token for token in tokens if token is not None]
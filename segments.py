@@ -0,0 +1,418 @@
+import os
+import json
+import math
+import heapq
+import numpy as np
+from collections import Counter
+
+from indexing import create_index_spimi, open_index, open_docnos, load_document_stats, \
+    merge_indexes, write_document_stats_counters, write_docnos, create_document_norms, \
+    create_bounds, IndexWriter, INDEX_FORMAT_VERSION, DOCNOS_SUFFIX, LEXICON_SUFFIX, \
+    BOUNDS_SUFFIX, DOCUMENT_NORMS_DTYPE
+from searching import search, rank_key, DEFAULT_TOP_K
+from sharding import GlobalStatsLexicon, ShardedDocnos
+
+MANIFEST_FILENAME = 'segments.json'
+INDEX_SUFFIX = '.index'
+STATS_SUFFIX = '.stats'
+DELETED_SUFFIX = '.deleted'
+
+
+def create_segments(directory):
+    """Creates an empty segmented index in the given directory
+
+    A segmented index consists of a manifest ('segments.json') and any
+    number of segments. Each segment is a regular index
+    ('<segment>.index', with lexicon and docnos), its document stats
+    ('<segment>.stats') and a bitmap of deleted document ids
+    ('<segment>.deleted', one bit per document id). The manifest lists the
+    live segments in the order they were created and is replaced atomically
+    whenever segments are added, merged or documents are deleted
+    """
+    if os.path.exists(os.path.join(directory, MANIFEST_FILENAME)):
+        raise ValueError('{} already contains a segmented index'.format(directory))
+
+    os.makedirs(directory, exist_ok=True)
+    __write_manifest(directory, {'version': INDEX_FORMAT_VERSION,
+                                 'next_segment': 0,
+                                 'segments': []})
+
+
+def add_segment(directory, document_files, preprocess, verbose=True,
+                max_tokens_per_block=10000000,
+                strip_html_tags=True,
+                strip_html_entities=True,
+                strip_square_bracket_tags=True):
+    """Indexes the given document files (using the SPIMI method) into a new
+    segment and adds it to the segmented index. Returns the segment's name
+    """
+    manifest = read_manifest(directory)
+
+    name = 'segment_{:06d}'.format(manifest['next_segment'])
+    index_filepath = os.path.join(directory, name + INDEX_SUFFIX)
+
+    create_index_spimi(document_files, preprocess, index_filepath,
+                       os.path.join(directory, name + STATS_SUFFIX),
+                       verbose=verbose,
+                       max_tokens_per_block=max_tokens_per_block,
+                       strip_html_tags=strip_html_tags,
+                       strip_html_entities=strip_html_entities,
+                       strip_square_bracket_tags=strip_square_bracket_tags)
+
+    (number_of_documents, index) = open_index(index_filepath)
+    index.close()
+
+    docnos = open_docnos(index_filepath)
+    number_of_ids = len(docnos)
+    docnos.close()
+
+    __write_deleted(directory, name, np.zeros(number_of_ids, dtype=bool))
+
+    manifest['next_segment'] += 1
+    manifest['segments'].append({'name': name,
+                                 'number_of_documents': number_of_documents,
+                                 'number_of_ids': number_of_ids,
+                                 'number_of_deleted': 0})
+    __write_manifest(directory, manifest)
+
+    return name
+
+
+def delete_documents(directory, docnos):
+    """Marks the documents with the given document numbers as deleted.
+    Returns the number of deleted documents
+
+    Deleted documents are excluded from search results immediately, their
+    postings (and their contribution to the collection stats) are only
+    removed when their segment is merged
+    """
+    manifest = read_manifest(directory)
+    docnos = set(docnos)
+    number_of_deleted = 0
+
+    for segment in manifest['segments']:
+        deleted = load_deleted(directory, segment)
+        docno_table = open_docnos(os.path.join(directory, segment['name'] + INDEX_SUFFIX))
+
+        newly_deleted = [document_id for document_id in range(len(docno_table))
+                         if not deleted[document_id] and docno_table[document_id] in docnos]
+        docno_table.close()
+
+        if newly_deleted:
+            deleted = deleted.copy()
+            deleted[newly_deleted] = True
+
+            __write_deleted(directory, segment['name'], deleted)
+            segment['number_of_deleted'] += len(newly_deleted)
+            number_of_deleted += len(newly_deleted)
+
+    __write_manifest(directory, manifest)
+    return number_of_deleted
+
+
+def merge_segments(directory, merge_factor=10, max_deleted_ratio=0.3, verbose=True):
+    """Applies a logarithmic merge policy to the segmented index and returns
+    the number of merges
+
+    Segments are assigned to levels by size (level = floor(log(number of
+    live documents) / log(merge_factor))). Whenever merge_factor adjacent
+    segments share a level, they are merged into a single segment of the
+    next level, which bounds the number of segments to about merge_factor
+    per level. Segments in which more than max_deleted_ratio of the
+    documents are deleted are rewritten to reclaim the space
+    """
+    number_of_merges = 0
+
+    while True:
+        manifest = read_manifest(directory)
+        merge = __find_merge(manifest['segments'], merge_factor, max_deleted_ratio)
+
+        if merge is None:
+            return number_of_merges
+
+        (start, end) = merge
+
+        if verbose:
+            print('Merging {}'.format(', '.join(
+                [segment['name'] for segment in manifest['segments'][start:end]])))
+
+        __merge(directory, manifest, start, end)
+        number_of_merges += 1
+
+
+def load_deleted(directory, segment):
+    """Returns the deleted documents bitmap of the given segment as boolean
+    array indexed by document id
+    """
+    with open(os.path.join(directory, segment['name'] + DELETED_SUFFIX), 'rb') as f:
+        bits = np.frombuffer(f.read(), dtype=np.uint8)
+
+    return np.unpackbits(bits)[:segment['number_of_ids']].astype(bool)
+
+
+class SegmentedIndex:
+    """Searches all live segments of a segmented index
+
+    Global document ids are assigned by concatenating the document ids of
+    the segments (in manifest order), they are only valid until the
+    segments change. Document frequencies, collection stats and the
+    document norms of cosine tf-idf are aggregated over all segments,
+    deleted documents count towards them until they are merged away
+    """
+
+    def __init__(self, directory):
+        manifest = read_manifest(directory)
+
+        self.directory = directory
+        self.segments = manifest['segments']
+
+        self.__indexes = []
+        self.__document_stats = []
+        self.__deleted = []
+        self.__first_document_ids = []
+
+        number_of_ids = 0
+        total_length = 0
+        sum_of_average_term_frequencies = 0
+
+        for segment in self.segments:
+            index_filepath = os.path.join(directory, segment['name'] + INDEX_SUFFIX)
+            document_stats = load_document_stats(
+                os.path.join(directory, segment['name'] + STATS_SUFFIX))
+
+            self.__indexes.append(open_index(index_filepath)[1])
+            self.__document_stats.append(document_stats)
+            self.__deleted.append(load_deleted(directory, segment))
+            self.__first_document_ids.append(number_of_ids)
+
+            number_of_ids += segment['number_of_ids']
+            total_length += document_stats.total_length
+            sum_of_average_term_frequencies += document_stats.mean_average_term_frequency * \
+                document_stats.number_of_documents
+
+        self.number_of_documents = sum([segment['number_of_documents']
+                                        for segment in self.segments])
+        self.average_document_length = total_length / number_of_ids if number_of_ids else 0
+        self.mean_average_term_frequency = sum_of_average_term_frequencies / number_of_ids \
+            if number_of_ids else 0
+
+        self.docnos = ShardedDocnos(self.__first_document_ids,
+                                    [open_docnos(index.filepath) for index in self.__indexes])
+
+        # norms of the documents of every segment, see __global_norms
+        self.__norms = None
+
+    def search(self, search_terms, ranking_method, params={}, top_k=DEFAULT_TOP_K):
+        """Runs the search on all segments and returns the merged results as
+        (global document id, score) tuples, see searching.search
+        """
+        search_terms = list(search_terms)
+        document_frequencies = {}
+
+        for term in set(search_terms):
+            tokens = [index.get(term) for index in self.__indexes]
+            document_frequency = sum([token.document_frequency for token
+                                      in tokens if token is not None])
+
+            if document_frequency:
+                document_frequencies[term] = document_frequency
+
+        results = []
+        norms = self.__global_norms() if ranking_method == 'cosine_tfidf' else \
+            [document_stats.norm for document_stats in self.__document_stats]
+
+        for segment, index, document_stats, segment_norms, deleted, first_document_id in zip(
+                self.segments, self.__indexes, self.__document_stats, norms, self.__deleted,
+                self.__first_document_ids):
+            lexicon = GlobalStatsLexicon(index, document_frequencies)
+            document_stats = document_stats._replace(
+                average_document_length=self.average_document_length,
+                mean_average_term_frequency=self.mean_average_term_frequency,
+                norm=segment_norms)
+
+            # deleted documents are removed after the selection
+            segment_top_k = None if top_k is None else top_k + segment['number_of_deleted']
+
+            document_scores = search(self.number_of_documents, lexicon, document_stats,
+                                     search_terms, ranking_method, params,
+                                     top_k=segment_top_k)
+
+            results.append([(first_document_id + document_id, score)
+                            for document_id, score in document_scores
+                            if not deleted[document_id]][:top_k])
+
+        return list(heapq.merge(*results, key=rank_key))[:top_k]
+
+    def close(self):
+        for index in self.__indexes:
+            index.close()
+
+        self.docnos.close()
+
+    def __global_norms(self):
+        """Returns the tf-idf vector norms of the documents of every segment.
+        The norms stored with a segment use its own document frequencies,
+        these use the ones of all segments, like the norms of a single index
+        (see indexing.create_document_norms). They are computed in a pass
+        over all postings on the first cosine search
+        """
+        if self.__norms is None:
+            document_frequencies = Counter()
+
+            for index in self.__indexes:
+                for token in index:
+                    document_frequencies[token.term] += token.document_frequency
+
+            norms = []
+
+            for index, document_stats in zip(self.__indexes, self.__document_stats):
+                segment_norms = np.zeros(len(document_stats.length), dtype=DOCUMENT_NORMS_DTYPE)
+
+                for token in index:
+                    (document_ids, term_frequencies) = token.postings.arrays()
+
+                    idf = math.log(self.number_of_documents / document_frequencies[token.term])
+                    weights = np.log(1 + term_frequencies) * idf
+
+                    segment_norms[document_ids] += weights * weights
+
+                norms.append(np.sqrt(segment_norms))
+
+            self.__norms = norms
+
+        return self.__norms
+
+
+def read_manifest(directory):
+    """Returns the manifest of the segmented index in the given directory
+    """
+    with open(os.path.join(directory, MANIFEST_FILENAME)) as f:
+        manifest = json.load(f)
+
+    if manifest['version'] != INDEX_FORMAT_VERSION:
+        raise ValueError('{} is not a version {} segmented index'.format(
+            directory, INDEX_FORMAT_VERSION))
+
+    return manifest
+
+
+def __write_manifest(directory, manifest):
+    """Replaces the manifest atomically, readers either see the old or the
+    new list of segments
+    """
+    filepath = os.path.join(directory, MANIFEST_FILENAME)
+
+    with open(filepath + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(filepath + '.tmp', filepath)
+
+
+def __write_deleted(directory, name, deleted):
+    filepath = os.path.join(directory, name + DELETED_SUFFIX)
+
+    with open(filepath + '.tmp', 'wb') as f:
+        f.write(np.packbits(deleted).tobytes())
+
+    os.replace(filepath + '.tmp', filepath)
+
+
+def __level(segment, merge_factor):
+    """Returns floor(log(number of live documents) / log(merge_factor)),
+    computed with integers since the floating point quotient is rounded
+    down at exact powers (log(1000) / log(10) < 3)
+    """
+    live_documents = segment['number_of_ids'] - segment['number_of_deleted']
+    level = 0
+
+    while live_documents >= merge_factor:
+        live_documents //= merge_factor
+        level += 1
+
+    return level
+
+
+def __find_merge(segments, merge_factor, max_deleted_ratio):
+    """Returns the range of segments to merge next or None
+    """
+    levels = [__level(segment, merge_factor) for segment in segments]
+
+    for start in range(len(segments) - merge_factor + 1):
+        if len(set(levels[start:start + merge_factor])) == 1:
+            return (start, start + merge_factor)
+
+    for i, segment in enumerate(segments):
+        if segment['number_of_ids'] and \
+                segment['number_of_deleted'] / segment['number_of_ids'] > max_deleted_ratio:
+            return (i, i + 1)
+
+    return None
+
+
+def __merge(directory, manifest, start, end):
+    """Merges the segments [start, end) into a new segment which replaces
+    them in the manifest. Deleted documents are dropped
+    """
+    segments = manifest['segments'][start:end]
+
+    name = 'segment_{:06d}'.format(manifest['next_segment'])
+    index_filepath = os.path.join(directory, name + INDEX_SUFFIX)
+
+    indexes = []
+    document_id_maps = []
+    docnos = []
+    number_of_documents = 0
+
+    for segment in segments:
+        segment_filepath = os.path.join(directory, segment['name'] + INDEX_SUFFIX)
+        deleted = load_deleted(directory, segment)
+
+        (segment_number_of_documents, index) = open_index(segment_filepath)
+        indexes.append(index)
+
+        # live documents keep their order and are numbered consecutively
+        document_id_map = np.full(segment['number_of_ids'], -1, dtype=np.int64)
+        live_document_ids = np.flatnonzero(~deleted)
+        document_id_map[live_document_ids] = \
+            len(docnos) + np.arange(len(live_document_ids), dtype=np.int64)
+        document_id_maps.append(document_id_map)
+
+        docno_table = open_docnos(segment_filepath)
+        docnos += [docno_table[int(document_id)] for document_id in live_document_ids]
+        docno_table.close()
+
+        number_of_documents += segment_number_of_documents - segment['number_of_deleted']
+
+    with IndexWriter(index_filepath, number_of_documents) as index_writer:
+        (document_terms_counter, document_length_counter) = \
+            merge_indexes(index_writer, indexes, document_id_maps)
+
+    for index in indexes:
+        index.close()
+
+    write_docnos(index_filepath + DOCNOS_SUFFIX, docnos)
+    write_document_stats_counters(os.path.join(directory, name + STATS_SUFFIX),
+                                  document_terms_counter, document_length_counter,
+                                  len(docnos))
+    create_document_norms(index_filepath, os.path.join(directory, name + STATS_SUFFIX))
+    create_bounds(index_filepath, os.path.join(directory, name + STATS_SUFFIX))
+    __write_deleted(directory, name, np.zeros(len(docnos), dtype=bool))
+
+    manifest['next_segment'] += 1
+    manifest['segments'][start:end] = [{'name': name,
+                                        'number_of_documents': number_of_documents,
+                                        'number_of_ids': len(docnos),
+                                        'number_of_deleted': 0}]
+    __write_manifest(directory, manifest)
+
+    # readers which still use the old segments keep their memory maps
+    for segment in segments:
+        for suffix in [INDEX_SUFFIX, INDEX_SUFFIX + LEXICON_SUFFIX,
+                       INDEX_SUFFIX + DOCNOS_SUFFIX, INDEX_SUFFIX + BOUNDS_SUFFIX,
+                       STATS_SUFFIX, DELETED_SUFFIX]:
+            filepath = os.path.join(directory, segment['name'] + suffix)
+
+            if os.path.exists(filepath):
+                os.remove(filepath)
@@ -0,0 +1,434 @@
+import os
+import json
+import socket
+import threading
+import http.client
+import socketserver
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from preprocessing import split_words
+from indexing import open_index, open_docnos, open_impact_order, load_document_stats, \
+    load_impacts, IMPACTS_SUFFIX, IMPACT_ORDER_SUFFIX
+from searching import search, create_lexicon, create_scoring_context, DEFAULT_TOP_K
+from anytime import anytime_search
+from caching import cached_search, search_version, PostingCache, \
+    frequent_query_terms, highest_document_frequency_terms
+
+RANKING_METHODS = ['tfidf', 'cosine_tfidf', 'bm25', 'bm25va']
+DEFAULT_PARAMS = {'tfidf': {}, 'cosine_tfidf': {},
+                  'bm25': {'k1': 1.2, 'b': 0.75, 'k3': 8.0},
+                  'bm25va': {'k1': 1.2, 'k3': 8.0}}
+
+# number of pending connections, socketserver only queues 5 by default
+REQUEST_QUEUE_SIZE = 128
+
+IndexGeneration = namedtuple('IndexGeneration', ['version', 'index_file', 'stats_file',
+                                                 'number_of_documents', 'index',
+                                                 'document_stats', 'docnos',
+                                                 'files_version', 'scoring_contexts',
+                                                 'impacts', 'impact_order'])
+
+
+class SearchService:
+    """Keeps an index, its document stats and the preprocessor resident and
+    answers search requests
+
+    The loaded index is an immutable generation. reload() loads a new
+    generation next to the current one and swaps it in atomically, requests
+    which are in progress finish on the generation they started with. The
+    files of the old generation are closed once the last request using
+    them is done, so a rebuilt index has to be written to new files (or
+    moved over the old ones via os.replace, as the index builders do)
+    instead of overwriting them
+
+    If the index has impact ordered postings (see cmd_index.py
+    --impact_order), requests with a postings budget or a deadline are
+    answered by an anytime search (see anytime.py)
+
+    If a caching.ResultCache is given, results are cached per index
+    generation. With posting_cache_bytes, each generation keeps the decoded
+    posting lists of frequent terms in a caching.PostingCache, which is
+    prewarmed with the terms of prewarm_queries (preprocessed queries of a
+    query log) and the prewarm_top_terms terms with the highest document
+    frequencies
+    """
+
+    def __init__(self, index_file, stats_file, preprocess,
+                 strip_html_tags=True,
+                 strip_html_entities=True,
+                 strip_square_bracket_tags=True,
+                 cache=None,
+                 posting_cache_bytes=None,
+                 prewarm_queries=[],
+                 prewarm_top_terms=0):
+        self.preprocess = preprocess
+        self.cache = cache
+        self.posting_cache_bytes = posting_cache_bytes
+        self.prewarm_queries = prewarm_queries
+        self.prewarm_top_terms = prewarm_top_terms
+        self.strip_html_tags = strip_html_tags
+        self.strip_html_entities = strip_html_entities
+        self.strip_square_bracket_tags = strip_square_bracket_tags
+
+        self.__lock = threading.Lock()
+        self.__generation = None
+
+        # requests in progress per generation version, and replaced
+        # generations which are closed once their last request is done
+        self.__users_lock = threading.Lock()
+        self.__users = {}
+        self.__retired = {}
+        self.reload(index_file, stats_file)
+
+    @property
+    def generation(self):
+        return self.__generation
+
+    def reload(self, index_file=None, stats_file=None):
+        """Loads the given index (by default the current one again) and swaps
+        it in. Returns the new index version
+        """
+        with self.__lock:
+            current = self.__generation
+
+            index_file = index_file or current.index_file
+            stats_file = stats_file or current.stats_file
+            version = current.version + 1 if current else 1
+
+            number_of_documents, index = open_index(index_file)
+            document_stats = load_document_stats(stats_file)
+
+            (impacts, impact_order) = (None, None)
+
+            if os.path.exists(index_file + IMPACTS_SUFFIX) and \
+                    os.path.exists(index_file + IMPACT_ORDER_SUFFIX):
+                impacts = load_impacts(index_file)
+                impact_order = open_impact_order(index_file)
+
+            if self.posting_cache_bytes:
+                index = PostingCache(index, self.posting_cache_bytes)
+                index.prewarm(frequent_query_terms(self.prewarm_queries) +
+                              highest_document_frequency_terms(index.index,
+                                                               self.prewarm_top_terms))
+
+            generation = IndexGeneration(version, index_file, stats_file,
+                                         number_of_documents,
+                                         create_lexicon(index),
+                                         document_stats,
+                                         open_docnos(index_file),
+                                         search_version(index, document_stats),
+                                         {}, impacts, impact_order)
+
+            with self.__users_lock:
+                self.__generation = generation
+
+                if current is not None:
+                    if self.__users.get(current.version):
+                        self.__retired[current.version] = current
+                    else:
+                        self.__close(current)
+
+            return version
+
+    def search(self, request):
+        """Answers a search request, a dict with
+        * 'query' (text, which is preprocessed) or 'terms' (a list of
+          preprocessed terms)
+        * 'method' (tfidf, cosine_tfidf, bm25 or bm25va)
+        * 'params' (k1, b and k3 for bm25, k1 and k3 for bm25va, optional)
+        * 'top_k' (optional, defaults to 1000, null for all documents)
+        * 'max_postings' and/or 'deadline_ms' (optional, for indexes with
+          impact ordered postings), the postings budget and the time limit
+          of an anytime search of the impacts' ranking method
+
+        Returns a dict with the index version and the results, a list of
+        [docno, score] pairs. Anytime searches additionally return whether
+        they terminated early and the number of processed postings
+        """
+        generation = self.__acquire()
+
+        try:
+            return self.__search(generation, request)
+        finally:
+            self.__release(generation)
+
+    def __search(self, generation, request):
+        ranking_method = request.get('method', 'bm25')
+
+        if ranking_method not in RANKING_METHODS:
+            raise ValueError('Unknown ranking method "{}"'.format(ranking_method))
+
+        params = dict(DEFAULT_PARAMS[ranking_method])
+        params.update(request.get('params', {}))
+
+        if 'terms' in request:
+            search_terms = request['terms']
+
+            # a string would be searched as its characters
+            if not isinstance(search_terms, list) or \
+                    not all(isinstance(term, str) for term in search_terms):
+                raise ValueError('"terms" has to be a list of strings')
+        elif 'query' in request:
+            search_terms = self.preprocess(split_words(
+                request['query'],
+                strip_html_tags=self.strip_html_tags,
+                strip_html_entities=self.strip_html_entities,
+                strip_square_bracket_tags=self.strip_square_bracket_tags))
+        else:
+            raise ValueError('Missing "query" or "terms"')
+
+        top_k = request.get('top_k', DEFAULT_TOP_K)
+
+        if 'max_postings' in request or 'deadline_ms' in request:
+            if generation.impact_order is None:
+                raise ValueError('The index has no impact ordered postings')
+
+            result = anytime_search(generation.number_of_documents, generation.index,
+                                    generation.impacts, generation.impact_order,
+                                    search_terms, ranking_method, params, top_k=top_k,
+                                    max_postings=request.get('max_postings'),
+                                    deadline_ms=request.get('deadline_ms'))
+
+            return {'version': generation.version,
+                    'results': [[generation.docnos[document_id], score]
+                                for document_id, score in result.document_scores],
+                    'terminated_early': result.terminated_early,
+                    'processed_postings': result.processed_postings}
+
+        scoring_context = self.__scoring_context(generation, ranking_method, params)
+
+        if self.cache is not None:
+            document_scores = cached_search(self.cache, generation.number_of_documents,
+                                            generation.index, generation.document_stats,
+                                            search_terms, ranking_method, params,
+                                            top_k=top_k, version=generation.files_version,
+                                            scoring_context=scoring_context)
+        else:
+            document_scores = search(generation.number_of_documents, generation.index,
+                                     generation.document_stats, search_terms,
+                                     ranking_method, params, top_k=top_k,
+                                     scoring_context=scoring_context)
+
+        return {'version': generation.version,
+                'results': [[generation.docnos[document_id], score]
+                            for document_id, score in document_scores]}
+
+    def status(self):
+        generation = self.__generation
+
+        status = {'version': generation.version,
+                  'index_file': generation.index_file,
+                  'stats_file': generation.stats_file,
+                  'number_of_documents': generation.number_of_documents}
+
+        if self.cache is not None:
+            status['cache'] = self.cache.stats()
+
+        if isinstance(generation.index, PostingCache):
+            status['posting_cache'] = generation.index.stats()
+
+        return status
+
+    def __acquire(self):
+        """Returns the current generation, which stays open until it is
+        released
+        """
+        with self.__users_lock:
+            generation = self.__generation
+            self.__users[generation.version] = self.__users.get(generation.version, 0) + 1
+            return generation
+
+    def __release(self, generation):
+        with self.__users_lock:
+            self.__users[generation.version] -= 1
+
+            if self.__users[generation.version] == 0:
+                del self.__users[generation.version]
+
+                if generation.version in self.__retired:
+                    self.__close(self.__retired.pop(generation.version))
+
+    @staticmethod
+    def __close(generation):
+        """Closes the files of a generation which is no longer used. The
+        document stats and impacts are numpy arrays on top of their mappings,
+        which are unmapped once the generation is garbage collected
+        """
+        generation.index.close()
+        generation.docnos.close()
+
+        if generation.impact_order is not None:
+            generation.impact_order.close()
+
+        generation.scoring_contexts.clear()
+
+    @staticmethod
+    def __scoring_context(generation, ranking_method, params):
+        """Returns the scoring context of the generation for the given ranking
+        method and b, it is created on first use
+        """
+        key = (ranking_method, params.get('b') if ranking_method == 'bm25' else None)
+
+        if key not in generation.scoring_contexts:
+            generation.scoring_contexts[key] = create_scoring_context(
+                generation.document_stats, ranking_method, params)
+
+        return generation.scoring_contexts[key]
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    """Serves a SearchService over HTTP
+
+    POST /search  - search request as json body, see SearchService.search
+    POST /reload  - optional json body with 'index_file' and 'stats_file'
+    GET  /status  - version and files of the loaded index, cache stats
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.__respond(200, self.server.service.status())
+        else:
+            self.__respond(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+
+            if not isinstance(request, dict):
+                raise ValueError('The request body has to be a json object')
+
+            if self.path == '/search':
+                self.__respond(200, self.server.service.search(request))
+            elif self.path == '/reload':
+                version = self.server.service.reload(request.get('index_file'),
+                                                     request.get('stats_file'))
+                self.__respond(200, {'version': version})
+            else:
+                self.__respond(404, {'error': 'Not found'})
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            self.__respond(400, {'error': str(e)})
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def __respond(self, status, response):
+        body = json.dumps(response).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class SearchHTTPServer(ThreadingHTTPServer):
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+
+class UnixSearchHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+
+def create_server(service, host='127.0.0.1', port=8080, unix_socket=None,
+                  verbose=False):
+    """Creates a threaded HTTP server for the given service, listening on
+    the given UNIX socket or else on host and port. Each request is handled
+    in its own thread
+    """
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+        server = UnixSearchHTTPServer(unix_socket, SearchRequestHandler)
+    else:
+        server = SearchHTTPServer((host, port), SearchRequestHandler)
+
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+class SearchClient:
+    """Client for a search server, address is either 'http://host:port' or
+    'unix:/path/to/socket'
+    """
+
+    def __init__(self, address, timeout=60):
+        self.address = address
+        self.timeout = timeout
+
+    def search(self, search_terms, ranking_method, params={}, top_k=DEFAULT_TOP_K):
+        """Searches the given (preprocessed) terms and returns a list of
+        (docno, score) tuples
+        """
+        response = self.__request('POST', '/search', {'terms': list(search_terms),
+                                                      'method': ranking_method,
+                                                      'params': params,
+                                                      'top_k': top_k})
+        return [(docno, score) for docno, score in response['results']]
+
+    def query(self, query, ranking_method, params={}, top_k=DEFAULT_TOP_K):
+        """Searches the given query text, which is preprocessed by the server
+        """
+        response = self.__request('POST', '/search', {'query': query,
+                                                      'method': ranking_method,
+                                                      'params': params,
+                                                      'top_k': top_k})
+        return [(docno, score) for docno, score in response['results']]
+
+    def reload(self, index_file=None, stats_file=None):
+        return self.__request('POST', '/reload', {'index_file': index_file,
+                                                  'stats_file': stats_file})['version']
+
+    def status(self):
+        return self.__request('GET', '/status')
+
+    def __request(self, method, path, request=None):
+        connection = self.__connect()
+
+        try:
+            body = json.dumps(request).encode('utf-8') if request is not None else None
+            connection.request(method, path, body=body,
+                               headers={'Content-Type': 'application/json'})
+
+            response = connection.getresponse()
+            result = json.loads(response.read().decode('utf-8'))
+
+            if response.status != 200:
+                raise ValueError(result.get('error', 'Request failed'))
+
+            return result
+        finally:
+            connection.close()
+
+    def __connect(self):
+        if self.address.startswith('unix:'):
+            return UnixHTTPConnection(self.address[len('unix:'):], timeout=self.timeout)
+
+        url = urlparse(self.address)
+        return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=self.timeout)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a UNIX socket
+    """
+
+    def __init__(self, socket_path, timeout=60):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
@@ -0,0 +1,294 @@
+import os
+import glob
+import json
+import heapq
+from bisect import bisect_right
+from pathos.multiprocessing import ProcessingPool
+
+from indexing import open_index, open_docnos, load_document_stats, file_version, \
+    write_document_stats, write_docnos, create_bounds, IndexWriter, Token, DOCNOS_SUFFIX
+from searching import search, rank_key, DEFAULT_TOP_K
+
+SHARDS_SUFFIX = '.shards'
+SHARDS_FORMAT_VERSION = 1
+
+# shards opened by the current (worker) process, by index file path: the
+# versions of the shard's index and stats files, the index and the stats
+__open_shards = {}
+
+
+def create_shards(index_filepath, document_stats_path, number_of_shards):
+    """Splits the given index into number_of_shards document-partitioned
+    shards of (almost) equal size and writes a manifest to
+    '<index file>.shards'
+
+    Shard i contains the documents with ids [first_document_id,
+    first_document_id + number_of_ids) and consists of an index
+    ('<index file>.shard<i>', with lexicon and docnos) and document stats
+    ('<index file>.shard<i>.stats'), using shard local document ids. The
+    manifest stores the document ranges of the shards and the global
+    collection stats, which are needed to score shards exactly like the
+    whole index
+
+    The shards are cut out of the complete index, so building them needs
+    the whole index first
+    """
+    remove_shards(index_filepath)
+
+    number_of_documents, index = open_index(index_filepath)
+    document_stats = load_document_stats(document_stats_path)
+    docnos = open_docnos(index_filepath)
+
+    number_of_ids = len(docnos)
+    number_of_shards = max(1, min(number_of_shards, number_of_ids))
+    bases = [(i * number_of_ids) // number_of_shards for i in range(number_of_shards + 1)]
+
+    shards = []
+    index_writers = []
+
+    for i in range(number_of_shards):
+        shard_filepath = '{}.shard{}'.format(index_filepath, i)
+        shards.append({
+            'index_file': os.path.basename(shard_filepath),
+            'stats_file': os.path.basename(shard_filepath) + '.stats',
+            'first_document_id': bases[i],
+            'number_of_ids': bases[i + 1] - bases[i]
+        })
+        index_writers.append(IndexWriter(shard_filepath, bases[i + 1] - bases[i]))
+
+    for token in index:
+        shard_postings = [[] for _ in range(number_of_shards)]
+
+        for document_id, term_frequency in token.postings:
+            shard = bisect_right(bases, document_id) - 1
+            shard_postings[shard].append((document_id - bases[shard], term_frequency))
+
+        for index_writer, postings_list in zip(index_writers, shard_postings):
+            if postings_list:
+                index_writer.write(token.term, postings_list)
+
+    directory = os.path.dirname(index_filepath)
+
+    for i, (index_writer, shard) in enumerate(zip(index_writers, shards)):
+        index_writer.close()
+
+        start = bases[i]
+        end = bases[i + 1]
+
+        write_docnos(os.path.join(directory, shard['index_file']) + DOCNOS_SUFFIX,
+                     [docnos[document_id] for document_id in range(start, end)])
+        write_document_stats(os.path.join(directory, shard['stats_file']),
+                             document_stats.length[start:end],
+                             document_stats.terms[start:end],
+                             document_stats.norm[start:end])
+        create_bounds(os.path.join(directory, shard['index_file']),
+                      os.path.join(directory, shard['stats_file']))
+
+    with open(index_filepath + SHARDS_SUFFIX + '.tmp', 'w') as f:
+        json.dump({
+            'version': SHARDS_FORMAT_VERSION,
+            'number_of_documents': number_of_documents,
+            'average_document_length': document_stats.average_document_length,
+            'mean_average_term_frequency': document_stats.mean_average_term_frequency,
+            'shards': shards
+        }, f, indent=2)
+
+    os.replace(index_filepath + SHARDS_SUFFIX + '.tmp', index_filepath + SHARDS_SUFFIX)
+
+    index.close()
+    docnos.close()
+
+
+def remove_shards(index_filepath):
+    """Removes the manifest and the files of all shards of the given index,
+    if it was split before
+    """
+    for filepath in glob.glob(glob.escape(index_filepath) + '.shard*'):
+        os.remove(filepath)
+
+
+def search_shard(shard_filepath, stats_filepath, first_document_id,
+                 document_frequencies, collection_stats, search_terms,
+                 ranking_method, params, top_k):
+    """Searches a single shard using global document frequencies and
+    collection stats and returns the top_k (all if None) results with global
+    document ids. Runs in the worker processes of ShardedIndex
+    """
+    version = (file_version(shard_filepath), file_version(stats_filepath))
+
+    if shard_filepath in __open_shards and __open_shards[shard_filepath][0] != version:
+        # the shards have been rebuilt since they were opened
+        close_shards([shard_filepath])
+
+    if shard_filepath not in __open_shards:
+        (_, index) = open_index(shard_filepath)
+        __open_shards[shard_filepath] = (version, index, load_document_stats(stats_filepath))
+
+    (_, index, document_stats) = __open_shards[shard_filepath]
+
+    lexicon = GlobalStatsLexicon(index, document_frequencies)
+    document_stats = document_stats._replace(
+        average_document_length=collection_stats['average_document_length'],
+        mean_average_term_frequency=collection_stats['mean_average_term_frequency'])
+
+    document_scores = search(collection_stats['number_of_documents'], lexicon,
+                             document_stats, search_terms, ranking_method, params,
+                             top_k=top_k)
+
+    return [(first_document_id + document_id, score)
+            for document_id, score in document_scores]
+
+
+def close_shards(shard_filepaths):
+    """Closes the given shards if the current process has opened them, see
+    search_shard
+    """
+    for shard_filepath in shard_filepaths:
+        if shard_filepath in __open_shards:
+            (_, index, _) = __open_shards.pop(shard_filepath)
+            index.close()
+
+
+class GlobalStatsLexicon:
+    """Lexicon of a shard which reports global document frequencies instead
+    of the shard local ones. Terms which only occur in other shards are
+    returned with an empty posting list
+    """
+
+    def __init__(self, index, document_frequencies):
+        self.__index = index
+        self.__document_frequencies = document_frequencies
+
+    def get(self, term, default=None):
+        if term not in self.__document_frequencies:
+            return default
+
+        token = self.__index.get(term)
+
+        # terms of other shards still contribute to query weights (cosine)
+        if token is None:
+            return Token(-1, term, self.__document_frequencies[term], [])
+
+        return token._replace(document_frequency=self.__document_frequencies[term])
+
+
+class ShardedDocnos:
+    """Maps global document ids to the document numbers stored in the shards
+    """
+
+    def __init__(self, first_document_ids, docno_tables):
+        self.__first_document_ids = first_document_ids
+        self.__docno_tables = docno_tables
+
+    def close(self):
+        for docno_table in self.__docno_tables:
+            docno_table.close()
+
+    def __getitem__(self, document_id):
+        shard = bisect_right(self.__first_document_ids, document_id) - 1
+
+        if shard < 0:
+            raise IndexError('Document id {} out of range'.format(document_id))
+
+        return self.__docno_tables[shard][document_id - self.__first_document_ids[shard]]
+
+    def __len__(self):
+        return sum([len(docno_table) for docno_table in self.__docno_tables])
+
+
+class ShardedIndex:
+    """Search coordinator for an index which was split using create_shards
+
+    Queries are sent to all shards in parallel (one process per shard), the
+    per-shard results are merged. Document frequencies of the query terms
+    are summed up over all shards and sent along with the query, so the
+    scores are identical to the ones of the unsplit index
+    """
+
+    def __init__(self, index_filepath, num_nodes=None):
+        with open(index_filepath + SHARDS_SUFFIX) as f:
+            manifest = json.load(f)
+
+        if manifest['version'] != SHARDS_FORMAT_VERSION:
+            raise ValueError('{} is not a version {} shard manifest'.format(
+                index_filepath + SHARDS_SUFFIX, SHARDS_FORMAT_VERSION))
+
+        directory = os.path.dirname(index_filepath)
+
+        self.number_of_documents = manifest['number_of_documents']
+        self.collection_stats = {
+            'number_of_documents': manifest['number_of_documents'],
+            'average_document_length': manifest['average_document_length'],
+            'mean_average_term_frequency': manifest['mean_average_term_frequency']
+        }
+
+        self.__shard_filepaths = [os.path.join(directory, shard['index_file'])
+                                  for shard in manifest['shards']]
+        self.__stats_filepaths = [os.path.join(directory, shard['stats_file'])
+                                  for shard in manifest['shards']]
+        self.__first_document_ids = [shard['first_document_id']
+                                     for shard in manifest['shards']]
+
+        self.__indexes = [open_index(filepath)[1] for filepath in self.__shard_filepaths]
+        self.docnos = ShardedDocnos(self.__first_document_ids,
+                                    [open_docnos(filepath) for filepath
+                                     in self.__shard_filepaths])
+
+        self.__pool = ProcessingPool(nodes=num_nodes or len(self.__indexes))
+
+    def document_frequencies(self, search_terms):
+        """Returns the global document frequency of each of the given terms
+        which is part of the index
+        """
+        document_frequencies = {}
+
+        for term in set(search_terms):
+            tokens = [index.get(term) for index in self.__indexes]
+            document_frequency = sum([token.document_frequency for token
+                                      in tokens if token is not None])
+
+            if document_frequency:
+                document_frequencies[term] = document_frequency
+
+        return document_frequencies
+
+    def search(self, search_terms, ranking_method, params={}, top_k=DEFAULT_TOP_K):
+        """Runs the search on all shards and returns the merged results as
+        (global document id, score) tuples, see searching.search
+        """
+        number_of_shards = len(self.__indexes)
+        search_terms = list(search_terms)
+
+        results = self.__pool.map(search_shard,
+                                  self.__shard_filepaths,
+                                  self.__stats_filepaths,
+                                  self.__first_document_ids,
+                                  [self.document_frequencies(search_terms)] * number_of_shards,
+                                  [self.collection_stats] * number_of_shards,
+                                  [search_terms] * number_of_shards,
+                                  [ranking_method] * number_of_shards,
+                                  [params] * number_of_shards,
+                                  [top_k] * number_of_shards)
+
+        document_scores = list(heapq.merge(*results, key=rank_key))
+
+        if top_k is not None:
+            document_scores = document_scores[:top_k]
+
+        return document_scores
+
+    def close(self):
+        """Closes the shards. The worker processes are terminated, which
+        drops the shards they have opened
+        """
+        for index in self.__indexes:
+            index.close()
+
+        self.docnos.close()
+
+        # shards searched in this process
+        close_shards(self.__shard_filepaths)
+
+        self.__pool.close()
+        self.__pool.join()
+        self.__pool.clear()
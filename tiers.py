@@ -0,0 +1,91 @@
+import numpy as np
+
+from bitmaps import RoaringBitmap
+from postings import postings_arrays
+from searching import search, create_lexicon, create_filtered_lexicon, check_scorer_params, \
+    DEFAULT_TOP_K
+
+# scorer of the champion lists which suits each ranking method
+CHAMPION_SCORERS = {'tfidf': 'tfidf', 'cosine_tfidf': 'tfidf', 'bm25': 'bm25'}
+
+
+def check_champions(champions, ranking_method, params={}):
+    """Raises a ValueError if the given champion lists (see
+    indexing.open_champions) were selected by a scorer which does not suit
+    the ranking method or with different parameters, see
+    searching.check_impacts
+    """
+    if CHAMPION_SCORERS.get(ranking_method) != champions.scorer:
+        raise ValueError('Champion lists were built for {}, not for {}'.format(
+            champions.scorer, ranking_method))
+
+    check_scorer_params('Champion lists', champions.params, params)
+
+
+def tiered_lexicon(index, champions, search_terms, min_candidates, counters=None):
+    """Returns the lexicon to search the given terms with, using the champion
+    lists of the index (see indexing.open_champions) as first tier
+
+    The candidates are the documents of the champion lists of the search
+    terms. If there are at least min_candidates of them, the returned
+    lexicon only holds the postings of the candidates, which therefore get
+    the scores of a search of the whole index while all other documents are
+    skipped. Otherwise the search falls back to the second tier, the
+    remaining postings, so the whole index is returned
+
+    counters (a collections.Counter) optionally collects the number of
+    candidates and of fallbacks
+    """
+    lexicon = create_lexicon(index)
+    champion_lexicon = create_lexicon(champions.index)
+
+    document_ids = []
+
+    for term in set(search_terms):
+        token = lexicon.get(term)
+
+        if token is None:
+            continue
+
+        champion_token = champion_lexicon.get(term)
+        postings = champion_token.postings if champion_token is not None else token.postings
+
+        document_ids.append(postings_arrays(postings)[0])
+
+    candidates = np.unique(np.concatenate(document_ids)) if document_ids \
+        else np.zeros(0, dtype=np.int64)
+
+    if counters is not None:
+        counters['queries'] += 1
+        counters['candidates'] += len(candidates)
+
+    if len(candidates) < min_candidates:
+        if counters is not None:
+            counters['fallbacks'] += 1
+
+        return lexicon
+
+    return create_filtered_lexicon(lexicon, search_terms,
+                                   RoaringBitmap.from_sorted(candidates).contains)
+
+
+def tiered_search(number_of_documents, index, champions, document_stats, search_terms,
+                  ranking_method, params={}, top_k=DEFAULT_TOP_K, min_candidates=None,
+                  scoring_context=None, counters=None):
+    """Ranks the documents of the champion lists of the search terms, see
+    tiered_lexicon and searching.search. Falls back to searching the whole
+    index if they hold less than min_candidates (by default top_k)
+    documents. A search for all documents (top_k None) always falls back
+
+    Raises a ValueError if the champion lists were not built for the given
+    ranking method and parameters, see check_champions
+    """
+    check_champions(champions, ranking_method, params)
+
+    if min_candidates is None:
+        min_candidates = top_k if top_k is not None else float('inf')
+
+    lexicon = tiered_lexicon(index, champions, search_terms, min_candidates, counters)
+
+    return search(number_of_documents, lexicon, document_stats, search_terms,
+                  ranking_method, params, top_k=top_k, scoring_context=scoring_context)
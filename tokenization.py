@@ -16,9 +16,11 @@ def generate_tokens_for_files(filepaths, encoding='latin-1',
                               strip_html_tags=True,
                               strip_html_entities=True,
                               strip_square_bracket_tags=True,
-                              preprocess=create_preprocessor()):
+                              preprocess=create_preprocessor(),
+                              with_positions=False):
     """Generator which provides a list of (doc_id, term) pairs for documents
-    contained in the given files
+    contained in the given files. With positions, the position of the term
+    within the document's (preprocessed) terms is appended
     """
 
     num_documents_processed = 0
@@ -42,8 +44,12 @@ def generate_tokens_for_files(filepaths, encoding='latin-1',
 
             terms = preprocess(words)
 
-            for term in terms:
-                yield (doc_id, term, num_documents_processed)
+            if with_positions:
+                for position, term in enumerate(terms):
+                    yield (doc_id, term, num_documents_processed, position)
+            else:
+                for term in terms:
+                    yield (doc_id, term, num_documents_processed)
 
 
 def generate_tokens_for_files_distributed(filepaths, encoding='latin-1',
@@ -51,12 +57,18 @@ def generate_tokens_for_files_distributed(filepaths, encoding='latin-1',
                               strip_html_tags=True,
                               strip_html_entities=True,
                               strip_square_bracket_tags=True,
-                              preprocess=create_preprocessor()):
-    """Generator which provides a list of (doc_id, term) pairs for documents
-    contained in the given files
+                              preprocess=create_preprocessor(),
+                              split_id=0,
+                              with_positions=False):
+    """Writes (term, split_id, document_id) triples for documents contained
+    in the given files to the partition segment files. Document ids are
+    dense integers in order of appearance within the split, the
+    corresponding document numbers are written to the split's docnos file.
+    With positions, the position of the term within the document's
+    (preprocessed) terms is appended
     """
 
-    num_documents_processed = 0
+    docnos = []
     segment_path = "./segmented_files/"
     partitions = ["aa", "bc", "de", "fh", "ij", "km", "nq", "rs", "tu", "vz"]
     segments = []
@@ -73,7 +85,6 @@ def generate_tokens_for_files_distributed(filepaths, encoding='latin-1',
             documents = __xml_parse_documents_from_file(filepath)
 
         for document in documents:
-            num_documents_processed += 1
             (doc_id, content) = document
             words = split_words(content,
                                 strip_html_tags=strip_html_tags,
@@ -82,19 +93,31 @@ def generate_tokens_for_files_distributed(filepaths, encoding='latin-1',
 
             terms = preprocess(words)
 
-            for term in terms:
+            if not terms:
+                continue
+
+            docnos.append(doc_id)
+            posting = "{} {}".format(split_id, len(docnos) - 1)
+
+            for position, term in enumerate(terms):
                 c = term[0]
+                entry = term + " " + posting
+
+                if with_positions:
+                    entry += " " + str(position)
+
                 for index, partition in enumerate(partitions):
                     if index == segments.__len__() - 1:
-                        segments[index].append(term + " " + doc_id)
+                        segments[index].append(entry)
                         break
                     else:
                         if c <= partition[1]:
-                            segments[index].append(term + " " + doc_id)
+                            segments[index].append(entry)
                             break
 
-    with open(segment_path + "meta_" + process_id().__str__(), "a") as file:
-        file.write("{}\n".format(num_documents_processed))
+    with open(segment_path + "docnos_" + str(split_id), "w") as file:
+        for docno in docnos:
+            file.write(docno + "\n")
 
     for index, segment in enumerate(segments):
         #write tokenized documents to file